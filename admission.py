@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from collections import Counter, deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional
+
+
+# 數字越小越優先：通話中的即時評分可以插隊到批次回補前面
+PRIORITY_CLASSES = {"live": 0, "batch": 1}
+
+
+class Overloaded(Exception):
+    """佇列已滿或趕不上 deadline；由 app 轉成 429 / 503 + Retry-After。"""
+
+    def __init__(self, status_code: int, reason: str, retry_after_s: float):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after_s = retry_after_s
+
+
+class AdmissionController:
+    """
+    有上限的排隊 + 併發上限。
+
+    - 併發數未滿且沒人排隊時直接放行
+    - 佇列已滿 -> 429
+    - 依目前排在前面的數量與平均處理時間估計等待時間，超過 deadline 直接 503 (fail fast)
+    - 排隊中超過 deadline -> 503
+    - 名額釋放時交給優先權最高 (數字最小)、最早來的等待者
+
+    參數:
+    max_concurrency (int): 同時在處理的請求上限
+    max_queue (int): 最多排隊幾筆
+    default_deadline_s (float): 請求沒指定 deadline 時的預設值
+    """
+
+    def __init__(self, max_concurrency: int, max_queue: int, default_deadline_s: float):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.default_deadline_s = default_deadline_s
+
+        self._heap: list = []
+        self._seq = itertools.count()
+        self.inflight = 0
+        self.queued = 0
+        self._queued_by_prio: Counter = Counter()
+
+        self._service_ewma: Optional[float] = None
+        self._waits: deque = deque(maxlen=2048)
+        self.admitted = 0
+        self.shed: Counter = Counter()
+
+    def estimated_wait(self, priority: int) -> float:
+        if self._service_ewma is None:
+            return 0.0
+        ahead = sum(n for p, n in self._queued_by_prio.items() if p <= priority)
+        return (ahead + 1) / self.max_concurrency * self._service_ewma
+
+    def _retry_after(self) -> float:
+        return max(1.0, math.ceil(self.estimated_wait(max(PRIORITY_CLASSES.values()))))
+
+    async def acquire(self, priority: int, deadline_s: Optional[float] = None) -> float:
+        """取得一個名額，回傳排隊等待的秒數。"""
+        deadline_s = self.default_deadline_s if deadline_s is None else deadline_s
+        start = time.monotonic()
+
+        if self.inflight < self.max_concurrency and self.queued == 0:
+            self.inflight += 1
+            self._admit(0.0)
+            return 0.0
+
+        if self.queued >= self.max_queue:
+            self.shed["queue_full"] += 1
+            raise Overloaded(429, "queue full", self._retry_after())
+        if self.estimated_wait(priority) > deadline_s:
+            self.shed["deadline_unmeetable"] += 1
+            raise Overloaded(503, "deadline cannot be met", self._retry_after())
+
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (priority, next(self._seq), fut))
+        self.queued += 1
+        self._queued_by_prio[priority] += 1
+        try:
+            await asyncio.wait_for(fut, timeout=deadline_s)
+        except BaseException as e:
+            if fut.done() and not fut.cancelled():
+                # 逾時 / 取消的同時剛好拿到名額，把名額還回去
+                self.release()
+            else:
+                fut.cancel()
+                self.queued -= 1
+                self._queued_by_prio[priority] -= 1
+            if isinstance(e, asyncio.TimeoutError):
+                self.shed["deadline_expired"] += 1
+                raise Overloaded(503, "deadline expired in queue", self._retry_after()) from None
+            raise
+
+        waited = time.monotonic() - start
+        self._admit(waited)
+        return waited
+
+    def _admit(self, waited: float) -> None:
+        self.admitted += 1
+        self._waits.append(waited)
+
+    def release(self, service_s: Optional[float] = None) -> None:
+        if service_s is not None:
+            a = 0.1
+            self._service_ewma = (
+                service_s if self._service_ewma is None
+                else (1 - a) * self._service_ewma + a * service_s
+            )
+        while self._heap:
+            priority, _, fut = heapq.heappop(self._heap)
+            if fut.cancelled():
+                continue
+            # 名額直接轉給下一位，inflight 不變
+            self.queued -= 1
+            self._queued_by_prio[priority] -= 1
+            fut.set_result(None)
+            return
+        self.inflight -= 1
+
+    @asynccontextmanager
+    async def slot(self, priority: int, deadline_s: Optional[float] = None) -> AsyncIterator[float]:
+        waited = await self.acquire(priority, deadline_s)
+        start = time.monotonic()
+        try:
+            yield waited
+        finally:
+            self.release(time.monotonic() - start)
+
+    def stats(self) -> Dict[str, Any]:
+        waits = sorted(self._waits)
+
+        def pct(q: float) -> float:
+            return waits[min(len(waits) - 1, int(q * len(waits)))] if waits else 0.0
+
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "inflight": self.inflight,
+            "queue_depth": self.queued,
+            "queue_depth_by_priority": {
+                name: self._queued_by_prio[p] for name, p in PRIORITY_CLASSES.items()
+            },
+            "admitted": self.admitted,
+            "shed": dict(self.shed),
+            "wait_s": {"p50": pct(0.50), "p95": pct(0.95), "p99": pct(0.99), "max": waits[-1] if waits else 0.0},
+            "service_s_ewma": self._service_ewma,
+        }
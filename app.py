@@ -1,94 +1,898 @@
 from __future__ import annotations
 
+import asyncio
+import json
+import logging
+import os
+import time
 from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Literal, Optional
 
 import httpx
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
 from pydantic import BaseModel
-from fastapi.responses import PlainTextResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 
+from admission import PRIORITY_CLASSES, AdmissionController, Overloaded
+from backend_pool import BackendPool
+from batching import MicroBatcher
+from cascade import CascadeRouter, Tier
+from confidence import calibrate, fraud_probability
+from fast_path import FastPath
+from metrics import (
+    CHAR_BUCKETS,
+    TOKEN_BUCKETS,
+    Registry,
+    SampledLogger,
+    Timer,
+    gauge_lines,
+    histogram_from_counts,
+    setup_logging,
+)
+from model_profiles import ModelProfile, get_profile
+from prompts import get_prompt
+from shadow import ShadowScorer
+from streaming import SessionStore, StreamSession
+from token_length import CHARS_PER_TOKEN, DEFAULT_TOKENIZER, TokenCounter, conversation_budget, fit
+from verdict_cache import VerdictCache
+from windowing import RULES as WINDOW_RULES, combine, split_windows
+
+
+VLLM_URL = os.getenv("VLLM_URL", "http://vllm:8000/v1/chat/completions")
+MODEL_NAME = os.getenv("MODEL_NAME", "scam-8b-sft")
+VLLM_MAX_CONCURRENCY = int(os.getenv("VLLM_MAX_CONCURRENCY", "256"))
+VLLM_TIMEOUT_S = float(os.getenv("VLLM_TIMEOUT_S", "180"))
+
+# 多個 vLLM replica (逗號分隔的完整網址)，沒設就只用 VLLM_URL；
+# 依進行中請求數最少分派，連續失敗 VLLM_EJECT_AFTER 次暫時移出，/health 恢復後放回
+VLLM_URLS = [u.strip() for u in os.getenv("VLLM_URLS", VLLM_URL).split(",") if u.strip()]
+VLLM_POOL_CONNECTIONS = int(os.getenv("VLLM_POOL_CONNECTIONS", "64"))  # 每個 replica
+VLLM_MAX_RETRIES = int(os.getenv("VLLM_MAX_RETRIES", "1"))
+VLLM_EJECT_AFTER = int(os.getenv("VLLM_EJECT_AFTER", "3"))
+VLLM_HEALTH_INTERVAL_S = float(os.getenv("VLLM_HEALTH_INTERVAL_S", "10"))
+
+# 兩階段 cascade：fraud_prob 落在 [ESCALATE_LOW, ESCALATE_HIGH] 或對話超過 ESCALATE_LONG_CHARS
+# 才送到第二個 (較大的) 模型；ESCALATE_URL 留空代表關閉，多個 replica 以逗號分隔。
+# 第二階段超過 ESCALATE_TIMEOUT_S (含排隊) 或失敗時沿用第一階段的結果。
+ESCALATE_URL = os.getenv("ESCALATE_URL", "")
+ESCALATE_MODEL = os.getenv("ESCALATE_MODEL", "base-70b-awq")
+ESCALATE_MAX_CONCURRENCY = int(os.getenv("ESCALATE_MAX_CONCURRENCY", "8"))
+ESCALATE_TIMEOUT_S = float(os.getenv("ESCALATE_TIMEOUT_S", "5"))
+ESCALATE_LOW = float(os.getenv("ESCALATE_LOW", "0.2"))
+ESCALATE_HIGH = float(os.getenv("ESCALATE_HIGH", "0.8"))
+ESCALATE_LONG_CHARS = int(os.getenv("ESCALATE_LONG_CHARS", "0"))
+
+# Shadow mode (shadow.py)：抽樣 SHADOW_SAMPLE_RATE 的線上請求，在回應之後另外送給同一組 vLLM 上的候選 adapter
+# (docker-compose.yml 以 SHADOW_ADAPTERS=cand-a=<ckpt> 讓 vllm 多載入候選 adapter)，結果寫到 SHADOW_LOG_DIR 給 evaluation.py 算 DWA。
+# SHADOW_MODELS 為逗號分隔的 adapter 名稱，留空代表關閉；併發與等待上限和主流量分開計算。
+# 抽樣在判定之後，快取命中、前置篩選、視窗模式的長對話也會抽到 (長對話送截短後的版本)；
+# 候選的判定套用同一組 PROB_CALIB_A / B 與 FRAUD_THRESHOLD
+SHADOW_MODELS = [m.strip() for m in os.getenv("SHADOW_MODELS", "").split(",") if m.strip()]
+SHADOW_SAMPLE_RATE = float(os.getenv("SHADOW_SAMPLE_RATE", "0.05"))
+SHADOW_MAX_CONCURRENCY = int(os.getenv("SHADOW_MAX_CONCURRENCY", "4"))
+SHADOW_MAX_PENDING = int(os.getenv("SHADOW_MAX_PENDING", "64"))
+SHADOW_TIMEOUT_S = float(os.getenv("SHADOW_TIMEOUT_S", "30"))
+SHADOW_LOG_DIR = os.getenv("SHADOW_LOG_DIR", "./inference_data/shadow")
+
+# 以第一個 token 的 top logprobs 算詐騙機率；fraud_prob >= FRAUD_THRESHOLD 判為 True
+# PROB_CALIB_A / PROB_CALIB_B 為 Platt scaling 參數，可用 `python confidence.py fit` 擬合
+TOP_LOGPROBS = int(os.getenv("TOP_LOGPROBS", "5"))
+FRAUD_THRESHOLD = float(os.getenv("FRAUD_THRESHOLD", "0.5"))
+PROB_CALIB_A = float(os.getenv("PROB_CALIB_A", "1.0"))
+PROB_CALIB_B = float(os.getenv("PROB_CALIB_B", "0.0"))
+
+# Admission control：送往模型的請求數上限 + 有上限的排隊；
+# 佇列滿回 429，排隊趕不上 deadline 回 503，都帶 Retry-After。ADMISSION_MAX_CONCURRENCY = 0 代表關閉
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "128"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "1024"))
+ADMISSION_DEADLINE_S = float(os.getenv("ADMISSION_DEADLINE_S", "30"))
 
-VLLM_URL = "http://vllm:8000/v1/chat/completions"
-MODEL_NAME = "scam-8b-sft"
+# /predict_batch 每個請求同時處理的筆數上限 (輸入讀取也會被這個上限擋住，形成 backpressure)
+PREDICT_BATCH_CONCURRENCY = int(os.getenv("PREDICT_BATCH_CONCURRENCY", "64"))
 
-SYSTEM_PROMPT = """You are a strict binary classification system specialized in fraud detection. Your task is to analyze a conversation log between two parties and determine if it exhibits characteristics of a scam or fraudulent intent.
+# 結構化 log：寫入走背景 thread，每筆請求的 log 只抽樣 LOG_SAMPLE_RATE 比例 (錯誤一律記錄)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.01"))
 
-**Input Format:**
-The user will provide a conversation text enclosed within <conversation> tags.
+# CPU 前置篩選 (fast_path.py)：非常確定是正常或詐騙的對話直接回應，不送 vLLM
+# FAST_PATH_MODEL 為 fast_path.py train 的輸出，空字串代表關閉；LOW / HIGH 沒給就用模型檔內的門檻
+FAST_PATH_MODEL = os.getenv("FAST_PATH_MODEL", "")
+FAST_PATH_LOW = os.getenv("FAST_PATH_LOW")
+FAST_PATH_HIGH = os.getenv("FAST_PATH_HIGH")
 
-**Classification Criteria:**
-- Output 'True': If the conversation contains evidence of scamming, phishing, social engineering, financial fraud, or malicious intent by either party.
-- Output 'False': If the conversation appears to be a normal, benign interaction without fraudulent intent.
+# 超過 vLLM --vllm_max_model_len 的對話先在這裡截短，不讓 vLLM 回錯誤
+# TRUNCATE_POLICY: head / recent / head_tail (見 token_length.py)，none 代表不處理
+# TOKENIZER_PATH 需是本機快取的 tokenizer，找不到時以 TRUNCATE_CHARS_PER_TOKEN 估算
+MAX_MODEL_LEN = int(os.getenv("MAX_MODEL_LEN", "4096"))
+TRUNCATE_POLICY = os.getenv("TRUNCATE_POLICY", "head_tail")
+TOKENIZER_PATH = os.getenv("TOKENIZER_PATH", DEFAULT_TOKENIZER)
+TRUNCATE_CHARS_PER_TOKEN = float(os.getenv("TRUNCATE_CHARS_PER_TOKEN", str(CHARS_PER_TOKEN)))
 
-**Output Constraints (CRITICAL):**
-1. You must output EXACTLY one word: "True" or "False".
-2. Do NOT output any explanation, reasoning, preamble, or punctuation.
-3. Do NOT output markdown formatting (e.g., no bold, no code blocks).
-4. Do NOT apologize or converse.
-5. If the input is empty or unintelligible, output "False" (as the safe default) or handle strictly as per specific edge-case logic.
-"""
+# 長對話改用視窗模式 (windowing.py)：切成重疊的視窗同批評分，依 WINDOW_RULE (any / max / recency) 合併，
+# 任一視窗的 fraud_prob >= WINDOW_EARLY_STOP 就取消其餘視窗直接判 True。WINDOW_RULE 留空代表沿用截斷
+# 需要 TRUNCATE_POLICY 不為 none (共用同一個 token 預算)
+WINDOW_RULE = os.getenv("WINDOW_RULE", "")
+WINDOW_OVERLAP_TURNS = int(os.getenv("WINDOW_OVERLAP_TURNS", "2"))
+WINDOW_MAX = int(os.getenv("WINDOW_MAX", "8"))
+WINDOW_EARLY_STOP = float(os.getenv("WINDOW_EARLY_STOP", "0.95"))
+WINDOW_RECENCY_DECAY = float(os.getenv("WINDOW_RECENCY_DECAY", "0.7"))
 
-USER_TEMPLATE = (
-    'Here is the conversation log to classify: <conversation>\n'
-    '{conversation}\n'
-    '</conversation>\n'
-    'Reminder: Based on the system instructions, output ONLY "True" or "False".'
+# 主模型使用的 prompt 版本 (prompts.py)：prefix 讓對話前的文字逐位元組固定，命中 vLLM prefix cache
+# compact 只適用以該樣板訓練的 adapter；escalate 的 base 模型一律使用 full
+PROMPT_VARIANT = os.getenv("PROMPT_VARIANT", "full")
+
+# 後端模型的 profile (model_profiles.py)：chat template 參數、guided decoding 與輸出 parser
+# auto 依 MODEL_NAME / ESCALATE_MODEL 挑選；GUIDED_DECODING 可覆寫 profile 的設定 (guided_choice / structured_outputs / none)
+MODEL_PROFILE = os.getenv("MODEL_PROFILE", "auto")
+ESCALATE_PROFILE = os.getenv("ESCALATE_PROFILE", "auto")
+GUIDED_DECODING = os.getenv("GUIDED_DECODING", "")
+
+# Micro-batching：把時間窗內的請求湊成一批再一起送往 vLLM
+# BATCH_WINDOW_MS = 0 代表關閉，每筆請求直接送出
+BATCH_WINDOW_MS = float(os.getenv("BATCH_WINDOW_MS", "0"))
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "32"))
+
+# 判定快取：同一段對話 (正規化後) + 同一個模型直接回傳上次的結果
+# CACHE_MAX_ENTRIES = 0 代表關閉；CACHE_DB_PATH 設定後會多一層 sqlite 共用快取
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "100000"))
+CACHE_TTL_S = float(os.getenv("CACHE_TTL_S", "3600"))
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH") or None
+
+# 通話中即時評分：每累積幾句 / 幾個字元重評一次，
+# fraud_prob 連續 STREAM_CONFIRM_N 次 >= STREAM_FINAL_THRESHOLD 就提早結案
+STREAM_EVERY_TURNS = int(os.getenv("STREAM_EVERY_TURNS", "2"))
+STREAM_EVERY_CHARS = int(os.getenv("STREAM_EVERY_CHARS", "0"))
+STREAM_CONFIRM_N = int(os.getenv("STREAM_CONFIRM_N", "1"))
+STREAM_FINAL_THRESHOLD = float(os.getenv("STREAM_FINAL_THRESHOLD", "0.9"))
+STREAM_IDLE_S = float(os.getenv("STREAM_IDLE_S", "1800"))
+
+
+
+METRICS = Registry()
+REQUESTS = METRICS.counter(
+    "scam_requests_total", "Classified conversations by endpoint and verdict", ["endpoint", "verdict"]
+)
+REQUEST_LATENCY = METRICS.histogram(
+    "scam_request_latency_seconds", "End-to-end classification latency", ["endpoint"]
 )
+STAGE_LATENCY = METRICS.histogram(
+    "scam_stage_latency_seconds", "Latency breakdown of uncached scoring", ["stage"]
+)
+INPUT_CHARS = METRICS.histogram(
+    "scam_input_chars", "Conversation length in characters", buckets=CHAR_BUCKETS
+)
+PROMPT_TOKENS = METRICS.histogram(
+    "scam_prompt_tokens", "Prompt tokens reported by the upstream usage field", buckets=TOKEN_BUCKETS
+)
+TRUNCATED = METRICS.counter(
+    "scam_truncated_total", "Conversations truncated to fit the model context", ["policy"]
+)
+UPSTREAM_REQUESTS = METRICS.counter(
+    "scam_upstream_requests_total", "Requests sent to model backends", ["tier"]
+)
+UPSTREAM_ERRORS = METRICS.counter(
+    "scam_upstream_errors_total", "Failed requests to model backends", ["tier", "kind"]
+)
+WINDOWED = METRICS.counter(
+    "scam_windowed_total", "Long conversations scored in windows by outcome", ["outcome"]
+)
+WINDOWS = METRICS.histogram(
+    "scam_windows_per_conversation", "Windows scored per long conversation", buckets=(2, 3, 4, 6, 8, 12, 16, 32)
+)
+UNPARSED_OUTPUTS = METRICS.counter(
+    "scam_unparsed_outputs_total", "Model outputs the profile parser could not map to True/False", ["tier"]
+)
+
+log = SampledLogger(logging.getLogger("scam_call"), LOG_SAMPLE_RATE)
 
 
 class PredictIn(BaseModel):
     text: str  # 前端丟來的 conversation 文字
+    threshold: Optional[float] = None  # 沒給就用 FRAUD_THRESHOLD
+    priority: Literal["live", "batch"] = "live"  # 批次回補請用 batch，讓即時評分優先
+    deadline_ms: Optional[float] = None  # 排隊最多等多久，沒給就用 ADMISSION_DEADLINE_S
 
 
 class PredictOut(BaseModel):
     output: str  # "True" or "False"
+    fraud_prob: Optional[float] = None  # 校準後的詐騙機率；後端沒回 logprobs 時為 None
+    # 第一階段模型未校準的機率 (confidence.py fit 用)，只在 /predict_batch 回傳；其他 tier 為 None
+    raw_prob: Optional[float] = None
+
+
+class BatchItem(BaseModel):
+    id: Optional[str] = None  # 沒給就用在批次中的序號
+    text: str
+
+
+class StreamStartIn(BaseModel):
+    every_turns: Optional[int] = None   # 沒給就用 STREAM_EVERY_TURNS
+    every_chars: Optional[int] = None
+    confirm_n: Optional[int] = None
+    final_threshold: Optional[float] = None
+    turns: List[str] = []
+
+
+class StreamTurnsIn(BaseModel):
+    turns: List[str]  # 新進來的逐字稿句子，例如 "caller: ..."
+
+
+class StreamOut(BaseModel):
+    session_id: str
+    turns: int
+    verdict: Optional[str]  # 尚未評分過為 None
+    fraud_prob: Optional[float]
+    final: bool             # True 代表已確定為詐騙，不會再變
+    n_scored: int
+    final_at_turn: Optional[int]
+
+
+def _make_pool(urls: List[str], timeout_s: float) -> BackendPool:
+    return BackendPool(
+        [u.strip() for u in urls if u.strip()],
+        max_connections=VLLM_POOL_CONNECTIONS,
+        timeout_s=timeout_s,
+        max_retries=VLLM_MAX_RETRIES,
+        eject_after=VLLM_EJECT_AFTER,
+        health_interval_s=VLLM_HEALTH_INTERVAL_S,
+    )
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    app.state.http = httpx.AsyncClient(timeout=180.0)
+    get_prompt(PROMPT_VARIANT)  # 名稱打錯時啟動就失敗，不要等到第一筆請求
+    app.state.profiles = {
+        "primary": _load_profile(MODEL_PROFILE, MODEL_NAME),
+        "escalate": _load_profile(ESCALATE_PROFILE, ESCALATE_MODEL),
+    }
+    _, log_listener = setup_logging("scam_call", LOG_LEVEL)
+    log_listener.start()
+    app.state.primary = Tier(
+        "primary", _make_pool(VLLM_URLS, VLLM_TIMEOUT_S), MODEL_NAME,
+        VLLM_MAX_CONCURRENCY, VLLM_TIMEOUT_S,
+    )
+    app.state.escalate = None
+    app.state.router = None
+    if ESCALATE_URL:
+        app.state.escalate = Tier(
+            "escalate", _make_pool(ESCALATE_URL.split(","), ESCALATE_TIMEOUT_S), ESCALATE_MODEL,
+            ESCALATE_MAX_CONCURRENCY, ESCALATE_TIMEOUT_S,
+        )
+        app.state.router = CascadeRouter(ESCALATE_LOW, ESCALATE_HIGH, ESCALATE_LONG_CHARS)
+    for tier in (app.state.primary, app.state.escalate):
+        if tier is not None:
+            await tier.pool.start()
+    app.state.batcher = None
+    if BATCH_WINDOW_MS > 0:
+        app.state.batcher = MicroBatcher(
+            _post_batch, window_s=BATCH_WINDOW_MS / 1000.0, max_size=BATCH_MAX_SIZE
+        )
+    app.state.sessions = SessionStore(idle_s=STREAM_IDLE_S)
+    app.state.shadow = None
+    if SHADOW_MODELS:
+        app.state.shadow = ShadowScorer(
+            SHADOW_MODELS, _shadow_score, SHADOW_SAMPLE_RATE, SHADOW_MAX_CONCURRENCY,
+            SHADOW_MAX_PENDING, SHADOW_LOG_DIR,
+        )
+    app.state.admission = None
+    if ADMISSION_MAX_CONCURRENCY > 0:
+        app.state.admission = AdmissionController(
+            ADMISSION_MAX_CONCURRENCY, ADMISSION_MAX_QUEUE, ADMISSION_DEADLINE_S
+        )
+    app.state.cache = None
+    if CACHE_MAX_ENTRIES > 0:
+        app.state.cache = VerdictCache(CACHE_MAX_ENTRIES, CACHE_TTL_S, CACHE_DB_PATH)
+    app.state.fast_path = None
+    if FAST_PATH_MODEL:
+        app.state.fast_path = FastPath.load(FAST_PATH_MODEL)
+        if FAST_PATH_LOW is not None:
+            app.state.fast_path.low = float(FAST_PATH_LOW)
+        if FAST_PATH_HIGH is not None:
+            app.state.fast_path.high = float(FAST_PATH_HIGH)
+    app.state.lengths = None
+    app.state.token_budget = None
+    if WINDOW_RULE and (WINDOW_RULE not in WINDOW_RULES or TRUNCATE_POLICY == "none"):
+        raise ValueError(f"WINDOW_RULE must be one of {WINDOW_RULES} and needs TRUNCATE_POLICY != none, "
+                         f"got {WINDOW_RULE!r} / {TRUNCATE_POLICY!r}")
+    if TRUNCATE_POLICY != "none":
+        if TRUNCATE_POLICY not in ("head", "recent", "head_tail"):
+            raise ValueError(f"TRUNCATE_POLICY must be none, head, recent or head_tail, got {TRUNCATE_POLICY!r}")
+        app.state.lengths = TokenCounter(TOKENIZER_PATH, TRUNCATE_CHARS_PER_TOKEN)
+        # escalate 用 full prompt，預算以較長的那個為準
+        empty = _build_payload("", "full", "escalate") if app.state.escalate is not None else _build_payload("")
+        app.state.token_budget = conversation_budget(
+            app.state.lengths, MAX_MODEL_LEN, empty["messages"], max_new_tokens=empty["max_tokens"],
+        )
+        if not app.state.lengths.exact:
+            log.warning("tokenizer not found locally, estimating token counts",
+                        tokenizer=TOKENIZER_PATH, chars_per_token=TRUNCATE_CHARS_PER_TOKEN)
+    app.state.cache_scope = _cache_scope()
     yield
-    await app.state.http.aclose()
+    if app.state.shadow is not None:
+        await app.state.shadow.aclose()
+    if app.state.batcher is not None:
+        await app.state.batcher.aclose()
+    if app.state.cache is not None:
+        app.state.cache.close()
+    for tier in (app.state.primary, app.state.escalate):
+        if tier is not None:
+            await tier.pool.aclose()
+    log_listener.stop()
 
 
 app = FastAPI(lifespan=lifespan)
 
 
+@app.exception_handler(Overloaded)
+async def _overloaded_handler(request: Request, exc: Overloaded):
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": exc.reason},
+        headers={"Retry-After": str(int(exc.retry_after_s))},
+    )
 
-def _coerce_boolean_word(raw: str) -> str:
-    # 嚴格只接受 True/False；不符合就回 False
-    if raw is None:
-        return "False"
-    s = raw.strip()
-    if s == "True":
-        return "True"
-    if s == "False":
-        return "False"
-    return "False"
 
+# 後端錯誤轉成 502 / 504；未處理的例外會讓 uvicorn 關掉 keep-alive 連線，client 會看到 ReadError
+@app.exception_handler(httpx.HTTPError)
+async def _upstream_error_handler(request: Request, exc: httpx.HTTPError):
+    return JSONResponse(status_code=502, content={"detail": f"upstream error: {type(exc).__name__}"})
 
 
-@app.post("/predict", response_class=PlainTextResponse)
-async def predict(inp: PredictIn):
-    conversation = inp.text
+@app.exception_handler(asyncio.TimeoutError)
+async def _upstream_timeout_handler(request: Request, exc: asyncio.TimeoutError):
+    return JSONResponse(status_code=504, content={"detail": "upstream timeout"})
 
-    payload = {
+
+def _load_profile(name: str, model: str) -> ModelProfile:
+    profile = get_profile(name, model)
+    if GUIDED_DECODING:
+        profile = profile.with_constraint(None if GUIDED_DECODING == "none" else GUIDED_DECODING)
+    return profile
+
+
+def _cache_scope() -> str:
+    """
+    快取 key 的設定指紋：會改變模型看到的內容或判定方式的設定都要放進來，
+    設定不同的 replica 共用 CACHE_DB_PATH 時才不會拿到彼此的結果。
+    校準參數與門檻在取出後才套用，不放進來 (cascade 的升級判斷例外，見下)
+    """
+    lengths = app.state.lengths
+    scope: Dict[str, Any] = {
         "model": MODEL_NAME,
-        "messages": [
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {"role": "user", "content": USER_TEMPLATE.format(conversation=conversation)},
+        "prompt": PROMPT_VARIANT,
+        "profile": app.state.profiles["primary"].stats(),
+        "truncate": TRUNCATE_POLICY,
+        "max_model_len": MAX_MODEL_LEN,
+        "budget_tokens": app.state.token_budget,
+        "tokenizer": None if lengths is None else [lengths.name, lengths.backend, lengths.chars_per_token],
+        "window": None if not WINDOW_RULE else [
+            WINDOW_RULE, WINDOW_OVERLAP_TURNS, WINDOW_MAX, WINDOW_EARLY_STOP, WINDOW_RECENCY_DECAY,
         ],
+        "escalate": None,
+    }
+    if app.state.router is not None:
+        # 是否升級依校準後的機率決定，升級後的結果也會進快取
+        scope["escalate"] = {
+            "model": ESCALATE_MODEL,
+            "profile": app.state.profiles["escalate"].stats(),
+            "band": [ESCALATE_LOW, ESCALATE_HIGH],
+            "long_chars": ESCALATE_LONG_CHARS,
+            "calib": [PROB_CALIB_A, PROB_CALIB_B],
+        }
+    return json.dumps(scope, sort_keys=True)
+
+
+def _build_payload(conversation: str, variant: Optional[str] = None, tier: str = "primary") -> Dict[str, Any]:
+    payload = {
+        "model": MODEL_NAME,
+        "messages": get_prompt(variant or PROMPT_VARIANT).messages(conversation),
         "max_tokens": 1,
         "temperature": 0,
         "stream": False,
+        **app.state.profiles[tier].request_params(),
     }
+    if TOP_LOGPROBS > 0:
+        payload["logprobs"] = True
+        payload["top_logprobs"] = TOP_LOGPROBS
+    return payload
+
+
+async def _post_tier(tier: Tier, payload: Dict[str, Any]) -> httpx.Response:
+    UPSTREAM_REQUESTS.inc(tier=tier.name)
+    try:
+        with Timer() as t:
+            r = await tier.post(payload)
+    except Exception as e:
+        UPSTREAM_ERRORS.inc(tier=tier.name, kind=type(e).__name__)
+        log.warning("upstream error", tier=tier.name, error=repr(e))
+        raise
+    STAGE_LATENCY.observe(t.elapsed, stage="upstream")
+    return r
+
+
+async def _post_one(payload: Dict[str, Any]) -> httpx.Response:
+    return await _post_tier(app.state.primary, payload)
+
+
+async def _post_batch(payloads: List[Dict[str, Any]]) -> List[Any]:
+    # chat completions 一次只吃一段對話，所以一批請求是在同一個連線池上
+    # 同時送出，讓 vLLM 的 scheduler 一次排進同一個 step；單筆失敗只影響自己
+    return await asyncio.gather(
+        *(_post_one(p) for p in payloads), return_exceptions=True
+    )
+
+
+def _parse_choice(r: httpx.Response, tier: str) -> Dict[str, Any]:
+    with Timer() as t:
+        data = r.json()
+        choice = data.get("choices", [{}])[0]
+        raw_out = choice.get("message", {}).get("content", "")
+        p_raw = fraud_probability(choice)
+    STAGE_LATENCY.observe(t.elapsed, stage="decode")
+    prompt_tokens = (data.get("usage") or {}).get("prompt_tokens")
+    if prompt_tokens is not None:
+        PROMPT_TOKENS.observe(prompt_tokens)
+    verdict = app.state.profiles[tier].verdict(raw_out)
+    if verdict is None:
+        UNPARSED_OUTPUTS.inc(tier=tier)
+        verdict = "False"
+    # 快取存的是未校準的結果，調整校準參數或門檻不需要清快取
+    return {"raw": verdict, "p_raw": p_raw, "tier": tier}
+
+
+def _calibrated(score: Dict[str, Any]) -> Optional[float]:
+    if score.get("tier") == "windows":
+        return _window_probability(score)
+    p_raw = score.get("p_raw")
+    if p_raw is None:
+        return None
+    # 校準參數是針對第一階段模型擬合的，第二階段直接用原始機率
+    if score.get("tier", "primary") != "primary":
+        return p_raw
+    return calibrate(p_raw, PROB_CALIB_A, PROB_CALIB_B)
+
+
+def _fit_conversation(conversation: str) -> str:
+    # 放不進模型長度時依 TRUNCATE_POLICY 截短；token 數有記憶，重送與串流重評不會重算
+    counter = app.state.lengths
+    if counter is None:
+        return conversation
+    fitted, _, truncated = fit(counter, conversation, app.state.token_budget, TRUNCATE_POLICY)
+    if truncated:
+        TRUNCATED.inc(policy=TRUNCATE_POLICY)
+    return fitted
+
+
+async def _score_uncached(conversation: str) -> Dict[str, Any]:
+    if WINDOW_RULE and app.state.lengths is not None:
+        with Timer() as t:
+            windows = split_windows(app.state.lengths, conversation, app.state.token_budget,
+                                    WINDOW_OVERLAP_TURNS, WINDOW_MAX)
+        if len(windows) > 1:
+            STAGE_LATENCY.observe(t.elapsed, stage="prompt")
+            return await _score_windows(windows)
+    with Timer() as t:
+        fitted = _fit_conversation(conversation)
+        payload = _build_payload(fitted)
+    STAGE_LATENCY.observe(t.elapsed, stage="prompt")
+    if app.state.batcher is not None:
+        r = await app.state.batcher.submit(payload)
+    else:
+        r = await _post_one(payload)
+    score = _parse_choice(r, "primary")
+    return await _maybe_escalate(conversation, fitted, score)
 
-    r = await app.state.http.post(VLLM_URL, json=payload)
-    r.raise_for_status()
-    data = r.json()
 
-    raw_out = data.get("choices", [{}])[0].get("message", {}).get("content", "")
-    out = _coerce_boolean_word(raw_out)
-    print(out)  # 只會印在後端 console
+async def _score_windows(windows: List[str]) -> Dict[str, Any]:
+    # 各視窗同時送出 (有開 micro-batching 時會進同一批)；任一視窗很確定是詐騙就取消其餘視窗。
+    # 快取只存各視窗未校準的結果，合併在 _window_probability 依當下的校準參數計算；長對話不升級
+    async def one(window: str) -> Dict[str, Any]:
+        payload = _build_payload(window)
+        if app.state.batcher is not None:
+            r = await app.state.batcher.submit(payload)
+        else:
+            r = await _post_one(payload)
+        return _parse_choice(r, "primary")
+
+    WINDOWS.observe(len(windows))
+    tasks = [asyncio.ensure_future(one(w)) for w in windows]
+    index = {t: i for i, t in enumerate(tasks)}
+    scores: List[Any] = [None] * len(tasks)
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                score = t.result()
+                i = index[t]
+                scores[i] = [score["raw"], score["p_raw"]]
+                p = _calibrated(score)
+                if p is not None and p >= WINDOW_EARLY_STOP:
+                    WINDOWED.inc(outcome="early_stop")
+                    return {"raw": "True", "windows": scores, "early_stop": i, "tier": "windows"}
+    finally:
+        for t in pending:
+            t.cancel()
+    # raw 只在沒有機率時使用，此時的合併結果與校準參數無關
+    raw, _ = combine(scores, WINDOW_RULE, WINDOW_RECENCY_DECAY)
+    WINDOWED.inc(outcome="combined")
+    return {"raw": raw, "windows": scores, "early_stop": None, "tier": "windows"}
+
+
+def _window_probability(score: Dict[str, Any]) -> Optional[float]:
+    # 各視窗先校準再合併；提早結案的結果沿用觸發的那個視窗
+    calibrated = [
+        None if w is None else (w[0], None if w[1] is None else calibrate(w[1], PROB_CALIB_A, PROB_CALIB_B))
+        for w in score["windows"]
+    ]
+    stop = score.get("early_stop")
+    if stop is not None:
+        return calibrated[stop][1]
+    return combine(calibrated, WINDOW_RULE, WINDOW_RECENCY_DECAY)[1]
+
+
+async def _maybe_escalate(conversation: str, fitted: str, score: Dict[str, Any]) -> Dict[str, Any]:
+    router = app.state.router
+    if router is None:
+        return score
+    reason = router.escalation_reason(conversation, _calibrated(score))
+    if reason is None:
+        return score
+    try:
+        r = await _post_tier(app.state.escalate, _build_payload(fitted, "full", "escalate"))
+    except (asyncio.TimeoutError, httpx.HTTPError):
+        router.fallbacks += 1
+        return score
+    return _parse_choice(r, "escalate")
+
+
+async def _shadow_score(model: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    # 候選 adapter 和主模型在同一組 replica 上；不經過 Tier，不佔主流量的併發名額。
+    # 判定方式與線上相同 (主模型的校準參數 + FRAUD_THRESHOLD)，才能和線上的判定比較
+    UPSTREAM_REQUESTS.inc(tier="shadow")
+    try:
+        r = await asyncio.wait_for(app.state.primary.pool.post(dict(payload, model=model)), SHADOW_TIMEOUT_S)
+    except Exception as e:
+        UPSTREAM_ERRORS.inc(tier="shadow", kind=type(e).__name__)
+        raise
+    choice = r.json().get("choices", [{}])[0]
+    verdict = app.state.profiles["primary"].verdict(choice.get("message", {}).get("content", ""))
+    if verdict is None:
+        UNPARSED_OUTPUTS.inc(tier="shadow")
+        verdict = "False"
+    v = _decide({"raw": verdict, "p_raw": fraud_probability(choice), "tier": "primary"})
+    return {"output": v.output, "fraud_prob": v.fraud_prob, "raw": verdict, "p_raw": v.raw_prob}
+
+
+def _shadow_payload(conversation: str) -> Dict[str, Any]:
+    # 長對話 (不論線上是否走視窗模式) 依 TRUNCATE_POLICY 截短後送一次；不計入 TRUNCATED
+    counter = app.state.lengths
+    if counter is not None:
+        conversation, _, _ = fit(counter, conversation, app.state.token_budget, TRUNCATE_POLICY)
+    return _build_payload(conversation)
+
+
+async def _score(
+    conversation: str, priority: str = "live", deadline_s: Optional[float] = None
+) -> Dict[str, Any]:
+    score = await _score_served(conversation, priority, deadline_s)
+    shadow = app.state.shadow
+    if shadow is not None:
+        # 在判定之後抽樣，快取命中、合併的重複請求、前置篩選與視窗模式都算在內；不等候選 adapter 的結果
+        v = _decide(score)
+        shadow.submit(lambda: _shadow_payload(conversation),
+                      {"output": v.output, "fraud_prob": v.fraud_prob, "tier": score["tier"]})
+    return score
+
+
+async def _score_served(conversation: str, priority: str, deadline_s: Optional[float]) -> Dict[str, Any]:
+    async def compute() -> Dict[str, Any]:
+        admission = app.state.admission
+        if admission is None:
+            return await _score_uncached(conversation)
+        async with admission.slot(PRIORITY_CLASSES[priority], deadline_s) as waited:
+            STAGE_LATENCY.observe(waited, stage="queue")
+            return await _score_uncached(conversation)
+
+    # 前置篩選判得掉的不查快取、不佔 admission 名額；fraud_prob 不套用模型的校準參數
+    fast = app.state.fast_path
+    if fast is not None:
+        decided = fast.decide(conversation)
+        if decided is not None:
+            return {"raw": decided[0], "p_raw": decided[1], "tier": "fast_path"}
+
+    # 快取命中與合併的重複請求不佔 admission 名額
+    cache = app.state.cache
+    if cache is None:
+        return await compute()
+    key = cache.make_key(conversation, app.state.cache_scope)
+    return await cache.get_or_compute(key, compute)
+
+
+def _decide(score: Dict[str, Any], threshold: Optional[float] = None) -> PredictOut:
+    prob = _calibrated(score)
+    if prob is None:
+        # 後端沒有 logprobs 時退回原本的單一 token 判定
+        return PredictOut(output=score["raw"], fraud_prob=None)
+    t = FRAUD_THRESHOLD if threshold is None else threshold
+    raw_prob = score.get("p_raw") if score.get("tier") == "primary" else None
+    return PredictOut(output="True" if prob >= t else "False", fraud_prob=prob, raw_prob=raw_prob)
+
+
+async def _classify(
+    conversation: str,
+    threshold: Optional[float] = None,
+    priority: str = "live",
+    deadline_s: Optional[float] = None,
+    endpoint: str = "predict",
+) -> PredictOut:
+    start = time.perf_counter()
+    INPUT_CHARS.observe(len(conversation))
+    try:
+        v = _decide(await _score(conversation, priority, deadline_s), threshold)
+    except Overloaded:
+        REQUESTS.inc(endpoint=endpoint, verdict="shed")
+        raise
+    except Exception as e:
+        REQUESTS.inc(endpoint=endpoint, verdict="error")
+        log.warning("classification failed", endpoint=endpoint, error=repr(e))
+        raise
+    elapsed = time.perf_counter() - start
+    REQUESTS.inc(endpoint=endpoint, verdict=v.output)
+    REQUEST_LATENCY.observe(elapsed, endpoint=endpoint)
+    log.request(
+        "classified", endpoint=endpoint, verdict=v.output, fraud_prob=v.fraud_prob,
+        chars=len(conversation), latency_ms=round(elapsed * 1000.0, 2),
+    )
+    return v
+
+
+def _classify_input(inp: PredictIn, endpoint: str):
+    deadline_s = None if inp.deadline_ms is None else inp.deadline_ms / 1000.0
+    return _classify(inp.text, inp.threshold, inp.priority, deadline_s, endpoint)
+
+
+async def _rescore_session(s: StreamSession) -> None:
+    v = await _classify(s.text, endpoint="stream")
+    s.record(v.output, v.fraud_prob)
+
+
+async def _advance_session(s: StreamSession, turns: List[str]) -> Dict[str, Any]:
+    async with s.lock:
+        if s.add_turns(turns):
+            await _rescore_session(s)
+        return s.to_dict()
+
+
+def _new_session(inp: StreamStartIn) -> StreamSession:
+    return app.state.sessions.create(
+        every_turns=STREAM_EVERY_TURNS if inp.every_turns is None else inp.every_turns,
+        every_chars=STREAM_EVERY_CHARS if inp.every_chars is None else inp.every_chars,
+        confirm_n=STREAM_CONFIRM_N if inp.confirm_n is None else inp.confirm_n,
+        final_threshold=(
+            STREAM_FINAL_THRESHOLD if inp.final_threshold is None else inp.final_threshold
+        ),
+    )
+
+
+@app.post("/stream", response_model=StreamOut)
+async def stream_start(inp: StreamStartIn):
+    s = _new_session(inp)
+    return await _advance_session(s, inp.turns)
+
+
+@app.post("/stream/{session_id}", response_model=StreamOut)
+async def stream_turns(session_id: str, inp: StreamTurnsIn):
+    s = app.state.sessions.get(session_id)
+    if s is None:
+        raise HTTPException(status_code=404, detail="unknown or expired session")
+    return await _advance_session(s, inp.turns)
+
+
+@app.delete("/stream/{session_id}", response_model=StreamOut)
+async def stream_end(session_id: str):
+    s = app.state.sessions.pop(session_id)
+    if s is None:
+        raise HTTPException(status_code=404, detail="unknown or expired session")
+    # 通話結束時若還有沒評到的句子，補評一次給出完整對話的判定
+    async with s.lock:
+        if s.has_unscored():
+            await _rescore_session(s)
+        return s.to_dict()
+
+
+@app.websocket("/stream/ws")
+async def stream_ws(ws: WebSocket):
+    # 第一個訊息可帶 every_turns / every_chars / confirm_n，之後每個訊息為 {"turns": [...]}
+    # 每次評分後推送目前狀態；確定為詐騙時推送 final=true
+    await ws.accept()
+    s: Optional[StreamSession] = None
+    try:
+        while True:
+            msg = await ws.receive_json()
+            if s is None:
+                s = _new_session(StreamStartIn(**{k: v for k, v in msg.items() if k != "turns"}))
+            n_scored = s.n_scored
+            state = await _advance_session(s, msg.get("turns", []))
+            if state["n_scored"] != n_scored:
+                await ws.send_json(state)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        if s is not None:
+            app.state.sessions.pop(s.id)
+
+
+async def _iter_list(items: List[Any]) -> AsyncIterator[Any]:
+    for item in items:
+        yield item
+
+
+async def _score_batch_item(
+    idx: int, raw: Any, threshold: Optional[float], priority: str, deadline_s: Optional[float]
+) -> Dict[str, Any]:
+    item_id = str(idx)
+    try:
+        data = json.loads(raw) if isinstance(raw, (bytes, str)) else raw
+        item = BatchItem(**data)
+        if item.id is not None:
+            item_id = item.id
+        v = await _classify(item.text, threshold, priority, deadline_s, "predict_batch")
+        return {"id": item_id, "output": v.output, "fraud_prob": v.fraud_prob, "raw_prob": v.raw_prob}
+    except Overloaded as e:
+        return {"id": item_id, "error": e.reason, "status": e.status_code}
+    except Exception as e:
+        return {"id": item_id, "error": str(e) or type(e).__name__, "status": 500}
+
+
+async def _run_batch(
+    items: AsyncIterator[Any], threshold: Optional[float], priority: str, deadline_s: Optional[float]
+) -> AsyncIterator[str]:
+    # 同時最多 PREDICT_BATCH_CONCURRENCY 筆，結果依完成順序逐行送回
+    sem = asyncio.Semaphore(PREDICT_BATCH_CONCURRENCY)
+    pending: set = set()
+
+    async def one(idx: int, raw: Any) -> Dict[str, Any]:
+        try:
+            return await _score_batch_item(idx, raw, threshold, priority, deadline_s)
+        finally:
+            sem.release()
+
+    idx = 0
+    async for raw in items:
+        await sem.acquire()
+        pending.add(asyncio.ensure_future(one(idx, raw)))
+        idx += 1
+        done = {t for t in pending if t.done()}
+        pending -= done
+        for t in done:
+            yield json.dumps(t.result(), ensure_ascii=False) + "\n"
+
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for t in done:
+            yield json.dumps(t.result(), ensure_ascii=False) + "\n"
+
+
+@app.post("/predict_batch")
+async def predict_batch(
+    request: Request,
+    threshold: Optional[float] = None,
+    priority: Literal["live", "batch"] = "batch",
+    deadline_ms: Optional[float] = None,
+):
+    """
+    批次評分，回傳 NDJSON (每行 {"id", "output", "fraud_prob", "raw_prob"} 或 {"id", "error", "status"})。
+    輸入可以是 JSON {"items": [{"id", "text"}, ...]}，
+    或 Content-Type: application/x-ndjson (每行一個 {"id", "text"})。
+    輸入會先整份讀進來 (StreamingResponse 會搶同一個 receive channel 偵測斷線)，
+    輸出則是邊算邊送；大量資料請像 batch_score.py 一樣分 chunk 送。
+    """
+    if "ndjson" in request.headers.get("content-type", ""):
+        body = await request.body()
+        items = _iter_list([line for line in body.split(b"\n") if line.strip()])
+    else:
+        body = await request.json()
+        raw_items = body.get("items") if isinstance(body, dict) else body
+        if not isinstance(raw_items, list):
+            raise HTTPException(status_code=422, detail="expected {\"items\": [...]} or NDJSON")
+        items = _iter_list(raw_items)
+    deadline_s = None if deadline_ms is None else deadline_ms / 1000.0
+    return StreamingResponse(
+        _run_batch(items, threshold, priority, deadline_s), media_type="application/x-ndjson"
+    )
+
+
+def _collect_state_metrics() -> List[str]:
+    # 把各元件 stats() 的狀態在 scrape 時轉成 metrics
+    st = app.state
+    lines: List[str] = []
+    lines += gauge_lines("scam_stream_sessions", "Open streaming sessions", [({}, len(st.sessions))])
+    if st.cache is not None:
+        c = st.cache.stats()
+        lines += gauge_lines("scam_cache_events_total", "Verdict cache lookups by outcome", [
+            ({"event": k}, c[k]) for k in ("hits", "disk_hits", "misses", "coalesced", "evictions")
+        ], kind="counter")
+        lines += gauge_lines("scam_cache_entries", "Entries in the in-memory verdict cache", [({}, c["entries"])])
+    if st.admission is not None:
+        a = st.admission.stats()
+        lines += gauge_lines("scam_admission_inflight", "Admitted requests in progress", [({}, a["inflight"])])
+        lines += gauge_lines("scam_admission_queue_depth", "Requests waiting for admission", [
+            ({"priority": k}, v) for k, v in a["queue_depth_by_priority"].items()
+        ])
+        lines += gauge_lines("scam_admission_shed_total", "Requests rejected by admission control", [
+            ({"reason": k}, v) for k, v in a["shed"].items()
+        ], kind="counter")
+    if st.batcher is not None:
+        lines += histogram_from_counts(
+            "scam_batch_size", "Micro-batch sizes sent upstream",
+            st.batcher.histogram, (1, 2, 4, 8, 16, 32, 64, 128, 256),
+        )
+    # 每個 metric 只能有一組 HELP / TYPE：先收集所有 tier 的樣本再一起輸出
+    tiers = [t for t in (st.primary, st.escalate) if t is not None]
+    if tiers:
+        lines += gauge_lines("scam_tier_inflight", "In-flight requests per model tier", [
+            ({"tier": t.name}, t.inflight) for t in tiers
+        ])
+        lines += gauge_lines("scam_replica_healthy", "Replica health (1 = in rotation)", [
+            ({"tier": t.name, "url": r.url}, int(r.healthy)) for t in tiers for r in t.pool.replicas
+        ])
+    if st.fast_path is not None:
+        lines += gauge_lines("scam_fast_path_decisions_total", "Fast-path outcomes (forward = sent to the model)", [
+            ({"decision": k}, v) for k, v in st.fast_path.decisions.items()
+        ], kind="counter")
+    if st.shadow is not None:
+        lines += gauge_lines("scam_shadow_outcomes_total", "Shadow verdicts vs the served verdict per candidate adapter", [
+            ({"model": m, "outcome": k}, v) for m, o in st.shadow.outcomes.items() for k, v in o.items()
+        ], kind="counter")
+    if st.router is not None:
+        lines += gauge_lines("scam_cascade_escalations_total", "Escalations to the second tier", [
+            ({"reason": k}, v) for k, v in st.router.escalated.items()
+        ], kind="counter")
+    return lines
+
+
+METRICS.add_collector(_collect_state_metrics)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(METRICS.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/stats")
+async def stats():
+    batcher = app.state.batcher
+    return {
+        "batching": batcher.stats() if batcher is not None else {"enabled": False},
+        "cache": app.state.cache.stats() if app.state.cache is not None else {"enabled": False},
+        "stream_sessions": len(app.state.sessions),
+        "admission": app.state.admission.stats() if app.state.admission is not None else {"enabled": False},
+        "tiers": [t.stats() for t in (app.state.primary, app.state.escalate) if t is not None],
+        "cascade": app.state.router.stats() if app.state.router is not None else {"enabled": False},
+        "fast_path": app.state.fast_path.stats() if app.state.fast_path is not None else {"enabled": False},
+        "shadow": app.state.shadow.stats() if app.state.shadow is not None else {"enabled": False},
+        "prompt": PROMPT_VARIANT,
+        "profiles": {tier: p.stats() for tier, p in app.state.profiles.items()},
+        "truncation": (
+            {"policy": TRUNCATE_POLICY, "budget_tokens": app.state.token_budget, **app.state.lengths.stats()}
+            if app.state.lengths is not None else {"enabled": False}
+        ),
+        "windows": (
+            {"rule": WINDOW_RULE, "overlap_turns": WINDOW_OVERLAP_TURNS, "max_windows": WINDOW_MAX,
+             "early_stop": WINDOW_EARLY_STOP}
+            if WINDOW_RULE else {"enabled": False}
+        ),
+    }
+
+
+@app.post("/predict", response_class=PlainTextResponse)
+async def predict(inp: PredictIn):
+    out = (await _classify_input(inp, "predict")).output
     return out  # 前端只會拿到 True 或 False（純文字）
 
+
+
+@app.post("/predict_json", response_model=PredictOut, response_model_exclude={"raw_prob"})
+async def predict_json(inp: PredictIn):
+    return await _classify_input(inp, "predict_json")
@@ -0,0 +1,197 @@
+from __future__ import annotations
+
+import asyncio
+import random
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+
+class Replica:
+    """一個 vLLM replica：自己的連線池、目前進行中的請求數與健康狀態。"""
+
+    def __init__(self, url: str, max_connections: int, timeout_s: float):
+        self.url = url
+        parts = urlsplit(url)
+        self.health_url = f"{parts.scheme}://{parts.netloc}/health"
+        self.client = httpx.AsyncClient(
+            timeout=timeout_s,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+        )
+
+        self.inflight = 0
+        self.healthy = True
+        self.consecutive_failures = 0
+
+        self.requests = 0
+        self.failures = 0
+        self.ejections = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "inflight": self.inflight,
+            "requests": self.requests,
+            "failures": self.failures,
+            "ejections": self.ejections,
+        }
+
+
+class BackendPool:
+    """
+    多個 OpenAI 相容 replica 組成的後端池。
+
+    - 依「進行中請求數最少」挑 replica (同分隨機)
+    - 連續失敗 eject_after 次就暫時移出；只有成功的 completion 會把連續失敗數歸零
+    - 背景定期打 /health：失敗算一次失敗；被移出的 replica 要送一筆最小的 completion (probe) 成功才放回，
+      避免 /health 正常但 completion 一直 5xx 的 replica 每個週期被放回來、繼續吃線上流量
+    - 連線錯誤、逾時、5xx 會換一台 replica 重送 (分類請求是 idempotent 的)；4xx 直接拋出
+    - 全部 replica 都被移出時仍照最少負載挑一台送 (fail open)，避免 /health 本身出問題時全面停擺
+
+    參數:
+    urls (list[str]): 各 replica 的 /v1/chat/completions 完整網址
+    max_connections (int): 每個 replica 的連線池大小
+    timeout_s (float): 單次 HTTP 請求逾時
+    max_retries (int): 失敗後最多再換幾台重送
+    eject_after (int): 連續失敗幾次移出
+    health_interval_s (float): 健康檢查間隔 (0 = 不做背景健康檢查)
+    """
+
+    def __init__(
+        self,
+        urls: List[str],
+        max_connections: int = 64,
+        timeout_s: float = 180.0,
+        max_retries: int = 1,
+        eject_after: int = 3,
+        health_interval_s: float = 10.0,
+    ):
+        if not urls:
+            raise ValueError("BackendPool 至少需要一個 replica")
+        self.replicas = [Replica(u, max_connections, timeout_s) for u in urls]
+        self.max_retries = max_retries
+        self.eject_after = eject_after
+        self.health_interval_s = health_interval_s
+        self._health_task: Optional[asyncio.Task] = None
+        self._probe_model: Optional[str] = None  # 最近一次送出的 model，probe 用同一個 (adapter)
+
+        self.retries = 0
+
+    async def start(self) -> None:
+        if self.health_interval_s > 0 and self._health_task is None:
+            self._health_task = asyncio.ensure_future(self._health_loop())
+
+    async def aclose(self) -> None:
+        if self._health_task is not None:
+            self._health_task.cancel()
+            await asyncio.gather(self._health_task, return_exceptions=True)
+            self._health_task = None
+        for rep in self.replicas:
+            await rep.client.aclose()
+
+    def _pick(self, exclude: List[Replica]) -> Optional[Replica]:
+        candidates = [r for r in self.replicas if r not in exclude]
+        if not candidates:
+            return None
+        healthy = [r for r in candidates if r.healthy]
+        pool = healthy or candidates
+        least = min(r.inflight for r in pool)
+        return random.choice([r for r in pool if r.inflight == least])
+
+    def _mark_ok(self, rep: Replica) -> None:
+        # 只在 completion 成功 (線上請求或 probe) 時呼叫
+        rep.consecutive_failures = 0
+        if not rep.healthy:
+            rep.healthy = True
+
+    def _mark_failed(self, rep: Replica) -> None:
+        rep.failures += 1
+        rep.consecutive_failures += 1
+        if rep.healthy and rep.consecutive_failures >= self.eject_after:
+            rep.healthy = False
+            rep.ejections += 1
+
+    async def post(self, payload: Dict[str, Any]) -> httpx.Response:
+        tried: List[Replica] = []
+        last_exc: Optional[BaseException] = None
+        self._probe_model = payload.get("model", self._probe_model)
+
+        for attempt in range(self.max_retries + 1):
+            rep = self._pick(tried)
+            if rep is None:
+                break
+            tried.append(rep)
+            if attempt > 0:
+                self.retries += 1
+
+            rep.inflight += 1
+            rep.requests += 1
+            try:
+                r = await rep.client.post(rep.url, json=payload)
+                if r.status_code >= 500:
+                    r.raise_for_status()
+            except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                self._mark_failed(rep)
+                last_exc = e
+                continue
+            finally:
+                rep.inflight -= 1
+
+            self._mark_ok(rep)
+            r.raise_for_status()  # 4xx 是請求本身的問題，換台也沒用
+            return r  # JSON 由呼叫端解析 (app 會另外量 decode 時間)
+
+        assert last_exc is not None
+        raise last_exc
+
+    async def check_health(self) -> None:
+        async def probe(rep: Replica) -> None:
+            try:
+                r = await rep.client.get(rep.health_url, timeout=5.0)
+                ok = r.status_code == 200
+            except httpx.HTTPError:
+                ok = False
+            if not ok:
+                self._mark_failed(rep)
+            elif not rep.healthy:
+                await self._probe_completion(rep)
+
+        await asyncio.gather(*(probe(rep) for rep in self.replicas))
+
+    async def _probe_completion(self, rep: Replica) -> None:
+        # 還沒送過任何請求 (不知道 model) 時只能以 /health 為準
+        if self._probe_model is None:
+            self._mark_ok(rep)
+            return
+        payload = {
+            "model": self._probe_model,
+            "messages": [{"role": "user", "content": "ping"}],
+            "max_tokens": 1,
+            "temperature": 0,
+        }
+        try:
+            r = await rep.client.post(rep.url, json=payload, timeout=10.0)
+            ok = r.status_code < 400
+        except httpx.HTTPError:
+            ok = False
+        if ok:
+            self._mark_ok(rep)
+        else:
+            self._mark_failed(rep)
+
+    async def _health_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.health_interval_s)
+            await self.check_health()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "replicas": [r.stats() for r in self.replicas],
+            "healthy": sum(r.healthy for r in self.replicas),
+            "retries": self.retries,
+        }
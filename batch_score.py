@@ -0,0 +1,170 @@
+"""
+離線批次評分：讀 convert_to_swift_jsonl.py 產生的 messages 格式 JSONL，
+透過 app 的 /predict_batch 評分，輸出與 swift infer 相同格式 (加上 response / labels)
+的 JSONL，可直接交給 evaluation.py。
+
+- 輸出依輸入順序寫入；中斷後以相同參數重跑會從已完成的行數接續 (最後一行不完整會被截掉)
+- 每個 chunk 以 NDJSON 串流送出，同時最多 --inflight-chunks 個 chunk 在途
+- 回傳 error (429/503 等) 的筆數會在同一個 chunk 內退避重送
+
+python batch_score.py --input ./real_data/test.jsonl --output ./inference_data/app_test_results.jsonl
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from typing import Any, Dict, Iterator, List
+
+import httpx
+
+from convert_to_swift_jsonl import extract_conversation, record_label
+
+
+def _resume_point(path: str) -> int:
+    # 回傳已完成的行數；若最後一行沒寫完 (沒有換行) 就截掉
+    if not os.path.exists(path):
+        return 0
+    with open(path, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end != len(data):
+            f.truncate(end)
+    return data[:end].count(b"\n")
+
+
+def _iter_chunks(path: str, skip: int, size: int) -> Iterator[List[Dict[str, Any]]]:
+    chunk = []
+    n = 0
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            n += 1
+            if n <= skip:
+                continue
+            chunk.append(json.loads(line))
+            if len(chunk) >= size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+def _annotate(record: Dict[str, Any], res: Dict[str, Any]) -> Dict[str, Any]:
+    out = {"response": res["output"]}
+    if "label" in record or "labels" in record:
+        out["labels"] = "True" if record_label(record) == 1 else "False"
+    for k, v in record.items():
+        if k not in ("response", "labels", "fraud_prob", "raw_prob"):
+            out[k] = v
+    if res.get("fraud_prob") is not None:
+        out["fraud_prob"] = res["fraud_prob"]
+    # 未校準的機率，confidence.py fit 只用這個 (fraud_prob 已套用線上的 PROB_CALIB_A / B)
+    if res.get("raw_prob") is not None:
+        out["raw_prob"] = res["raw_prob"]
+    return out
+
+
+async def _score_chunk(client: httpx.AsyncClient, records: List[Dict[str, Any]], args) -> List[str]:
+    items = [{"id": str(i), "text": extract_conversation(r)} for i, r in enumerate(records)]
+    results: Dict[str, Dict[str, Any]] = {}
+
+    for attempt in range(args.retries + 1):
+        todo = [it for it in items if it["id"] not in results]
+        if not todo:
+            break
+        if attempt:
+            await asyncio.sleep(min(30.0, 2.0 ** attempt))
+        body = "".join(json.dumps(it, ensure_ascii=False) + "\n" for it in todo)
+        try:
+            async with client.stream(
+                "POST", args.url, content=body.encode("utf-8"),
+                headers={"Content-Type": "application/x-ndjson"},
+                params={"priority": "batch"},
+            ) as r:
+                r.raise_for_status()
+                async for line in r.aiter_lines():
+                    if not line.strip():
+                        continue
+                    res = json.loads(line)
+                    if "error" not in res:
+                        results[res["id"]] = res
+        except httpx.HTTPError as e:
+            print(f"[Warning] chunk 送出失敗 (第 {attempt + 1} 次): {e}")
+
+    missing = len(items) - len(results)
+    if missing:
+        raise RuntimeError(f"{missing} 筆重試 {args.retries} 次後仍失敗")
+    return [
+        json.dumps(_annotate(rec, results[str(i)]), ensure_ascii=False) + "\n"
+        for i, rec in enumerate(records)
+    ]
+
+
+async def run(args) -> None:
+    done = _resume_point(args.output)
+    if done:
+        print(f"接續先前的進度: 已完成 {done} 筆")
+
+    sem = asyncio.Semaphore(args.inflight_chunks)
+    finished: Dict[int, List[str]] = {}
+    next_write = 0
+    n_written = 0
+    start = time.monotonic()
+
+    async with httpx.AsyncClient(timeout=None) as client:
+        with open(args.output, "a", encoding="utf-8") as out:
+
+            async def one(idx: int, chunk: List[Dict[str, Any]]) -> None:
+                nonlocal next_write, n_written
+                try:
+                    finished[idx] = await _score_chunk(client, chunk, args)
+                finally:
+                    sem.release()
+                # 依輸入順序寫出，中斷時輸出檔永遠是輸入的前綴
+                while next_write in finished:
+                    lines = finished.pop(next_write)
+                    out.writelines(lines)
+                    out.flush()
+                    next_write += 1
+                    n_written += len(lines)
+                    elapsed = time.monotonic() - start
+                    print(f"[{done + n_written}] {n_written / elapsed:.1f} records/s")
+
+            tasks = []
+            for idx, chunk in enumerate(_iter_chunks(args.input, done, args.chunk_size)):
+                await sem.acquire()
+                tasks.append(asyncio.ensure_future(one(idx, chunk)))
+                # 有 chunk 失敗就停止送新的
+                failed = [t for t in tasks if t.done() and t.exception() is not None]
+                if failed:
+                    break
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+
+    errors = [r for r in results if isinstance(r, BaseException)]
+    elapsed = time.monotonic() - start
+    print("=" * 80)
+    print(f"Wrote: {args.output} (+{n_written} lines, 共 {done + n_written} lines)")
+    print(f"   - 耗時:     {elapsed:.1f} s")
+    print(f"   - 吞吐量:   {n_written / elapsed if elapsed else 0.0:.1f} records/s")
+    print("=" * 80)
+    if errors:
+        raise errors[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--input", required=True, help="messages 格式 JSONL")
+    parser.add_argument("--output", required=True, help="輸出 (可接續) 的 JSONL")
+    parser.add_argument("--url", default="http://localhost:9000/predict_batch")
+    parser.add_argument("--chunk-size", type=int, default=256)
+    parser.add_argument("--inflight-chunks", type=int, default=4)
+    parser.add_argument("--retries", type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import asyncio
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+
+FlushFn = Callable[[List[Any]], Awaitable[List[Any]]]
+
+
+class MicroBatcher:
+    """
+    把在同一個時間窗內抵達的請求聚成一批，一次交給 flush_fn 處理，
+    再把每一筆結果交回給送出它的那個請求。
+
+    參數:
+    flush_fn: async (items) -> results，results 需與 items 等長且同順序；
+              單筆失敗可以直接在該位置放 Exception，只會影響那一筆。
+    window_s (float): 收集時間窗 (秒)，第一筆進來後開始計時
+    max_size (int): 批次上限，湊滿就立即送出，不等時間窗
+    """
+
+    def __init__(self, flush_fn: FlushFn, window_s: float, max_size: int):
+        if max_size < 1:
+            raise ValueError("max_size 必須 >= 1")
+        self._flush_fn = flush_fn
+        self.window_s = window_s
+        self.max_size = max_size
+
+        self._pending: List[Tuple[Any, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._inflight: set = set()
+
+        # 批次大小分佈 (size -> 次數)，給調整 window / max_size 用
+        self.histogram: Counter = Counter()
+        self.items_total = 0
+
+    async def submit(self, item: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._pending.append((item, fut))
+
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window_s, self._flush)
+
+        return await fut
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+
+        batch, self._pending = self._pending, []
+        task = asyncio.ensure_future(self._run(batch))
+        # 保留 reference，避免 task 在執行中被 GC
+        self._inflight.add(task)
+        task.add_done_callback(self._inflight.discard)
+
+    async def _run(self, batch: List[Tuple[Any, asyncio.Future]]) -> None:
+        self.histogram[len(batch)] += 1
+        self.items_total += len(batch)
+
+        try:
+            results = await self._flush_fn([item for item, _ in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(
+                    f"flush_fn 回傳 {len(results)} 筆，預期 {len(batch)} 筆"
+                )
+        except Exception as e:
+            results = [e] * len(batch)
+
+        for (_, fut), res in zip(batch, results):
+            if fut.done():  # 呼叫端已取消
+                continue
+            if isinstance(res, BaseException):
+                fut.set_exception(res)
+            else:
+                fut.set_result(res)
+
+    async def aclose(self) -> None:
+        """送出剩餘的請求並等待所有批次完成。"""
+        self._flush()
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        batches = sum(self.histogram.values())
+        return {
+            "window_ms": self.window_s * 1000.0,
+            "max_size": self.max_size,
+            "batches": batches,
+            "items": self.items_total,
+            "mean_batch_size": (self.items_total / batches) if batches else 0.0,
+            "pending": len(self._pending),
+            "histogram": {str(k): v for k, v in sorted(self.histogram.items())},
+        }
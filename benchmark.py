@@ -0,0 +1,266 @@
+"""
+app.py 的壓測工具：重播測試集的對話打 /predict_json，統計吞吐量、延遲分位數與錯誤率，
+結果存成 JSON，可用 --baseline 和之前的結果比較。
+
+兩種負載模式：
+- --rps N:          open loop，依 Poisson 到達 (或 --arrival fixed) 固定速率送出，不管前面的有沒有回來
+- --concurrency N:  closed loop，維持 N 個請求在途，測最大吞吐量
+
+沒有 GPU 時搭配 mock_vllm.py：
+python mock_vllm.py --port 8000 --latency-ms 40 &
+VLLM_URL=http://localhost:8000/v1/chat/completions uvicorn app:app --port 9000 &
+python benchmark.py --input ./real_data/test.jsonl --rps 50 --duration 30 --output ./bench/rps50.json
+python benchmark.py --input ./syn_data/syn_test_sampled.jsonl --concurrency 64 --requests 2000 \\
+    --baseline ./bench/c64.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from convert_to_swift_jsonl import extract_conversation, read_jsonl
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """最近秩 (nearest-rank) 分位數；sorted_values 需已排序。"""
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, max(0, int(round(q * len(sorted_values))) - 1))
+    return sorted_values[idx]
+
+
+def load_texts(paths: List[str]) -> List[str]:
+    texts = []
+    for path in paths:
+        texts.extend(extract_conversation(r) for r in read_jsonl(path))
+    return [t for t in texts if t]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.status: Counter = Counter()
+        self.verdicts: Counter = Counter()
+        self.sent = 0
+
+    def record(self, latency_s: float, status: str, verdict: Optional[str] = None) -> None:
+        self.status[status] += 1
+        if status == "200":
+            self.latencies.append(latency_s)
+            if verdict is not None:
+                self.verdicts[verdict] += 1
+
+    def summary(self, elapsed_s: float) -> Dict[str, Any]:
+        lat = sorted(self.latencies)
+        n_done = sum(self.status.values())
+        n_ok = self.status.get("200", 0)
+        return {
+            "sent": self.sent,
+            "completed": n_done,
+            "ok": n_ok,
+            "elapsed_s": elapsed_s,
+            "throughput_rps": n_ok / elapsed_s if elapsed_s else 0.0,
+            "offered_rps": self.sent / elapsed_s if elapsed_s else 0.0,
+            "error_rate": (n_done - n_ok) / n_done if n_done else 0.0,
+            "status": dict(self.status),
+            "verdicts": dict(self.verdicts),
+            "latency_ms": {
+                "mean": 1000.0 * sum(lat) / len(lat) if lat else 0.0,
+                "p50": 1000.0 * percentile(lat, 0.50),
+                "p90": 1000.0 * percentile(lat, 0.90),
+                "p95": 1000.0 * percentile(lat, 0.95),
+                "p99": 1000.0 * percentile(lat, 0.99),
+                "max": 1000.0 * lat[-1] if lat else 0.0,
+            },
+        }
+
+
+async def _send(client: httpx.AsyncClient, args, text: str, rec: Recorder) -> None:
+    body: Dict[str, Any] = {"text": text, "priority": args.priority}
+    if args.deadline_ms is not None:
+        body["deadline_ms"] = args.deadline_ms
+    rec.sent += 1
+    start = time.perf_counter()
+    try:
+        r = await client.post(args.url, json=body)
+        latency = time.perf_counter() - start
+        verdict = r.json().get("output") if r.status_code == 200 else None
+        rec.record(latency, str(r.status_code), verdict)
+    except httpx.TimeoutException:
+        rec.record(time.perf_counter() - start, "timeout")
+    except httpx.HTTPError as e:
+        rec.record(time.perf_counter() - start, type(e).__name__)
+
+
+def _text_stream(texts: List[str], args):
+    rng = random.Random(args.seed)
+    i = 0
+    while True:
+        if args.shuffle and i % len(texts) == 0:
+            rng.shuffle(texts)
+        text = texts[i % len(texts)]
+        if args.bust_cache:
+            # 加上不同的結尾，避免壓到的全是 verdict cache
+            text = f"{text}\n[{i}]"
+        yield i, text
+        i += 1
+
+
+def _should_stop(i: int, start: float, args) -> bool:
+    if args.requests and i >= args.requests:
+        return True
+    return bool(args.duration) and time.perf_counter() - start >= args.duration
+
+
+async def run_open_loop(client, texts, args, rec: Recorder) -> float:
+    rng = random.Random(args.seed)
+    tasks = set()
+    start = time.perf_counter()
+    next_at = start
+    for i, text in _text_stream(texts, args):
+        if _should_stop(i, start, args):
+            break
+        delay = next_at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        t = asyncio.ensure_future(_send(client, args, text, rec))
+        tasks.add(t)
+        t.add_done_callback(tasks.discard)
+        gap = 1.0 / args.rps
+        next_at += rng.expovariate(args.rps) if args.arrival == "poisson" else gap
+    if tasks:
+        await asyncio.gather(*tasks)
+    return time.perf_counter() - start
+
+
+async def run_closed_loop(client, texts, args, rec: Recorder) -> float:
+    stream = _text_stream(texts, args)
+    start = time.perf_counter()
+
+    async def worker() -> None:
+        for i, text in stream:
+            if _should_stop(i, start, args):
+                return
+            await _send(client, args, text, rec)
+
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    return time.perf_counter() - start
+
+
+async def _fetch_stats(client: httpx.AsyncClient, url: str) -> Optional[Dict[str, Any]]:
+    try:
+        r = await client.get(url, timeout=5.0)
+        r.raise_for_status()
+        return r.json()
+    except (httpx.HTTPError, ValueError):
+        return None
+
+
+async def run(args) -> Dict[str, Any]:
+    texts = load_texts(args.input)
+    if not texts:
+        raise SystemExit("輸入檔沒有可用的對話")
+
+    limits = httpx.Limits(max_connections=args.max_connections, max_keepalive_connections=args.max_connections)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        if args.warmup:
+            warm = Recorder()
+            await asyncio.gather(*(_send(client, args, t, warm) for t in texts[:args.warmup]))
+
+        rec = Recorder()
+        if args.rps:
+            elapsed = await run_open_loop(client, texts, args, rec)
+        else:
+            elapsed = await run_closed_loop(client, texts, args, rec)
+        server_stats = await _fetch_stats(client, args.stats_url) if args.stats_url else None
+
+    return {
+        "config": {
+            "url": args.url,
+            "input": args.input,
+            "mode": "open" if args.rps else "closed",
+            "rps": args.rps,
+            "arrival": args.arrival,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "duration": args.duration,
+            "priority": args.priority,
+            "bust_cache": args.bust_cache,
+        },
+        "results": rec.summary(elapsed),
+        "server_stats": server_stats,
+    }
+
+
+def _report(out: Dict[str, Any], baseline: Optional[Dict[str, Any]]) -> None:
+    r = out["results"]
+    cfg = out["config"]
+    load = f"{cfg['rps']} rps ({cfg['arrival']})" if cfg["mode"] == "open" else f"concurrency {cfg['concurrency']}"
+    print("=" * 80)
+    print(f"🚀 壓測結果: {cfg['url']} ({load})")
+    print(f"   - 送出 / 完成 / 成功:  {r['sent']} / {r['completed']} / {r['ok']}")
+    print(f"   - 耗時:                {r['elapsed_s']:.1f} s")
+    print(f"   - 吞吐量:              {r['throughput_rps']:.1f} req/s (送出 {r['offered_rps']:.1f} req/s)")
+    print(f"   - 錯誤率:              {r['error_rate']:.2%} {r['status']}")
+    print(f"   - 延遲 (ms):           p50={r['latency_ms']['p50']:.1f}  p95={r['latency_ms']['p95']:.1f}  "
+          f"p99={r['latency_ms']['p99']:.1f}  max={r['latency_ms']['max']:.1f}")
+    if baseline is not None:
+        b = baseline["results"]
+        print("-" * 80)
+        print(f"{'vs. baseline':<24}{'baseline':>14}{'current':>14}{'change':>14}")
+        rows = [("throughput (req/s)", b["throughput_rps"], r["throughput_rps"])]
+        rows += [(f"{k} (ms)", b["latency_ms"][k], r["latency_ms"][k]) for k in ("p50", "p95", "p99")]
+        rows.append(("error rate", b["error_rate"], r["error_rate"]))
+        for name, old, new in rows:
+            change = f"{(new - old) / old:+.1%}" if old else "-"
+            print(f"{name:<24}{old:>14.4f}{new:>14.4f}{change:>14}")
+    print("=" * 80)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--input", nargs="+", default=["./real_data/test.jsonl"])
+    parser.add_argument("--url", default="http://localhost:9000/predict_json")
+    parser.add_argument("--stats-url", default="http://localhost:9000/stats", help="結束時抓 app 狀態 (空字串 = 不抓)")
+    load = parser.add_mutually_exclusive_group()
+    load.add_argument("--rps", type=float, default=0.0, help="open loop 的目標速率")
+    load.add_argument("--concurrency", type=int, default=32, help="closed loop 的在途請求數")
+    parser.add_argument("--arrival", choices=["poisson", "fixed"], default="poisson")
+    parser.add_argument("--requests", type=int, default=0, help="總請求數 (0 = 只看 --duration)")
+    parser.add_argument("--duration", type=float, default=30.0, help="最長秒數 (0 = 只看 --requests)")
+    parser.add_argument("--warmup", type=int, default=0, help="正式開始前先送幾筆 (不計入結果)")
+    parser.add_argument("--priority", choices=["live", "batch"], default="live")
+    parser.add_argument("--deadline-ms", type=float, default=None)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--max-connections", type=int, default=1000)
+    parser.add_argument("--shuffle", action="store_true")
+    parser.add_argument("--bust-cache", action="store_true", help="每筆對話加上不同結尾，繞過 verdict cache")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="結果 JSON")
+    parser.add_argument("--baseline", default=None, help="之前的結果 JSON，用來比較")
+    args = parser.parse_args()
+    if not args.requests and not args.duration:
+        parser.error("--requests 與 --duration 至少要給一個")
+
+    out = asyncio.run(run(args))
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    _report(out, baseline)
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(out, f, ensure_ascii=False, indent=2)
+        print(f"Wrote: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Any, Dict, Optional
+
+import httpx
+
+from backend_pool import BackendPool
+
+
+class Tier:
+    """
+    一個模型後端 (一個 served model，可能有多個 replica)。各自有併發上限與延遲預算，
+    超過上限的請求在 semaphore 上排隊，排隊時間也算在預算內。
+
+    參數:
+    name (str): 顯示用名稱，例如 "sft_8b"、"base_70b_awq"
+    pool (BackendPool): 此模型的 replica 池
+    model (str): served_model_name
+    max_concurrency (int): 同時送往此後端的請求上限
+    timeout_s (float): 單筆請求 (含排隊) 的延遲預算
+    """
+
+    def __init__(self, name: str, pool: BackendPool, model: str, max_concurrency: int, timeout_s: float):
+        self.name = name
+        self.pool = pool
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.timeout_s = timeout_s
+        self._sem = asyncio.Semaphore(max_concurrency)
+
+        self.inflight = 0
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+
+    async def post(self, payload: Dict[str, Any]) -> httpx.Response:
+        payload = dict(payload, model=self.model)
+        self.calls += 1
+        try:
+            return await asyncio.wait_for(self._post(payload), self.timeout_s)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+        except Exception:
+            self.errors += 1
+            raise
+
+    async def _post(self, payload: Dict[str, Any]) -> httpx.Response:
+        async with self._sem:
+            self.inflight += 1
+            try:
+                return await self.pool.post(payload)
+            finally:
+                self.inflight -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "model": self.model,
+            "max_concurrency": self.max_concurrency,
+            "timeout_s": self.timeout_s,
+            "inflight": self.inflight,
+            "calls": self.calls,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "pool": self.pool.stats(),
+        }
+
+
+class CascadeRouter:
+    """
+    兩階段判定：先用便宜的模型評分，只有「不確定」或「太長」的對話才升級到大模型。
+
+    參數:
+    low / high (float): fraud_prob 落在 [low, high] 之間視為不確定
+    long_chars (int): 對話長度超過此值一律升級 (0 = 不看長度)
+    """
+
+    def __init__(self, low: float, high: float, long_chars: int):
+        self.low = low
+        self.high = high
+        self.long_chars = long_chars
+
+        self.escalated = {"uncertain": 0, "long": 0}
+        self.fallbacks = 0  # 升級失敗 / 超過預算，沿用第一階段結果
+        self.total = 0
+
+    def escalation_reason(self, conversation: str, fraud_prob: Optional[float]) -> Optional[str]:
+        self.total += 1
+        reason = None
+        if self.long_chars and len(conversation) > self.long_chars:
+            reason = "long"
+        elif fraud_prob is not None and self.low <= fraud_prob <= self.high:
+            reason = "uncertain"
+        if reason is not None:
+            self.escalated[reason] += 1
+        return reason
+
+    def stats(self) -> Dict[str, Any]:
+        n_esc = sum(self.escalated.values())
+        return {
+            "band": [self.low, self.high],
+            "long_chars": self.long_chars,
+            "total": self.total,
+            "escalated": dict(self.escalated),
+            "escalation_rate": (n_esc / self.total) if self.total else 0.0,
+            "fallbacks": self.fallbacks,
+        }
@@ -0,0 +1,242 @@
+"""
+資料集 / 推論結果 JSONL 的欄位式快取 (memory-mapped numpy 陣列)。
+
+JSONL 仍是交換格式；第一次讀取時轉成 <來源資料夾>/.colcache/<檔名>/ 底下的欄位檔，
+之後直接 mmap，不再重複解析 JSON、也不用每筆都從 prompt 裡用 regex 撈 <conversation>：
+
+- lengths.npy (uint32)  對話字元長度
+- labels.npy  (int8)    1 / 0 / -1 (無法解析)
+- scores.npy  (float64) 詐騙機率 (fraud_prob 或 logprobs)，沒有時為 NaN
+- keys.npy    (int64)   對話內容 hash
+- lines.npy   (uint32)  原始檔的行號
+- conv_idx.npy (uint32) 每筆對到去重後的第幾段對話
+- conv.bin + conv_off.npy          去重後的對話文字 (不含 SYSTEM_PROMPT / 指令)
+- resp.bin + resp_off.npy          response 原文 (資料集沒有時為空字串)
+- preds_<parser>.npy (int8)        依 parser 解析後的預測，第一次用到時才產生
+- meta.json                        來源檔的 mtime / size 與格式版本，任一不符就重建
+
+python columnar.py build "./inference_data/*.jsonl" ./real_data/test.jsonl
+python columnar.py info ./inference_data/sft_8b_infer_test_results_108_v4.jsonl
+"""
+import argparse
+import json
+import os
+import shutil
+import time
+from array import array
+from typing import Any, Dict, Iterator, Optional
+
+import numpy as np
+
+from convert_to_swift_jsonl import extract_conversation
+from evaluation import (
+    DETECT_SAMPLE,
+    conversation_key,
+    detect_parser,
+    expand_paths,
+    get_parser,
+    item_score,
+    parse_label,
+)
+
+
+FORMAT_VERSION = 1
+CACHE_DIRNAME = ".colcache"
+
+
+def default_cache_dir(path: str) -> str:
+    return os.path.join(os.path.dirname(os.path.abspath(path)), CACHE_DIRNAME, os.path.basename(path))
+
+
+def _source_stat(path: str) -> Dict[str, Any]:
+    st = os.stat(path)
+    return {"source": os.path.abspath(path), "mtime_ns": st.st_mtime_ns, "size": st.st_size,
+            "version": FORMAT_VERSION}
+
+
+class _Blob:
+    """把字串依序寫進一個 utf-8 blob，另外記錄 offsets"""
+
+    def __init__(self, path: str):
+        self.f = open(path, 'wb')
+        self.offsets = array('Q', [0])
+
+    def add(self, text: str) -> int:
+        data = text.encode('utf-8')
+        self.f.write(data)
+        self.offsets.append(self.offsets[-1] + len(data))
+        return len(self.offsets) - 2
+
+    def close(self, offsets_path: str) -> None:
+        self.f.close()
+        np.save(offsets_path, np.frombuffer(self.offsets, dtype=np.uint64))
+
+
+def build(path: str, cache_dir: Optional[str] = None) -> str:
+    """把一個 JSONL 轉成欄位檔 (先寫到暫存資料夾再換上，避免留下寫一半的快取)"""
+    cache_dir = cache_dir or default_cache_dir(path)
+    tmp = f"{cache_dir}.tmp{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    meta = _source_stat(path)
+    cols = {
+        "lengths": array('I'), "labels": array('b'), "scores": array('d'),
+        "keys": array('q'), "lines": array('I'), "conv_idx": array('I'),
+    }
+    conv = _Blob(os.path.join(tmp, "conv.bin"))
+    resp = _Blob(os.path.join(tmp, "resp.bin"))
+    seen: Dict[int, int] = {}
+    invalid = 0
+
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError:
+                invalid += 1
+                continue
+            text = extract_conversation(item)
+            key = conversation_key(text)
+            idx = seen.get(key)
+            if idx is None:
+                idx = seen[key] = conv.add(text)
+            cols["lengths"].append(len(text))
+            cols["labels"].append(parse_label(item))
+            cols["scores"].append(item_score(item))
+            cols["keys"].append(key)
+            cols["lines"].append(line_no)
+            cols["conv_idx"].append(idx)
+            resp.add(str(item.get('response') or ''))
+
+    conv.close(os.path.join(tmp, "conv_off.npy"))
+    resp.close(os.path.join(tmp, "resp_off.npy"))
+    for name, arr in cols.items():
+        np.save(os.path.join(tmp, f"{name}.npy"), np.frombuffer(arr, dtype=np.dtype(arr.typecode)) if len(arr)
+                else np.zeros(0, dtype=np.dtype(arr.typecode)))
+
+    meta.update({"n": len(cols["lengths"]), "unique_conversations": len(seen), "invalid_lines": invalid,
+                 "has_response": resp.offsets[-1] > 0, "built_at": time.time()})
+    with open(os.path.join(tmp, "meta.json"), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    os.makedirs(os.path.dirname(cache_dir), exist_ok=True)
+    os.replace(tmp, cache_dir)
+    return cache_dir
+
+
+def is_fresh(path: str, cache_dir: str) -> bool:
+    try:
+        with open(os.path.join(cache_dir, "meta.json"), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return False
+    current = _source_stat(path)
+    return all(meta.get(k) == v for k, v in current.items())
+
+
+class ColumnarTable:
+    """一個快取好的檔案；數值欄位都是唯讀的 memmap"""
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        with open(os.path.join(cache_dir, "meta.json"), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        load = lambda name: np.load(os.path.join(cache_dir, f"{name}.npy"), mmap_mode='r')
+        self.lengths = load("lengths")
+        self.labels = load("labels")
+        self.scores = load("scores")
+        self.keys = load("keys")
+        self.lines = load("lines")
+        self.conv_idx = load("conv_idx")
+        self._conv_off = load("conv_off")
+        self._resp_off = load("resp_off")
+        self._conv = self._blob("conv.bin")
+        self._resp = self._blob("resp.bin")
+
+    def _blob(self, name: str) -> np.ndarray:
+        p = os.path.join(self.cache_dir, name)
+        # 空檔案不能 mmap
+        return np.memmap(p, dtype=np.uint8, mode='r') if os.path.getsize(p) else np.zeros(0, np.uint8)
+
+    def __len__(self) -> int:
+        return int(self.meta["n"])
+
+    @property
+    def invalid_lines(self) -> int:
+        return int(self.meta.get("invalid_lines", 0))
+
+    def conversation(self, i: int) -> str:
+        j = int(self.conv_idx[i])
+        return bytes(self._conv[self._conv_off[j]:self._conv_off[j + 1]]).decode('utf-8')
+
+    def response(self, i: int) -> str:
+        return bytes(self._resp[self._resp_off[i]:self._resp_off[i + 1]]).decode('utf-8')
+
+    def iter_responses(self) -> Iterator[str]:
+        for i in range(len(self)):
+            yield self.response(i)
+
+    def resolve_parser(self, parser: str) -> str:
+        if parser != "auto":
+            return parser
+        n = min(len(self), DETECT_SAMPLE)
+        return detect_parser(self.response(i) for i in range(n))
+
+    def preds(self, parser: str = "auto") -> np.ndarray:
+        """依 parser 解析後的預測；第一次用到時從 resp.bin 解析並存檔"""
+        parser = self.resolve_parser(parser)
+        p = os.path.join(self.cache_dir, f"preds_{parser}.npy")
+        if not os.path.exists(p):
+            parse = get_parser(parser)
+            out = np.fromiter((parse(r) for r in self.iter_responses()), dtype=np.int8, count=len(self))
+            tmp = f"{p}.tmp{os.getpid()}.npy"
+            np.save(tmp, out)
+            os.replace(tmp, p)
+        return np.load(p, mmap_mode='r')
+
+
+def open_table(path: str, cache_dir: Optional[str] = None, rebuild: bool = False) -> ColumnarTable:
+    """開啟 path 的欄位快取；不存在或來源檔已變更就重建"""
+    cache_dir = cache_dir or default_cache_dir(path)
+    if rebuild or not is_fresh(path, cache_dir):
+        build(path, cache_dir)
+    return ColumnarTable(cache_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_build = sub.add_parser("build", help="建立 (或更新過期的) 欄位快取")
+    p_build.add_argument("paths", nargs="+")
+    p_build.add_argument("--force", action="store_true", help="不管是否過期都重建")
+    p_info = sub.add_parser("info", help="顯示快取狀態")
+    p_info.add_argument("paths", nargs="+")
+    args = parser.parse_args()
+
+    for path in expand_paths(args.paths):
+        cache_dir = default_cache_dir(path)
+        if args.cmd == "build":
+            fresh = is_fresh(path, cache_dir) and not args.force
+            if not fresh:
+                start = time.perf_counter()
+                build(path, cache_dir)
+                print(f"built  {path} -> {cache_dir} ({time.perf_counter() - start:.2f} s)")
+            else:
+                print(f"fresh  {path}")
+        else:
+            if not is_fresh(path, cache_dir):
+                print(f"stale  {path}")
+                continue
+            t = ColumnarTable(cache_dir)
+            size = sum(os.path.getsize(os.path.join(cache_dir, f)) for f in os.listdir(cache_dir))
+            print(f"fresh  {path}: n={len(t)}, unique conversations={t.meta['unique_conversations']}, "
+                  f"cache {size / 1e6:.1f} MB vs source {t.meta['size'] / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
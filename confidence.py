@@ -0,0 +1,149 @@
+"""
+從模型第一個輸出 token 的 top logprobs 算出詐騙機率，並做 Platt scaling 校準。
+
+python confidence.py fit scored.jsonl   # 需要每行有 raw_prob 或 logprobs，與 label/labels
+
+fit 只能用未校準的機率 (app.py 把校準套在原始機率上)：
+- batch_score.py 的輸出：raw_prob (fraud_prob 已經過線上的 PROB_CALIB_A / B，不能拿來重新擬合)
+- swift infer --logprobs true / infer_runner.py 的輸出：從 logprobs 以 fraud_probability 計算
+兩者都沒有的行會略過。
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import math
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+
+_TRUE_TOKENS = ("true",)
+_FALSE_TOKENS = ("false",)
+_EPS = 1e-6
+
+
+def fraud_probability(choice: Dict[str, Any]) -> Optional[float]:
+    """
+    從 chat completions 的 choice 取出 P(True) / (P(True) + P(False))。
+    top_logprobs 裡 "True" / " True" / "true" 等變體會合併計算。
+    沒有 logprobs (後端不支援) 或兩者都不在 top-k 內時回傳 None。
+    """
+    content = (choice.get("logprobs") or {}).get("content") or []
+    if not content:
+        return None
+    top = content[0].get("top_logprobs") or []
+
+    p_true = 0.0
+    p_false = 0.0
+    for item in top:
+        tok = str(item.get("token", "")).strip().lower()
+        if tok in _TRUE_TOKENS:
+            p_true += math.exp(item.get("logprob", -math.inf))
+        elif tok in _FALSE_TOKENS:
+            p_false += math.exp(item.get("logprob", -math.inf))
+
+    if p_true + p_false <= 0.0:
+        return None
+    return p_true / (p_true + p_false)
+
+
+def _logit(p: float) -> float:
+    p = min(max(p, _EPS), 1.0 - _EPS)
+    return math.log(p / (1.0 - p))
+
+
+def _sigmoid(z: float) -> float:
+    if z >= 0:
+        return 1.0 / (1.0 + math.exp(-z))
+    ez = math.exp(z)
+    return ez / (1.0 + ez)
+
+
+def calibrate(p: float, a: float = 1.0, b: float = 0.0) -> float:
+    """Platt scaling: sigmoid(a * logit(p) + b)；a=1, b=0 時不改變機率。"""
+    if a == 1.0 and b == 0.0:
+        return p
+    return _sigmoid(a * _logit(p) + b)
+
+
+def fit_platt(pairs: Iterable[Tuple[float, int]], iters: int = 100) -> Tuple[float, float]:
+    """
+    以 Newton 法最小化 log loss，擬合 Platt scaling 的 (a, b)。
+
+    參數:
+    pairs: (未校準機率, label 0/1) 的序列
+    """
+    xs = []
+    ys = []
+    for p, y in pairs:
+        xs.append(_logit(p))
+        ys.append(float(y))
+    if not xs:
+        return 1.0, 0.0
+
+    a, b = 1.0, 0.0
+    for _ in range(iters):
+        g_a = g_b = 0.0
+        h_aa = h_ab = h_bb = 0.0
+        for x, y in zip(xs, ys):
+            q = _sigmoid(a * x + b)
+            r = q - y
+            w = q * (1.0 - q)
+            g_a += r * x
+            g_b += r
+            h_aa += w * x * x
+            h_ab += w * x
+            h_bb += w
+        # 加一點 ridge，避免完全可分時 Hessian 退化
+        h_aa += 1e-6
+        h_bb += 1e-6
+        det = h_aa * h_bb - h_ab * h_ab
+        if det <= 0:
+            break
+        da = (h_bb * g_a - h_ab * g_b) / det
+        db = (h_aa * g_b - h_ab * g_a) / det
+        a -= da
+        b -= db
+        if abs(da) < 1e-9 and abs(db) < 1e-9:
+            break
+    return a, b
+
+
+def raw_probability(item: Dict[str, Any]) -> Optional[float]:
+    """結果檔一行的未校準機率：raw_prob 優先，否則從 logprobs 計算；都沒有回傳 None"""
+    if item.get("raw_prob") is not None:
+        return float(item["raw_prob"])
+    if item.get("logprobs"):
+        return fraud_probability(item)
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_fit = sub.add_parser("fit", help="擬合 PROB_CALIB_A / PROB_CALIB_B")
+    p_fit.add_argument("path")
+    args = parser.parse_args()
+
+    pairs = []
+    skipped = 0
+    with open(args.path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            p = raw_probability(item)
+            if p is None:
+                skipped += 1
+                continue
+            raw = item.get("labels", item.get("label"))
+            pairs.append((float(p), 1 if str(raw).strip().lower() in ("1", "true") else 0))
+
+    a, b = fit_platt(pairs)
+    print(f"N={len(pairs)} (skipped {skipped} without raw_prob / logprobs)")
+    print(f"PROB_CALIB_A={a:.6f}")
+    print(f"PROB_CALIB_B={b:.6f}")
+
+
+if __name__ == "__main__":
+    main()
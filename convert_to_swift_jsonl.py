@@ -1,44 +1,75 @@
+"""
+把對話資料轉成 swift 訓練用的 messages 格式 JSONL。
+
+串流處理，資料量可以大於記憶體：
+- 多個輸入檔依序分塊讀取，交給多個 process 轉換 (長度過濾 + build_record)
+- 依對話內容 hash 一次分出 train / val / test (重複的對話不會跨 split)
+- 外部 shuffle：先隨機分到暫存 bucket，再逐 bucket 打亂，固定 seed 可完全重現
+- --dedup 以 MinHash/LSH 找近似重複 (dedup.py)，可丟棄或只回報，--dedup-index 讓之後的批次也能比對
+- 給 --max-model-len 時改以 token 長度過濾或截斷 (token_length.py)，取代 MAX_CHARS 字元過濾
+- 輸出可分片 (--shard-size)、可壓縮 (--compress)，並寫一份 manifest.json (筆數、詐騙筆數、sha256)
+
+python convert_to_swift_jsonl.py     # 同舊版: syn_data/all.jsonl -> syn_data/syn_test.jsonl
+python convert_to_swift_jsonl.py --inputs "./real_data/*.jsonl" "./syn_data/*.jsonl" \\
+    --out-dir ./datasets/v5 --prefix "" --splits train=0.8 val=0.1 test=0.1 --shard-size 100000 --compress
+"""
+import argparse
+import glob
+import gzip
+import hashlib
+import io
+import itertools
 import json
+import math
+import os
 import random
-from typing import List, Dict, Any, Tuple
+import re
+import shutil
+import time
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Iterator, NamedTuple, Optional, Tuple
+
+from prompts import PROMPTS, get_prompt
+from prompts import SYSTEM_PROMPT  # noqa: F401  原本定義在這裡，保留給 `from convert_to_swift_jsonl import SYSTEM_PROMPT` 的舊腳本
+from token_length import CHARS_PER_TOKEN, DEFAULT_TOKENIZER, POLICIES, conversation_budget, fit, get_counter
 
 MAX_CHARS = 4500
 SEED = 42
 
-SYSTEM_PROMPT = """You are a strict binary classification system specialized in fraud detection. Your task is to analyze a conversation log between two parties and determine if it exhibits characteristics of a scam or fraudulent intent.
-
-**Input Format:**
-The user will provide a conversation text enclosed within <conversation> tags.
-
-**Classification Criteria:**
-- Output 'True': If the conversation contains evidence of scamming, phishing, social engineering, financial fraud, or malicious intent by either party.
-- Output 'False': If the conversation appears to be a normal, benign interaction without fraudulent intent.
-
-**Output Constraints (CRITICAL):**
-1. You must output EXACTLY one word: "True" or "False".
-2. Do NOT output any explanation, reasoning, preamble, or punctuation.
-3. Do NOT output markdown formatting (e.g., no bold, no code blocks).
-4. Do NOT apologize or converse.
-5. If the input is empty or unintelligible, output "False" (as the safe default) or handle strictly as per specific edge-case logic.
-"""
-
-def build_record(dialogue: str, label: int, cut_pct: int) -> Dict[str, Any]:
-    user_prompt = (
-        "Here is the conversation log to classify: "
-        f"<conversation>\n{dialogue}\n</conversation>\n"
-        'Reminder: Based on the system instructions, output ONLY "True" or "False".'
-    )
+def build_record(dialogue: str, label: int, cut_pct: int, prompt: str = "full") -> Dict[str, Any]:
+    # prompt 需與推論時 app.py 的 PROMPT_VARIANT 相同 (見 prompts.py)
     assistant = "True" if int(label) == 1 else "False"
     return {
-        "messages": [
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {"role": "user", "content": user_prompt},
-            {"role": "assistant", "content": assistant},
-        ],
+        "messages": get_prompt(prompt).messages(dialogue) + [{"role": "assistant", "content": assistant}],
         "label": int(label),       # 保留，方便離線算 accuracy
         "cut_pct": int(cut_pct),   # 0
     }
 
+_CONVERSATION_RE = re.compile(r'<conversation>(.*?)</conversation>', re.DOTALL)
+
+def extract_conversation(record: Dict[str, Any]) -> str:
+    # 從 messages 格式取出 <conversation> 內的原始對話
+    for msg in record.get("messages") or []:
+        if msg.get("role") == "user":
+            content = msg.get("content", "")
+            match = _CONVERSATION_RE.search(content)
+            return match.group(1).strip() if match else content
+    return ""
+
+def record_label(record: Dict[str, Any]) -> int:
+    # label 可能是 0/1、"0"/"1" 或 "True"/"False" (推論結果檔用的是 labels)
+    raw = record.get("labels", record.get("label"))
+    return 1 if str(raw).strip().lower() in ("1", "true") else 0
+
+def truncate_dialogue(dialogue: str, cut_pct: int) -> str:
+    # 以「句」為單位截掉最後 cut_pct% 的對話，模擬通話進行到一半時的逐字稿
+    # cut_pct=0 為完整對話；至少保留一句
+    turns = [t for t in dialogue.split("\n") if t.strip()]
+    keep = max(1, math.ceil(len(turns) * (100 - int(cut_pct)) / 100))
+    return "\n".join(turns[:keep])
+
 def read_jsonl(path: str) -> List[Dict[str, Any]]:
     data = []
     with open(path, "r", encoding="utf-8") as f:
@@ -55,28 +86,439 @@ def write_jsonl(lines: List[Dict[str, Any]], path: str) -> None:
             f.write(json.dumps(ex, ensure_ascii=False) + "\n")
     print(f"Wrote: {path} ({len(lines)} lines)")
 
+def _open_text(path: str, mode: str = "r"):
+    # .gz 的輸入 / 輸出都走 gzip；寫入時 mtime 固定為 0，同樣內容的檔案 checksum 才會一樣
+    if path.endswith(".gz"):
+        if "r" in mode:
+            return gzip.open(path, "rt", encoding="utf-8")
+        return io.TextIOWrapper(gzip.GzipFile(filename="", mode="wb", fileobj=open(path, "wb"), mtime=0),
+                                encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+def iter_line_chunks(paths: List[str], chunk_size: int) -> Iterator[List[str]]:
+    # 依序讀多個輸入檔，每次吐出 chunk_size 行，不會整份讀進記憶體
+    chunk: List[str] = []
+    for path in paths:
+        with _open_text(path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                chunk.append(line)
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+    if chunk:
+        yield chunk
+
+def parse_splits(specs: List[str]) -> List[Tuple[str, float]]:
+    # "train=0.8" "val=0.1" "test=0.1" -> 正規化成比例總和為 1
+    splits = []
+    for spec in specs:
+        name, _, ratio = spec.partition("=")
+        if not name or not ratio or float(ratio) < 0:
+            raise ValueError(f"split 格式應為 name=ratio: {spec!r}")
+        splits.append((name, float(ratio)))
+    total = sum(r for _, r in splits)
+    if total <= 0:
+        raise ValueError("split 比例總和必須大於 0")
+    return [(name, r / total) for name, r in splits]
+
+def assign_split(dialogue: str, seed: int, cum_ratios: List[float]) -> int:
+    # 依對話內容的 hash 決定 split：同樣的對話 (跨檔重複也一樣) 一定落在同一個 split，與讀取順序無關
+    h = hashlib.blake2b(dialogue.encode("utf-8"), digest_size=8, key=str(seed).encode("utf-8")).digest()
+    u = int.from_bytes(h, "big") / 2.0 ** 64
+    for i, c in enumerate(cum_ratios):
+        if u < c:
+            return i
+    return len(cum_ratios) - 1
+
+def _dialogue_of(ex: Dict[str, Any]) -> str:
+    if "dialogue" in ex:
+        d = ex.get("dialogue")
+        return d if isinstance(d, str) else ""
+    return extract_conversation(ex)
+
+class ChunkJob(NamedTuple):
+    """
+    送給 worker 的一批資料與轉換設定 (要能 pickle 給 ProcessPoolExecutor)
+
+    lines: 原始 JSONL 行；可以是原始合成資料 ({"dialogue", "labels"}) 或已轉好的 messages 格式 (real_data/*.jsonl)
+    length: None 時以 max_chars 字元過濾；否則為 {"tokenizer", "chars_per_token", "budget", "policy"}，
+      改以 token 預算過濾或截斷 (見 token_length.fit)，整批對話一次編碼
+    minhash: 不為 None 時順便算每筆 (截斷後) 對話的 MinHash 簽章，給去重用；
+      值為 (num_perm, shingle, seed)，必須和比對的索引相同
+    prompt: prompts.py 的版本名稱
+    """
+    lines: List[str]
+    seed: int
+    cum_ratios: List[float]
+    max_chars: int
+    length: Optional[Dict[str, Any]]
+    minhash: Optional[Tuple[int, int, int]]
+    prompt: str
+
+def transform_chunk(job: ChunkJob) -> Tuple[List[Tuple[int, int, str]], Dict[str, int], Any]:
+    """
+    worker：把一批原始 JSONL 行轉成 swift 訓練格式。
+
+    參數:
+    job: ChunkJob
+
+    回傳:
+    ([(split 編號, label, 序列化後的 JSON 行)], 計數, 簽章 (n, NUM_PERM) 或 None)
+    """
+    lines, seed, cum_ratios, max_chars, length, minhash, prompt = job
+    out = []
+    stats = {"read": 0, "invalid": 0, "empty": 0, "too_long": 0, "truncated": 0, "over_chars": 0}
+    items = []
+    for line in lines:
+        stats["read"] += 1
+        try:
+            ex = json.loads(line)
+        except json.JSONDecodeError:
+            stats["invalid"] += 1
+            continue
+        if not isinstance(ex, dict):
+            stats["invalid"] += 1
+            continue
+        d = _dialogue_of(ex)
+        if not d.strip():
+            stats["empty"] += 1
+            continue
+        items.append((ex, d))
+
+    counter = None
+    if length is not None:
+        counter = get_counter(length["tokenizer"], length["chars_per_token"])
+        counter.count_batch([d for _, d in items])
+    kept = []
+    for ex, d in items:
+        if len(d) > max_chars:
+            stats["over_chars"] += 1
+        if counter is None:
+            if len(d) > max_chars:
+                stats["too_long"] += 1
+                continue
+        else:
+            fitted, _, truncated = fit(counter, d, length["budget"], length["policy"])
+            if fitted is None:
+                stats["too_long"] += 1
+                continue
+            stats["truncated"] += truncated
+            d = fitted
+        label = record_label(ex)
+        record = build_record(d, label, ex.get("cut_pct", 0) or 0, prompt)
+        out.append((assign_split(d, seed, cum_ratios), label, json.dumps(record, ensure_ascii=False) + "\n"))
+        kept.append(d)
+    sigs = None
+    if minhash is not None:
+        from dedup import get_hasher
+        sigs = get_hasher(*minhash).signatures(kept)
+    return out, stats, sigs
+
+def _map_chunks(jobs: Iterator[ChunkJob], workers: int) -> Iterator[Any]:
+    # 保持順序的平行 map；最多只有 workers * 2 個 chunk 在途，記憶體不會隨輸入變大
+    if workers <= 1:
+        for job in jobs:
+            yield transform_chunk(job)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        pending: deque = deque()
+        for job in jobs:
+            pending.append(ex.submit(transform_chunk, job))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def _file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def shard_name(prefix: str, split: str, idx: int, n_shards: int, ext: str) -> str:
+    if n_shards == 1:
+        return f"{prefix}{split}{ext}"
+    return f"{prefix}{split}-{idx:05d}-of-{n_shards:05d}{ext}"
+
+def _dedup_records(sig_path: str, rec_split: array, names: List[str], mode: str, index: Any,
+                   index_path: Optional[str], priority: Optional[List[str]], batch: str) -> Tuple[Dict[str, Any], bytearray]:
+    # 在所有簽章上分群、和既有索引比對，決定要丟哪幾筆；回傳 (manifest 用的統計, 每筆是否丟棄)
+    # 簽章是 worker 以 index 的 (num_perm, shingle, seed) 算的，才能和索引比對
+    import numpy as np
+    from dedup import cluster, resolve
+
+    sigs = np.fromfile(sig_path, dtype=np.uint32).reshape(-1, index.num_perm)
+    assert len(sigs) == len(rec_split), "signature count does not match the record count"
+    splits = np.frombuffer(rec_split, dtype=np.int16).astype(np.int64) if len(rec_split) else np.zeros(0, np.int64)
+    order = [n for n in (priority or ["test", "val", "train"]) if n in names]
+    order += [n for n in names if n not in order]
+    labels = cluster(sigs, index.threshold, index.bands, index.rows)
+    group_drop, st = resolve(labels, splits, [names.index(n) for n in order])
+    match, _ = index.query(sigs)
+    in_index = match >= 0
+    dup = group_drop | in_index
+
+    by_index_split: Dict[str, int] = {}
+    for m in match[in_index].tolist():
+        key = index.split_names[int(index.splits[m])]
+        by_index_split[key] = by_index_split.get(key, 0) + 1
+    info = {
+        "mode": mode,
+        "threshold": index.threshold,
+        "priority": order,
+        "within_split": {names[k]: v for k, v in st["within"].items()},
+        "cross_split": {f"{names[k]}~{names[d]}": v for (k, d), v in st["cross"].items()},
+        "index": index_path,
+        "index_size_before": len(index),
+        "index_matches": by_index_split,
+        "duplicates": int(dup.sum()),
+        "dropped": int(dup.sum()) if mode == "drop" else 0,
+    }
+    if index_path:
+        for s, name in enumerate(names):
+            index.add(sigs[(splits == s) & ~dup], split=name, batch=batch)
+        index.save(index_path)
+    drop = bytearray(dup.astype(np.uint8).tobytes()) if mode == "drop" else bytearray(len(rec_split))
+    return info, drop
+
+def build_dataset(inputs: List[str], out_dir: str, splits: List[Tuple[str, float]], *, prefix: str = "",
+                  seed: int = SEED, max_chars: int = MAX_CHARS, shard_size: int = 0, compress: bool = False,
+                  workers: int = 1, chunk_size: int = 2000, shuffle_buckets: int = 64,
+                  max_model_len: int = 0, length_policy: str = "filter", tokenizer: str = DEFAULT_TOKENIZER,
+                  chars_per_token: float = CHARS_PER_TOKEN, dedup: str = "off", dedup_threshold: Optional[float] = None,
+                  dedup_index: Optional[str] = None, dedup_priority: Optional[List[str]] = None,
+                  prompt: str = "full") -> Dict[str, Any]:
+    """
+    串流建立資料集：讀取 → 多 process 轉換 → 依 hash 分 split → 外部 shuffle → 分片寫出 + manifest。
+
+    shuffle 分兩段 (記憶體上限約為「輸出大小 / shuffle_buckets」)：
+    1) 每筆以 Random(seed) 隨機丟進該 split 的 shuffle_buckets 個暫存檔之一
+    2) 逐一把每個暫存檔讀進記憶體、以 Random(f"{seed}:{split}:{bucket}") 打亂後依序寫到分片
+    chunk 的處理結果依輸入順序回收，所以同樣的輸入、seed 與 bucket 數，輸出逐位元組相同 (與 workers 數無關)。
+
+    參數:
+    inputs: 輸入 JSONL (可為 .gz)，依給定順序讀取
+    splits: [(名稱, 比例)]，比例總和為 1
+    shard_size: 每個分片的筆數上限；0 表示每個 split 只寫一個檔
+    compress: 輸出 .jsonl.gz
+    max_model_len: > 0 時改用 token 長度：對話預算 = max_model_len - prompt 與 template 開銷，
+      依 length_policy (filter / head / recent / head_tail) 過濾或截斷；0 時沿用 max_chars 字元過濾
+    dedup: off / report / drop。以 MinHash/LSH (dedup.py) 找出同 split 內與跨 split 的近似重複，
+      report 只記在 manifest，drop 時每群只留一筆 (跨 split 時留在 dedup_priority 最前面的 split)
+    dedup_index: 既有的去重索引資料夾；和索引中任一筆近似的也算重複，結束後把這批留下的加進索引
+    dedup_threshold: None 時用索引建立時的值 (新索引為 0.7)；與既有索引不同時報錯
+    prompt: prompts.py 的版本名稱，token 預算也依此版本的 prompt 開銷計算
+
+    回傳:
+    manifest (同時寫到 <out_dir>/<prefix>manifest.json)
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    tmp_dir = os.path.join(out_dir, f".shuffle_tmp{os.getpid()}")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    names = [name for name, _ in splits]
+    cum_ratios = list(itertools.accumulate(r for _, r in splits))
+    rng = random.Random(seed)
+    ext = ".jsonl.gz" if compress else ".jsonl"
+
+    length = None
+    if max_model_len > 0:
+        counter = get_counter(tokenizer, chars_per_token)
+        length = {
+            "tokenizer": tokenizer, "chars_per_token": chars_per_token, "policy": length_policy,
+            "budget": conversation_budget(counter, max_model_len, build_record("", 0, 0, prompt)["messages"][:2]),
+            "backend": counter.backend,
+        }
+
+    index = None
+    minhash = None
+    if dedup != "off":
+        from dedup import DedupIndex
+
+        # 簽章參數以索引為準 (新索引為 dedup.py 的預設值)
+        index = DedupIndex.open(dedup_index, dedup_threshold)
+        minhash = (index.num_perm, index.shingle, index.seed)
+
+    totals = {"read": 0, "invalid": 0, "empty": 0, "too_long": 0, "truncated": 0, "over_chars": 0}
+    # 每筆的 split 與 label (每筆 3 bytes)；去重後要重算各 split 的筆數
+    rec_split = array("h")
+    rec_label = array("b")
+    sig_path = os.path.join(tmp_dir, "sigs.bin")
+    dedup_info = None
+    try:
+        # 1) 轉換 + 分 split + 丟進 shuffle bucket
+        buckets = [[open(os.path.join(tmp_dir, f"{s}_{b}.jsonl"), "w", encoding="utf-8")
+                    for b in range(shuffle_buckets)] for s in range(len(names))]
+        sig_file = open(sig_path, "wb") if dedup != "off" else None
+        try:
+            jobs = (ChunkJob(chunk, seed, cum_ratios, max_chars, length, minhash, prompt)
+                    for chunk in iter_line_chunks(inputs, chunk_size))
+            for out, stats, sigs in _map_chunks(jobs, workers):
+                for k, v in stats.items():
+                    totals[k] += v
+                if sig_file is not None:
+                    sig_file.write(sigs.tobytes())
+                for s, label, line in out:
+                    b = rng.randrange(shuffle_buckets)
+                    # 暫存檔每行前面加上流水號，去重時才知道要丟哪幾筆
+                    buckets[s][b].write(f"{len(rec_split)}\t{line}")
+                    rec_split.append(s)
+                    rec_label.append(label)
+        finally:
+            for files in buckets:
+                for f in files:
+                    f.close()
+            if sig_file is not None:
+                sig_file.close()
+
+        drop = bytearray(len(rec_split))
+        if dedup != "off":
+            dedup_info, drop = _dedup_records(sig_path, rec_split, names, dedup, index,
+                                              dedup_index, dedup_priority, batch=os.path.abspath(out_dir))
+
+        n_kept = [0] * len(names)
+        n_fraud = [0] * len(names)
+        for i, (sp, label) in enumerate(zip(rec_split, rec_label)):
+            if not drop[i]:
+                n_kept[sp] += 1
+                n_fraud[sp] += label
+
+        # 2) 逐 bucket 打亂後寫分片
+        manifest_splits = {}
+        for s, name in enumerate(names):
+            n = n_kept[s]
+            n_shards = max(1, math.ceil(n / shard_size)) if shard_size else 1
+            per_shard = math.ceil(n / n_shards) if n else 0
+            shards = []
+            idx, written, f = 0, 0, None
+
+            def close_shard():
+                f.close()
+                path = os.path.join(out_dir, shard_name(prefix, name, idx, n_shards, ext))
+                shards.append({"file": os.path.basename(path), "n": written, "sha256": _file_sha256(path)})
+
+            for b in range(shuffle_buckets):
+                src = os.path.join(tmp_dir, f"{s}_{b}.jsonl")
+                with open(src, "r", encoding="utf-8") as fb:
+                    lines = fb.readlines()
+                os.remove(src)
+                random.Random(f"{seed}:{name}:{b}").shuffle(lines)
+                for line in lines:
+                    rid, line = line.split("\t", 1)
+                    if drop[int(rid)]:
+                        continue
+                    if f is not None and written >= per_shard:
+                        close_shard()
+                        idx, written, f = idx + 1, 0, None
+                    if f is None:
+                        f = _open_text(os.path.join(out_dir, shard_name(prefix, name, idx, n_shards, ext)), "w")
+                    f.write(line)
+                    written += 1
+            if f is None:
+                # 空的 split 也寫一個空檔，下游不用特別處理
+                f = _open_text(os.path.join(out_dir, shard_name(prefix, name, 0, 1, ext)), "w")
+            close_shard()
+            manifest_splits[name] = {"n": n, "n_fraud": n_fraud[s], "shards": shards}
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    manifest = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "inputs": [{"path": p, "size": os.path.getsize(p)} for p in inputs],
+        "seed": seed,
+        "prompt": prompt,
+        "max_chars": max_chars if length is None else None,
+        "length": length,
+        "ratios": dict(splits),
+        "shard_size": shard_size,
+        "shuffle_buckets": shuffle_buckets,
+        "compress": compress,
+        "counts": totals,
+        "dedup": dedup_info,
+        "written": sum(v["n"] for v in manifest_splits.values()),
+        "splits": manifest_splits,
+    }
+    with open(os.path.join(out_dir, f"{prefix}manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
 def main():
-    rng = random.Random(SEED)
-
-    raw = read_jsonl("./syn_data/all.jsonl")
-
-    # 1) 長度過濾 & 轉換
-    ms_records = []
-    for ex in raw:
-        d = ex.get("dialogue", "")
-        # 過濾長度 MAX_CHARS (4500)
-        if isinstance(d, str) and len(d) <= MAX_CHARS:
-             # 直接轉換，cut_pct=0
-             record = build_record(d, ex["labels"], 0)
-             ms_records.append(record)
-
-    # 2) shuffle
-    rng.shuffle(ms_records)
-    test = ms_records
-    
-    print(f"Total processed records: {len(test)}")
-
-    write_jsonl(test, "./syn_data/syn_test.jsonl")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--inputs", nargs="+", default=["./syn_data/all.jsonl"], help="輸入 JSONL (可用 glob、可為 .gz)")
+    parser.add_argument("--out-dir", default="./syn_data")
+    parser.add_argument("--prefix", default="syn_", help="輸出檔名前綴")
+    parser.add_argument("--splits", nargs="+", default=["test=1"], help="name=ratio，例如 train=0.8 val=0.1 test=0.1")
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--max-chars", type=int, default=MAX_CHARS, help="超過此長度的對話捨棄 (沒給 --max-model-len 時)")
+    parser.add_argument("--max-model-len", type=int, default=0, help="改以 token 長度過濾 / 截斷 (與 vLLM 的設定相同)")
+    parser.add_argument("--length-policy", choices=POLICIES, default="filter", help="對話超過 token 預算時的處理")
+    parser.add_argument("--tokenizer", default=DEFAULT_TOKENIZER, help="本機快取的 tokenizer 名稱或路徑")
+    parser.add_argument("--chars-per-token", type=float, default=CHARS_PER_TOKEN, help="沒有 tokenizer 時的估算比例")
+    parser.add_argument("--prompt", choices=sorted(PROMPTS), default="full", help="prompt 版本 (prompts.py)，需與推論端相同")
+    parser.add_argument("--shard-size", type=int, default=0, help="每個分片的筆數上限 (0 = 每個 split 一個檔)")
+    parser.add_argument("--compress", action="store_true", help="輸出 .jsonl.gz")
+    parser.add_argument("--dedup", choices=["off", "report", "drop"], default="off", help="MinHash/LSH 近似去重")
+    parser.add_argument("--dedup-threshold", type=float, default=None,
+                        help="估計 Jaccard 相似度下限 (預設 0.7；沿用既有索引時預設為索引的值，指定不同的值會報錯)")
+    parser.add_argument("--dedup-index", default=None, help="去重索引資料夾 (不存在會新建)，用來跨批次比對")
+    parser.add_argument("--dedup-priority", nargs="+", default=["test", "val", "train"],
+                        help="近似重複橫跨多個 split 時，保留在最前面的 split")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunk-size", type=int, default=2000, help="每個 worker 一次處理幾行")
+    parser.add_argument("--shuffle-buckets", type=int, default=64, help="外部 shuffle 的暫存檔數，越多每段用的記憶體越少")
+    args = parser.parse_args()
+
+    inputs = []
+    for pattern in args.inputs:
+        matched = sorted(glob.glob(pattern))
+        if not matched:
+            parser.error(f"找不到輸入檔: {pattern}")
+        inputs.extend(matched)
+    try:
+        splits = parse_splits(args.splits)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.dedup != "off" and args.dedup_index:
+        # threshold 與既有索引不符時，在讀資料之前就停下來
+        from dedup import DedupIndex
+
+        try:
+            DedupIndex.open(args.dedup_index, args.dedup_threshold)
+        except ValueError as e:
+            parser.error(str(e))
+
+    manifest = build_dataset(inputs, args.out_dir, splits, prefix=args.prefix, seed=args.seed,
+                             max_chars=args.max_chars, shard_size=args.shard_size, compress=args.compress,
+                             workers=args.workers, chunk_size=args.chunk_size,
+                             shuffle_buckets=max(1, args.shuffle_buckets), max_model_len=args.max_model_len,
+                             length_policy=args.length_policy, tokenizer=args.tokenizer,
+                             chars_per_token=args.chars_per_token, dedup=args.dedup,
+                             dedup_threshold=args.dedup_threshold, dedup_index=args.dedup_index,
+                             dedup_priority=args.dedup_priority, prompt=args.prompt)
+    c = manifest["counts"]
+    length = manifest["length"]
+    if length is None:
+        print(f"Read: {c['read']} lines from {len(inputs)} file(s) "
+              f"(invalid {c['invalid']}, empty {c['empty']}, > {args.max_chars} chars {c['too_long']})")
+    else:
+        valid = c["read"] - c["invalid"] - c["empty"]
+        print(f"Read: {c['read']} lines from {len(inputs)} file(s) (invalid {c['invalid']}, empty {c['empty']})")
+        print(f"Token budget: {length['budget']} per conversation (tokenizer backend: {length['backend']})")
+        print(f"  chars <= {args.max_chars} would keep: {valid - c['over_chars']}")
+        print(f"  {length['policy']} keeps: {valid - c['too_long']} (truncated {c['truncated']})")
+    dd = manifest["dedup"]
+    if dd is not None:
+        print(f"Near-duplicates ({dd['mode']}): {dd['duplicates']} "
+              f"(within split {dd['within_split']}, across splits {dd['cross_split']}, "
+              f"in index {dd['index_matches']}), dropped {dd['dropped']}")
+    print(f"Total processed records: {manifest['written']}")
+    for name, sp in manifest["splits"].items():
+        for shard in sp["shards"]:
+            print(f"Wrote: {os.path.join(args.out_dir, shard['file'])} ({shard['n']} lines)")
+    print(f"Wrote: {os.path.join(args.out_dir, args.prefix + 'manifest.json')}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,496 @@
+"""
+對話近似重複偵測：MinHash 簽章 + LSH 分段，找出同一 split 內與跨 split (train / test 洩漏) 的近似重複。
+
+詐騙腳本大量套用同一個模板，real_data 的 train / test / all_test 與 syn_data 又是分別產生的，
+完全相同的比對抓不到只改了人名、金額的版本。做法：
+- 每段對話取小寫單字的 5-gram (shingle)，以 NUM_PERM 個 multiply-shift hash 取最小值當簽章
+- 簽章切成 bands × rows，任一 band 完全相同就是候選；每個 band 排序一次找相同的 key，
+  同一段相同 key 內的每筆都會比對 (模板化的腳本常常很多筆共用 key)，
+  每筆最多和同段內前 MAX_RUN 筆比較，避免超大的一段變成 O(N²)
+- 候選再以簽章估計的 Jaccard 相似度 >= threshold 確認，以 union-find 串成群組
+- 簽章計算可分給多個 process；索引 (簽章 + 每筆所屬 split) 可存檔，之後的新批次只需和索引比對
+
+python dedup.py report ./real_data/train.jsonl ./real_data/val.jsonl ./real_data/test.jsonl \\
+    ./real_data/all_test.jsonl "./syn_data/*.jsonl" --save-index ./dedup_index
+python dedup.py check --index ./dedup_index ./syn_data/new_batch.jsonl --add
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import shutil
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+NUM_PERM = 128
+SHINGLE = 5
+THRESHOLD = 0.7
+INDEX_VERSION = 1
+MAX_RUN = 512  # 同一段相同 band key 內，每筆最多比對幾筆
+
+_WORD_RE = re.compile(r"\w+")
+_GRAM_MULT = np.uint64(0x9E3779B97F4A7C15)
+
+
+def lsh_params(threshold: float, num_perm: int = NUM_PERM) -> Tuple[int, int]:
+    """選 bands × rows = num_perm，使 LSH 的 S 曲線轉折點 (1/b)^(1/r) 最接近 threshold"""
+    best = None
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        err = abs((1.0 / bands) ** (1.0 / rows) - threshold)
+        if best is None or err < best[0]:
+            best = (err, bands, rows)
+    return best[1], best[2]
+
+
+class MinHasher:
+    """
+    參數:
+    num_perm: 簽章長度
+    shingle: 幾個字一組
+    seed: hash 參數的亂數種子；同一個索引內必須相同
+    """
+
+    def __init__(self, num_perm: int = NUM_PERM, shingle: int = SHINGLE, seed: int = 1):
+        self.num_perm = num_perm
+        self.shingle = shingle
+        self.seed = seed
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, 2 ** 63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+        self._b = rng.integers(0, 2 ** 63, size=num_perm, dtype=np.uint64)
+
+    def _grams(self, text: str) -> np.ndarray:
+        words = _WORD_RE.findall(text.lower())
+        if not words:
+            return np.zeros(1, dtype=np.uint64)
+        wh = np.fromiter((zlib.crc32(w.encode("utf-8")) for w in words), dtype=np.uint64, count=len(words))
+        k = min(self.shingle, len(words))
+        n = len(words) - k + 1
+        g = np.zeros(n, dtype=np.uint64)
+        for j in range(k):
+            g = g * _GRAM_MULT + wh[j:j + n]
+        return np.unique(g)
+
+    def signature(self, text: str) -> np.ndarray:
+        g = self._grams(text)
+        # multiply-shift：(a * x + b) mod 2^64 的高 32 位
+        h = (g[:, None] * self._a[None, :] + self._b[None, :]) >> np.uint64(32)
+        return h.min(axis=0).astype(np.uint32)
+
+    def signatures(self, texts: Sequence[str]) -> np.ndarray:
+        out = np.empty((len(texts), self.num_perm), dtype=np.uint32)
+        for i, t in enumerate(texts):
+            out[i] = self.signature(t)
+        return out
+
+
+_HASHERS: Dict[Tuple[int, int, int], MinHasher] = {}
+
+
+def get_hasher(num_perm: int = NUM_PERM, shingle: int = SHINGLE, seed: int = 1) -> MinHasher:
+    key = (num_perm, shingle, seed)
+    if key not in _HASHERS:
+        _HASHERS[key] = MinHasher(num_perm, shingle, seed)
+    return _HASHERS[key]
+
+
+def _signature_job(job: Tuple[List[str], int, int, int]) -> np.ndarray:
+    texts, num_perm, shingle, seed = job
+    return get_hasher(num_perm, shingle, seed).signatures(texts)
+
+
+def parallel_signatures(texts: Sequence[str], num_perm: int = NUM_PERM, shingle: int = SHINGLE, seed: int = 1,
+                        workers: int = 1, chunk_size: int = 2000) -> np.ndarray:
+    jobs = [(list(texts[i:i + chunk_size]), num_perm, shingle, seed) for i in range(0, len(texts), chunk_size)]
+    if not jobs:
+        return np.zeros((0, num_perm), dtype=np.uint32)
+    if workers <= 1 or len(jobs) == 1:
+        return np.concatenate([_signature_job(j) for j in jobs])
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        return np.concatenate(list(ex.map(_signature_job, jobs)))
+
+
+def band_keys(sigs: np.ndarray, bands: int, rows: int) -> np.ndarray:
+    """(n, num_perm) 簽章 -> (n, bands) 的 64-bit band key"""
+    s = np.asarray(sigs, dtype=np.uint64)[:, :bands * rows].reshape(len(sigs), bands, rows)
+    keys = np.zeros((len(sigs), bands), dtype=np.uint64)
+    for j in range(rows):
+        keys = keys * _GRAM_MULT + s[:, :, j]
+    return keys
+
+
+def similarity(sigs_a: np.ndarray, sigs_b: np.ndarray) -> np.ndarray:
+    """逐列估計的 Jaccard 相似度 (相同位置相等的比例)"""
+    return (np.asarray(sigs_a) == np.asarray(sigs_b)).mean(axis=-1)
+
+
+def _components(n: int, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    # union-find；root 永遠取較小的編號，所以每群的代表是最早出現的那筆
+    parent = list(range(n))
+
+    def find(x: int) -> int:
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for x, y in zip(a.tolist(), b.tolist()):
+        rx, ry = find(x), find(y)
+        if rx != ry:
+            parent[max(rx, ry)] = min(rx, ry)
+    labels = np.arange(n)
+    for x in set(a.tolist()) | set(b.tolist()):
+        labels[x] = find(x)
+    return labels
+
+
+def cluster(sigs: np.ndarray, threshold: float = THRESHOLD, bands: Optional[int] = None,
+            rows: Optional[int] = None) -> np.ndarray:
+    """
+    把近似重複的對話分群。
+
+    回傳:
+    labels: 每筆所屬群組的代表 (群內最小的編號)；labels[i] == i 表示它是代表或沒有重複
+    """
+    n = len(sigs)
+    if bands is None or rows is None:
+        bands, rows = lsh_params(threshold, sigs.shape[1])
+    keys = band_keys(sigs, bands, rows)
+    edges_a, edges_b = [], []
+    for j in range(bands):
+        order = np.argsort(keys[:, j], kind="stable")
+        k = keys[order, j]
+        same = np.concatenate([[False], k[1:] == k[:-1]])
+        if not same.any():
+            continue
+        # 同一段相同 key 內兩兩比對 (每筆往前最多 MAX_RUN 筆)；只和段首比會漏掉段首不相似、彼此相似的兩筆
+        run_start = np.maximum.accumulate(np.where(~same, np.arange(n), 0))
+        pos = np.nonzero(same)[0]
+        for d in range(1, MAX_RUN + 1):
+            pos = pos[pos - d >= run_start[pos]]
+            if not len(pos):
+                break
+            a, b = order[pos - d], order[pos]
+            ok = similarity(sigs[a], sigs[b]) >= threshold
+            edges_a.append(a[ok])
+            edges_b.append(b[ok])
+    if not edges_a:
+        return np.arange(n)
+    pairs = np.unique(np.stack([np.concatenate(edges_a), np.concatenate(edges_b)], axis=1), axis=0)
+    return _components(n, pairs[:, 0], pairs[:, 1])
+
+
+class DedupIndex:
+    """
+    已收錄對話的簽章索引，用來檢查新批次是否和既有資料近似重複。
+
+    存檔格式 (資料夾)：sigs.npy (n, num_perm) uint32、splits.npy (每筆所屬 split 的編號)、meta.json
+    """
+
+    def __init__(self, num_perm: int = NUM_PERM, shingle: int = SHINGLE, seed: int = 1,
+                 threshold: float = THRESHOLD):
+        self.num_perm = num_perm
+        self.shingle = shingle
+        self.seed = seed
+        self.threshold = threshold
+        self.bands, self.rows = lsh_params(threshold, num_perm)
+        self.sigs = np.zeros((0, num_perm), dtype=np.uint32)
+        self.splits = np.zeros(0, dtype=np.int16)
+        self.split_names: List[str] = []
+        self.batches: List[Dict[str, Any]] = []
+        self._sorted: Optional[List[Tuple[np.ndarray, np.ndarray]]] = None
+
+    def __len__(self) -> int:
+        return len(self.sigs)
+
+    @property
+    def hasher(self) -> MinHasher:
+        return get_hasher(self.num_perm, self.shingle, self.seed)
+
+    def split_code(self, name: str) -> int:
+        if name not in self.split_names:
+            self.split_names.append(name)
+        return self.split_names.index(name)
+
+    def _band_index(self) -> List[Tuple[np.ndarray, np.ndarray]]:
+        if self._sorted is None:
+            keys = band_keys(self.sigs, self.bands, self.rows)
+            self._sorted = []
+            for j in range(self.bands):
+                order = np.argsort(keys[:, j], kind="stable")
+                self._sorted.append((keys[order, j], order))
+        return self._sorted
+
+    def query(self, sigs: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        回傳:
+        (每筆在索引中最相似的對象編號，沒有則為 -1；對應的相似度)
+        """
+        best = np.full(len(sigs), -1, dtype=np.int64)
+        best_sim = np.zeros(len(sigs))
+        if not len(self) or not len(sigs):
+            return best, best_sim
+        keys = band_keys(sigs, self.bands, self.rows)
+        for j, (sorted_keys, order) in enumerate(self._band_index()):
+            # 索引中 key 相同的整段 [lo, hi) 都是候選，逐一比對 (最多 MAX_RUN 筆)
+            lo = np.searchsorted(sorted_keys, keys[:, j], side="left")
+            hi = np.minimum(np.searchsorted(sorted_keys, keys[:, j], side="right"), lo + MAX_RUN)
+            idx = np.nonzero(hi > lo)[0]
+            for d in range(MAX_RUN):
+                idx = idx[lo[idx] + d < hi[idx]]
+                if not len(idx):
+                    break
+                cand = order[lo[idx] + d]
+                sim = similarity(sigs[idx], self.sigs[cand])
+                better = (sim >= self.threshold) & (sim > best_sim[idx])
+                best[idx[better]] = cand[better]
+                best_sim[idx[better]] = sim[better]
+        return best, best_sim
+
+    def add(self, sigs: np.ndarray, split: str, batch: str) -> None:
+        code = self.split_code(split)
+        self.sigs = np.concatenate([self.sigs, np.asarray(sigs, dtype=np.uint32)])
+        self.splits = np.concatenate([self.splits, np.full(len(sigs), code, dtype=np.int16)])
+        for b in self.batches:
+            if b["name"] == batch:
+                b["n"] += len(sigs)
+                break
+        else:
+            self.batches.append({"name": batch, "n": len(sigs), "added_at": time.strftime("%Y-%m-%dT%H:%M:%S")})
+        self._sorted = None
+
+    def save(self, path: str) -> None:
+        # 先寫暫存資料夾再換上，避免中斷時留下不完整的索引
+        tmp = f"{path.rstrip(os.sep)}.tmp{os.getpid()}"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        np.save(os.path.join(tmp, "sigs.npy"), self.sigs)
+        np.save(os.path.join(tmp, "splits.npy"), self.splits)
+        meta = {
+            "version": INDEX_VERSION, "n": len(self), "num_perm": self.num_perm, "shingle": self.shingle,
+            "seed": self.seed, "threshold": self.threshold, "bands": self.bands, "rows": self.rows,
+            "split_names": self.split_names, "batches": self.batches,
+        }
+        with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "DedupIndex":
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != INDEX_VERSION:
+            raise ValueError(f"unsupported dedup index version: {meta.get('version')}")
+        idx = cls(meta["num_perm"], meta["shingle"], meta["seed"], meta["threshold"])
+        idx.sigs = np.load(os.path.join(path, "sigs.npy"))
+        idx.splits = np.load(os.path.join(path, "splits.npy"))
+        idx.split_names = meta["split_names"]
+        idx.batches = meta["batches"]
+        return idx
+
+    @classmethod
+    def open(cls, path: Optional[str], threshold: Optional[float] = None) -> "DedupIndex":
+        """
+        既有的索引沿用建立時的 threshold (bands × rows 也跟著定下來)；
+        另外指定且不同的 threshold 直接報錯，不要默默以索引內的值為準。threshold 為 None 表示不指定
+        """
+        if path and os.path.exists(os.path.join(path, "meta.json")):
+            idx = cls.load(path)
+            if threshold is not None and abs(threshold - idx.threshold) > 1e-9:
+                raise ValueError(f"dedup index {path} was built with threshold {idx.threshold}, "
+                                 f"got {threshold}; omit the threshold or use a new index")
+            return idx
+        return cls(threshold=THRESHOLD if threshold is None else threshold)
+
+
+def resolve(labels: np.ndarray, splits: np.ndarray, priority: Sequence[int]) -> Tuple[np.ndarray, Dict[str, Any]]:
+    """
+    依分群結果決定要丟掉哪些。每群只留一筆：群組橫跨多個 split 時留在 priority 最前面的 split
+    (預設 test 優先，避免測試集因去重變小、訓練集仍含測試題的變形)，同 split 內留最早出現的。
+
+    參數:
+    labels: cluster() 的結果
+    splits: 每筆所屬 split 的編號
+    priority: split 編號，越前面越優先保留
+
+    回傳:
+    (drop 布林陣列, 統計 {"within": {split: n}, "cross": {(保留 split, 被丟 split): n}})
+    """
+    n = len(labels)
+    rank = np.full(int(splits.max()) + 1 if n else 1, len(priority), dtype=np.int64)
+    for r, s in enumerate(priority):
+        if s < len(rank):
+            rank[s] = r
+    # 每群中 (split 優先度, 編號) 最小的那筆保留
+    order = np.lexsort((np.arange(n), rank[splits], labels))
+    first = np.concatenate([[True], labels[order][1:] != labels[order][:-1]]) if n else np.zeros(0, bool)
+    keeper = np.empty(n, dtype=np.int64)
+    keeper_of_group = {}
+    for i, is_first in zip(order.tolist(), first.tolist()):
+        if is_first:
+            keeper_of_group[labels[i]] = i
+        keeper[i] = keeper_of_group[labels[i]]
+    drop = keeper != np.arange(n)
+    stats: Dict[str, Any] = {"within": {}, "cross": {}}
+    for i in np.nonzero(drop)[0].tolist():
+        s, ks = int(splits[i]), int(splits[keeper[i]])
+        if s == ks:
+            stats["within"][s] = stats["within"].get(s, 0) + 1
+        else:
+            stats["cross"][(ks, s)] = stats["cross"].get((ks, s), 0) + 1
+    return drop, stats
+
+
+def _read_texts(path: str) -> List[str]:
+    from convert_to_swift_jsonl import _dialogue_of, iter_line_chunks
+
+    texts = []
+    for chunk in iter_line_chunks([path], 10000):
+        for line in chunk:
+            try:
+                ex = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(ex, dict):
+                texts.append(_dialogue_of(ex))
+    return texts
+
+
+def _expand(patterns: Sequence[str]) -> List[str]:
+    paths = []
+    for p in patterns:
+        matched = sorted(glob.glob(p))
+        if not matched:
+            raise SystemExit(f"找不到輸入檔: {p}")
+        paths.extend(matched)
+    return paths
+
+
+def _snippet(text: str, n: int = 70) -> str:
+    return text.replace("\n", " | ")[:n]
+
+
+def cmd_report(args) -> None:
+    paths = _expand(args.paths)
+    texts, files = [], []
+    for fi, path in enumerate(paths):
+        t = _read_texts(path)
+        texts.extend(t)
+        files.extend([fi] * len(t))
+    files = np.asarray(files, dtype=np.int64)
+    start = time.perf_counter()
+    sigs = parallel_signatures(texts, workers=args.workers)
+    labels = cluster(sigs, args.threshold)
+    elapsed = time.perf_counter() - start
+
+    rep = labels != np.arange(len(labels))
+    names = [os.path.relpath(p) for p in paths]
+    width = max(len(n) for n in names) + 2
+    print("=" * 80)
+    print(f"🔍 近似重複報告 (N={len(texts)}, threshold={args.threshold}, {elapsed:.1f} s)")
+    print(f"   - 有近似重複的群組:   {len(set(labels[rep].tolist()))}")
+    print(f"   - 非代表的重複筆數:   {int(rep.sum())}")
+    print("-" * 80)
+    print(f"{'file':<{width}}{'n':>8}{'dup in file':>14}{'dup of earlier file':>22}")
+    first_file = files[labels]
+    for fi, name in enumerate(names):
+        mine = files == fi
+        within = int((rep & mine & (first_file == fi)).sum())
+        cross = int((rep & mine & (first_file != fi)).sum())
+        print(f"{name:<{width}}{int(mine.sum()):>8}{within:>14}{cross:>22}")
+
+    # 兩兩檔案之間：B 裡有幾筆和 A 的某筆同群
+    print("-" * 80)
+    print("跨檔案 (列 = 檔案中有幾筆在「欄」的檔案裡也有近似版本):")
+    groups_by_file = [np.unique(labels[files == fi]) for fi in range(len(paths))]
+    print(f"{'':<{width}}" + "".join(f"{i:>8}" for i in range(len(paths))))
+    for fi, name in enumerate(names):
+        row = labels[files == fi]
+        cells = []
+        for fj in range(len(paths)):
+            cells.append("-" if fi == fj else str(int(np.isin(row, groups_by_file[fj]).sum())))
+        print(f"{f'{fi} ' + name:<{width}}" + "".join(f"{c:>8}" for c in cells))
+
+    if args.examples:
+        print("-" * 80)
+        shown = 0
+        for i in np.nonzero(rep & (files != files[labels]))[0].tolist():
+            j = int(labels[i])
+            sim = float(similarity(sigs[i], sigs[j]))
+            print(f"[{sim:.2f}] {names[files[j]]}: {_snippet(texts[j])}")
+            print(f"       {names[files[i]]}: {_snippet(texts[i])}")
+            shown += 1
+            if shown >= args.examples:
+                break
+    print("=" * 80)
+
+    if args.save_index:
+        index = DedupIndex(threshold=args.threshold)
+        keep = ~rep
+        for fi, name in enumerate(names):
+            sel = keep & (files == fi)
+            index.add(sigs[sel], split=name, batch=name)
+        index.save(args.save_index)
+        print(f"Wrote: {args.save_index} ({len(index)} conversations)")
+
+
+def cmd_check(args) -> None:
+    index = DedupIndex.load(args.index)
+    print("=" * 80)
+    print(f"🔍 與索引比對: {args.index} (n={len(index)}, threshold={index.threshold})")
+    for path in _expand(args.paths):
+        texts = _read_texts(path)
+        sigs = parallel_signatures(texts, index.num_perm, index.shingle, index.seed, workers=args.workers)
+        match, _ = index.query(sigs)
+        # 批次內部自己的重複也算
+        labels = cluster(sigs, index.threshold, index.bands, index.rows)
+        inner = labels != np.arange(len(labels))
+        dup = (match >= 0) | inner
+        by_split: Dict[str, int] = {}
+        for m in match[match >= 0].tolist():
+            name = index.split_names[int(index.splits[m])]
+            by_split[name] = by_split.get(name, 0) + 1
+        print(f"   - {os.path.relpath(path)}: n={len(texts)}, 與索引重複 {int((match >= 0).sum())} {by_split}, "
+              f"批次內重複 {int(inner.sum())}, 新的 {int((~dup).sum())}")
+        if args.add:
+            index.add(sigs[~dup], split=args.split or os.path.relpath(path), batch=os.path.relpath(path))
+    print("=" * 80)
+    if args.add:
+        index.save(args.index)
+        print(f"Wrote: {args.index} ({len(index)} conversations)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_report = sub.add_parser("report", help="檔案內與檔案間的近似重複")
+    p_report.add_argument("paths", nargs="+")
+    p_report.add_argument("--threshold", type=float, default=THRESHOLD, help="估計 Jaccard 相似度下限")
+    p_report.add_argument("--examples", type=int, default=5, help="列出幾組跨檔案的重複")
+    p_report.add_argument("--save-index", default=None, help="把去重後的簽章存成索引")
+    p_report.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    p_check = sub.add_parser("check", help="新批次和既有索引比對")
+    p_check.add_argument("paths", nargs="+")
+    p_check.add_argument("--index", required=True)
+    p_check.add_argument("--add", action="store_true", help="把不重複的加進索引")
+    p_check.add_argument("--split", default=None, help="加入索引時標記的 split (預設為檔名)")
+    p_check.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+    if args.cmd == "report":
+        cmd_report(args)
+    else:
+        cmd_check(args)
+
+
+if __name__ == "__main__":
+    main()
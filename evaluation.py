@@ -1,465 +1,716 @@
+"""
+推論結果 (swift infer / batch_score.py 的 JSONL) 的評估：DWA、準確率、P/R/F1、混淆矩陣。
+
+多個檔案平行評估並輸出比較表；每個檔案的結果依 (路徑, mtime, 大小, parser, alpha, beta)
+快取在 --cache，沒變的檔案不會重新解析。
+
+python evaluation.py "./inference_data/*.jsonl"
+python evaluation.py "./inference_data/sft_8b_*_v4.jsonl" --format markdown --sort dwa
+python evaluation.py ./inference_data/qwen_8b_infer_test_results.jsonl --parser qwen --verbose
+python evaluation.py "./inference_data/sft_8b_*_v4.jsonl" --bootstrap 2000 --seed 0
+python evaluation.py ./inference_data/sft_8b_infer_test_results_60_v4.jsonl \\
+    ./inference_data/sft_8b_infer_test_results_108_v4.jsonl --compare --bootstrap 5000
+"""
+import argparse
+import csv
+import glob
+import hashlib
+import io
+import math
 import json
 import re
 import os
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from confidence import fraud_probability
+from convert_to_swift_jsonl import extract_conversation
 
 # 設定類別權重 (可依需求調整)
 ALPHA_COST = 2.0  # 詐騙樣本 (True) 的權重 (漏報代價大)
 BETA_COST = 1.0   # 正常樣本 (False) 的權重
 
-def calculate_dwa_from_jsonl(file_path):
+# 預測 / 標籤的編碼：1 = True (詐騙), 0 = False (正常), -1 = 無法解析 (一律算答錯)
+UNPARSED = -1
+DETECT_SAMPLE = 200  # auto 模式下用前幾筆 response 判斷格式
+
+def compute_dwa(lengths, is_correct, is_fraud, alpha=ALPHA_COST, beta=BETA_COST):
+    """
+    依長度衰減權重與類別成本計算 DWA，給其他工具 (cascade 模擬等) 共用
+
+    參數:
+    lengths: 每筆對話的字元長度
+    is_correct: 每筆是否答對
+    is_fraud: 每筆 Ground Truth 是否為詐騙
+    回傳: (DWA, 加權總分, 總權重)
+    """
+    epsilon = 1e-9
+    L = np.asarray(lengths, dtype=np.float64)
+    if L.size == 0:
+        return 0.0, 0.0, 0.0
+    w_len = np.maximum(0.0, 1.0 - L / (L.max() + epsilon))
+    weights = w_len * np.where(np.asarray(is_fraud, dtype=bool), alpha, beta)
+    total_weighted_score = float(weights[np.asarray(is_correct, dtype=bool)].sum())
+    total_possible_weight = float(weights.sum())
+    if total_possible_weight == 0:
+        return 0.0, total_weighted_score, total_possible_weight
+    return total_weighted_score / total_possible_weight, total_weighted_score, total_possible_weight
+
+
+# ---------------------------------------------------------
+# Response parser registry
+# 每個 parser 把 response 轉成 1 / 0 / UNPARSED
+# ---------------------------------------------------------
+PARSERS: Dict[str, Callable[[Any], int]] = {}
+
+def register_parser(name: str):
+    def deco(fn):
+        PARSERS[name] = fn
+        return fn
+    return deco
+
+def _bool_word(text: str) -> int:
+    t = text.strip().lower()
+    if t in ("true", "1"):
+        return 1
+    if t in ("false", "0"):
+        return 0
+    return UNPARSED
+
+_THINK_RE = re.compile(r'<think>.*?</think>', re.DOTALL)
+_BINARY_DIGIT_RE = re.compile(r'[01]')
+_TF_RE = re.compile(r'\b(True|False)\b', re.IGNORECASE)
+
+@register_parser("exact")
+def parse_exact(response: Any) -> int:
+    # SFT 模型 (max_new_tokens=1)：整段就是 True / False
+    return _bool_word(str(response or ''))
+
+@register_parser("qwen")
+def parse_qwen(response: Any) -> int:
+    # Qwen：去掉 <think>...</think> 後找第一個 0/1，沒有就看剩下的是不是 True / False
+    text = _THINK_RE.sub('', str(response or '')).strip()
+    m = _BINARY_DIGIT_RE.search(text)
+    if m:
+        return int(m.group(0))
+    return _bool_word(text[:10])
+
+@register_parser("oss")
+def parse_oss(response: Any) -> int:
+    # gpt-oss 等會先輸出推理 / channel 標記：取最後一個 True / False
+    matches = _TF_RE.findall(str(response or ''))
+    if not matches:
+        return UNPARSED
+    return 1 if matches[-1].lower() == 'true' else 0
+
+@register_parser("think_last")
+def parse_think_last(response: Any) -> int:
+    # 去掉 <think> 後取最後一個 True / False (推理內容中出現的字不算)
+    return parse_oss(_THINK_RE.sub('', str(response or '')))
+
+def detect_parser(responses: Iterable[Any]) -> str:
+    """依 response 的樣子挑 parser：全是 True/False -> exact；有 <think> -> qwen；其他 -> oss"""
+    responses = [str(r or '') for r in responses]
+    if any('<think>' in r for r in responses):
+        return "qwen"
+    if all(_bool_word(r) != UNPARSED for r in responses):
+        return "exact"
+    return "oss"
+
+def get_parser(name: str) -> Callable[[Any], int]:
+    if name not in PARSERS:
+        raise ValueError(f"未知的 parser: {name} (可用: {', '.join(sorted(PARSERS))})")
+    return PARSERS[name]
+
+def parse_label(item: Dict[str, Any]) -> int:
+    # 推論結果檔的 labels 是 "True"/"False"，原始資料的 label 是 0/1
+    if 'labels' in item:
+        return _bool_word(str(item['labels']))
+    if 'label' in item:
+        return _bool_word(str(item['label']))
+    return UNPARSED
+
+
+# ---------------------------------------------------------
+# 評估引擎：逐行讀取、每行只 parse 一次，存成 typed array
+# ---------------------------------------------------------
+class EvalData:
+    """一個結果檔的精簡表示：長度 / 預測 / 標籤各一個 typed array"""
+
+    def __init__(self, parser: str):
+        self.parser = parser
+        self.lengths = array('I')
+        self.preds = array('b')
+        self.labels = array('b')
+        self.keys = array('q')  # 對話內容的 64-bit hash (keep_keys=True 時才有)，配對比較用
+        self.scores = array('d')  # 詐騙機率，沒有時為 NaN
+        self.invalid_lines = 0
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    @classmethod
+    def from_table(cls, table, parser: str = "auto") -> "EvalData":
+        """由 columnar.ColumnarTable 建立；欄位直接是 memmap，不複製"""
+        data = cls(table.resolve_parser(parser))
+        data.lengths = table.lengths
+        data.preds = table.preds(data.parser)
+        data.labels = table.labels
+        data.keys = table.keys
+        data.scores = table.scores
+        data.invalid_lines = table.invalid_lines
+        return data
+
+    def numpy(self):
+        """零複製轉成 numpy (lengths, preds, labels)"""
+        if isinstance(self.lengths, np.ndarray):
+            return self.lengths, self.preds, self.labels
+        return (
+            np.frombuffer(self.lengths, dtype=np.dtype(self.lengths.typecode)) if len(self) else np.zeros(0, np.uint32),
+            np.frombuffer(self.preds, dtype=np.int8) if len(self) else np.zeros(0, np.int8),
+            np.frombuffer(self.labels, dtype=np.int8) if len(self) else np.zeros(0, np.int8),
+        )
+
+    def scores_numpy(self):
+        if isinstance(self.scores, np.ndarray):
+            return self.scores
+        return np.frombuffer(self.scores, dtype=np.float64) if len(self) else np.zeros(0, np.float64)
+
+    def has_scores(self) -> bool:
+        return bool(len(self)) and not bool(np.isnan(self.scores_numpy()).all())
+
+def item_score(item: Dict[str, Any]) -> float:
+    # batch_score.py 的輸出有 fraud_prob；swift infer --logprobs true 的輸出從 logprobs 算
+    p = item.get('fraud_prob')
+    if p is None:
+        p = fraud_probability(item)
+    return float('nan') if p is None else float(p)
+
+def conversation_key(conversation: str) -> int:
+    return int.from_bytes(hashlib.blake2b(conversation.encode('utf-8'), digest_size=8).digest(), 'little', signed=True)
+
+def load_results(file_path: str, parser: str = "auto", verbose: bool = True, keep_keys: bool = False,
+                 columnar: bool = False) -> EvalData:
     """
-    從 JSONL 檔案讀取資料並計算衰減加權準確率 (DWA Score)
-    
+    讀取推論結果 JSONL (swift infer / batch_score.py 的輸出)
+
     參數:
     file_path (str): jsonl 檔案的路徑
+    parser (str): PARSERS 內的名稱，或 "auto" 依前 DETECT_SAMPLE 筆 response 自動判斷
+    keep_keys (bool): 是否記錄對話 hash (兩個檔案配對比較時需要)
+    columnar (bool): 改從 columnar.py 的欄位快取 mmap 讀取 (來源檔變更時自動重建)
     """
-    
-    # 檢查檔案是否存在
-    if not os.path.exists(file_path):
-        print(f"錯誤: 找不到檔案 {file_path}")
-        return
+    if columnar:
+        from columnar import open_table  # columnar 也 import 本模組，放在這裡避免循環 import
+        return EvalData.from_table(open_table(file_path), parser)
 
-    parsed_results = []
-    global_max_len = 0
-    valid_count = 0
-    
-    print(f"正在讀取檔案: {file_path} ...")
-    
-    # ---------------------------------------------------------
-    # 步驟 1: 讀取檔案並預處理
-    # ---------------------------------------------------------
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            for line_idx, line in enumerate(f):
-                line = line.strip()
-                if not line: continue 
-                
-                try:
-                    item = json.loads(line)
-                except json.JSONDecodeError:
+    data = EvalData(parser)
+    parse = None if parser == "auto" else get_parser(parser)
+    pending = []  # auto 模式判斷出格式前先暫存 (length, response, label, key, score)
+
+    def append(length, response, label, key, score):
+        data.lengths.append(length)
+        data.preds.append(parse(response))
+        data.labels.append(label)
+        data.scores.append(score)
+        if keep_keys:
+            data.keys.append(key)
+
+    def flush_pending():
+        nonlocal parse
+        data.parser = detect_parser(p[1] for p in pending)
+        parse = PARSERS[data.parser]
+        for rec in pending:
+            append(*rec)
+        pending.clear()
+
+    with open(file_path, 'r', encoding='utf-8') as f:
+        for line_idx, line in enumerate(f):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError:
+                if verbose:
                     print(f"[Warning] Line {line_idx+1} is not valid JSON. Skipped.")
-                    continue
-
-                # --- A. 提取對話長度 ---
-                user_content = ""
-                if 'messages' in item and isinstance(item['messages'], list):
-                    for msg in item['messages']:
-                        if msg.get('role') == 'user':
-                            user_content = msg.get('content', "")
-                            break
-                
-                match = re.search(r'<conversation>(.*?)</conversation>', user_content, re.DOTALL)
-                if match:
-                    actual_conversation = match.group(1).strip()
-                else:
-                    actual_conversation = user_content
-                
-                length = len(actual_conversation)
-                if length > global_max_len:
-                    global_max_len = length
-                
-                # --- B. 判斷答對與否 ---
-                prediction = str(item.get('response', '')).strip()
-                
-                if 'labels' in item:
-                    ground_truth = str(item['labels']).strip()
-                elif 'label' in item:
-                    ground_truth = str(item['label']) 
-                else:
-                    ground_truth = "Unknown"
-
-                is_correct = (prediction.lower() == ground_truth.lower())
-                
-                parsed_results.append({
-                    'line_no': line_idx + 1,
-                    'length': length,
-                    'is_correct': is_correct,
-                    'prediction': prediction,
-                    'ground_truth': ground_truth
-                })
-                valid_count += 1
-                
-    except Exception as e:
-        print(f"讀取檔案時發生錯誤: {e}")
-        return
+                data.invalid_lines += 1
+                continue
 
-    if valid_count == 0:
-        print("沒有讀取到有效資料。")
-        return
+            conversation = extract_conversation(item)
+            rec = (
+                len(conversation),
+                item.get('response', ''),
+                parse_label(item),
+                conversation_key(conversation) if keep_keys else 0,
+                item_score(item),
+            )
+            if parse is None:
+                pending.append(rec)
+                if len(pending) >= DETECT_SAMPLE:
+                    flush_pending()
+                continue
+            append(*rec)
 
-    # ---------------------------------------------------------
-    # 步驟 2: 計算 DWA 分數 (修改處)
-    # ---------------------------------------------------------
-    epsilon = 1e-9
-    total_weighted_score = 0  
-    total_possible_weight = 0 
-    
-    for i, res in enumerate(parsed_results):
-        L = res['length']
-        
-        # 1. 計算長度衰減權重 (w_len)
-        w_len = 1.0 - (L / (global_max_len + epsilon))
-        w_len = max(0.0, w_len) 
-        
-        # 2. 計算類別成本權重 (w_class) [新增]
-        # 判斷 Ground Truth 是否為詐騙 (True)
-        is_fraud_sample = (res['ground_truth'].lower() == 'true' or res['ground_truth'] == '1')
-        w_class = ALPHA_COST if is_fraud_sample else BETA_COST
-        
-        # 3. 結合權重 (Omega) [修改]
-        final_weight = w_len * w_class
-        
-        # 4. 累加分數
-        contribution = final_weight if res['is_correct'] else 0.0
-        
-        total_weighted_score += contribution
-        total_possible_weight += final_weight
-
-    # ---------------------------------------------------------
-    # 步驟 3: 最終統計
-    # ---------------------------------------------------------
-    if total_possible_weight == 0:
-        final_score = 0.0
-    else:
-        final_score = total_weighted_score / total_possible_weight
+    if parse is None:
+        flush_pending()
+    return data
+
+def compute_metrics(data: EvalData, alpha: float = ALPHA_COST, beta: float = BETA_COST) -> Dict[str, Any]:
+    """DWA、準確率、precision / recall / F1 與混淆矩陣 (無法解析的預測視為答錯)"""
+    lengths, preds, labels = data.numpy()
+    n = len(data)
+    is_fraud = labels == 1
+    is_correct = preds == labels
+    dwa, num, denom = compute_dwa(lengths, is_correct, is_fraud, alpha, beta)
 
+    pred_true = preds == 1
+    tp = int(np.count_nonzero(pred_true & is_fraud))
+    fp = int(np.count_nonzero(pred_true & (labels == 0)))
+    fn = int(np.count_nonzero(~pred_true & is_fraud))
+    tn = int(np.count_nonzero((preds == 0) & (labels == 0)))
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    n_correct = int(np.count_nonzero(is_correct))
+
+    return {
+        "parser": data.parser,
+        "alpha": alpha,
+        "beta": beta,
+        "n": n,
+        "max_len": int(lengths.max()) if n else 0,
+        "dwa": dwa,
+        "weighted_score": num,
+        "total_weight": denom,
+        "correct": n_correct,
+        "accuracy": n_correct / n if n else 0.0,
+        "precision": precision,
+        "recall": recall,
+        "f1": f1,
+        "confusion": {"tp": tp, "fp": fp, "fn": fn, "tn": tn},
+        "unparsed": int(np.count_nonzero(preds == UNPARSED)),
+        "invalid_lines": data.invalid_lines,
+    }
+
+def print_report(m: Dict[str, Any]) -> None:
+    c = m["confusion"]
     print("=" * 80)
-    print(f"📊 統計摘要 (DWA Metric):")
-    print(f"   - 參數設定:          Alpha(Fraud)={ALPHA_COST}, Beta(Normal)={BETA_COST}")
-    print(f"   - 總樣本數 (N):      {valid_count}")
-    print(f"   - 全域最大長度 (Max): {global_max_len} chars")
-    print(f"   - 加權總分 (Num):    {total_weighted_score:.4f}")
-    print(f"   - 總權重 (Denom):    {total_possible_weight:.4f}")
+    print(f"📊 統計摘要 (DWA Metric - parser: {m['parser']}):")
+    print(f"   - 參數設定:          Alpha(Fraud)={m['alpha']}, Beta(Normal)={m['beta']}")
+    print(f"   - 總樣本數 (N):      {m['n']}")
+    print(f"   - 答對數量:          {m['correct']}")
+    print(f"   - 傳統準確率:        {m['accuracy']:.4f}")
+    print(f"   - Precision / Recall / F1: {m['precision']:.4f} / {m['recall']:.4f} / {m['f1']:.4f}")
+    print(f"   - 混淆矩陣:          TP={c['tp']}  FP={c['fp']}  FN={c['fn']}  TN={c['tn']}")
+    print(f"   - 全域最大長度 (Max): {m['max_len']} chars")
+    print(f"   - 加權總分 (Num):    {m['weighted_score']:.4f}")
+    print(f"   - 總權重 (Denom):    {m['total_weight']:.4f}")
     print("-" * 80)
-    print(f"🎯 DWA Score (衰減加權準確率): {final_score:.4f}")
+    print(f"🎯 DWA Score (衰減加權準確率): {m['dwa']:.4f}")
     print("=" * 80)
-    
-    return final_score
 
-
-def qwen_8b_calculate_dwa_from_jsonl(file_path):
+def evaluate_file(file_path, parser="auto", alpha=ALPHA_COST, beta=BETA_COST, verbose=True, columnar=False):
     """
-    [Qwen版] 從 JSONL 檔案讀取資料並計算衰減加權準確率 (DWA Score)
+    從 JSONL 檔案讀取資料並計算 DWA 及其他指標
+
+    參數:
+    file_path (str): jsonl 檔案的路徑
+    parser (str): response 的解析方式 (見 PARSERS)，預設自動判斷
+    回傳: 指標 dict；檔案不存在或沒有有效資料時回傳 None
     """
-    
     if not os.path.exists(file_path):
         print(f"錯誤: 找不到檔案 {file_path}")
-        return
-
-    parsed_results = []
-    global_max_len = 0
-    valid_count = 0
-    
-    print(f"正在讀取檔案: {file_path} ...")
-    
-    # ---------------------------------------------------------
-    # 步驟 1: 讀取檔案並預處理
-    # ---------------------------------------------------------
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            for line_idx, line in enumerate(f):
-                line = line.strip()
-                if not line: continue
-                
-                try:
-                    item = json.loads(line)
-                except json.JSONDecodeError:
-                    print(f"[Warning] Line {line_idx+1} is not valid JSON. Skipped.")
-                    continue
-
-                # --- A. 提取對話長度 ---
-                user_content = ""
-                if 'messages' in item and isinstance(item['messages'], list):
-                    for msg in item['messages']:
-                        if msg.get('role') == 'user':
-                            user_content = msg.get('content', "")
-                            break
-                
-                match = re.search(r'<conversation>(.*?)</conversation>', user_content, re.DOTALL)
-                if match:
-                    actual_conversation = match.group(1).strip()
-                else:
-                    actual_conversation = user_content
-                
-                length = len(actual_conversation)
-                if length > global_max_len:
-                    global_max_len = length
-                
-                # --- B. 判斷答對與否 (Qwen 特殊處理) ---
-                raw_response = str(item.get('response', '')).strip()
-                prediction_text = re.sub(r'<think>.*?</think>', '', raw_response, flags=re.DOTALL).strip()
-                
-                prediction_match = re.search(r'[01]', prediction_text)
-                if prediction_match:
-                    prediction = prediction_match.group(0)
-                else:
-                    prediction = prediction_text[:10] if prediction_text else "Unknown"
-                
-                if 'labels' in item:
-                    ground_truth = str(item['labels']).strip()
-                elif 'label' in item:
-                    ground_truth = str(item['label']).strip()
-                else:
-                    ground_truth = "Unknown"
-
-                is_correct = (prediction.lower() == ground_truth.lower())
-                
-                parsed_results.append({
-                    'line_no': line_idx + 1,
-                    'length': length,
-                    'is_correct': is_correct,
-                    'prediction': prediction,
-                    'ground_truth': ground_truth
-                })
-                valid_count += 1
-                
-    except Exception as e:
-        print(f"讀取檔案時發生錯誤: {e}")
-        return
+        return None
 
-    if valid_count == 0:
+    if verbose:
+        print(f"正在讀取檔案: {file_path} ...")
+    data = load_results(file_path, parser, verbose, columnar=columnar)
+    if len(data) == 0:
         print("沒有讀取到有效資料。")
-        return
+        return None
 
-    # ---------------------------------------------------------
-    # 步驟 2: 計算 DWA 分數 (修改處)
-    # ---------------------------------------------------------
-    epsilon = 1e-9
-    total_weighted_score = 0  
-    total_possible_weight = 0 
-    
-    for i, res in enumerate(parsed_results):
-        L = res['length']
-        
-        # 1. 長度衰減
-        w_len = 1.0 - (L / (global_max_len + epsilon))
-        w_len = max(0.0, w_len)
-        
-        # 2. 類別成本 [新增]
-        # 注意：Qwen 版本的 Ground Truth 可能是 "0"/"1" 或 "True"/"False"
-        gt_str = res['ground_truth'].lower()
-        is_fraud_sample = (gt_str == 'true' or gt_str == '1')
-        w_class = ALPHA_COST if is_fraud_sample else BETA_COST
-        
-        # 3. 結合權重
-        final_weight = w_len * w_class
-        
-        contribution = final_weight if res['is_correct'] else 0.0
-        
-        total_weighted_score += contribution
-        total_possible_weight += final_weight
-
-    # ---------------------------------------------------------
-    # 步驟 3: 最終統計
-    # ---------------------------------------------------------
-    if total_possible_weight == 0:
-        final_score = 0.0
-    else:
-        final_score = total_weighted_score / total_possible_weight
+    m = compute_metrics(data, alpha, beta)
+    if verbose:
+        if m["unparsed"] > 0:
+            print(f"⚠️  警告: 有 {m['unparsed']} 筆資料的 response 無法解析為 True 或 False")
+        print_report(m)
+    return m
 
-    print("=" * 80)
-    print(f"📊 統計摘要 (DWA Metric - Qwen):")
-    print(f"   - 參數設定:          Alpha(Fraud)={ALPHA_COST}, Beta(Normal)={BETA_COST}")
-    print(f"   - 總樣本數 (N):      {valid_count}")
-    print(f"   - 全域最大長度 (Max): {global_max_len} chars")
-    print(f"   - 加權總分 (Num):    {total_weighted_score:.4f}")
-    print(f"   - 總權重 (Denom):    {total_possible_weight:.4f}")
-    print("-" * 80)
-    print(f"🎯 DWA Score (衰減加權準確率): {final_score:.4f}")
-    print("=" * 80)
-    
-    return final_score
+def _dwa_or_none(file_path, parser):
+    m = evaluate_file(file_path, parser)
+    return None if m is None else m["dwa"]
+
+def calculate_dwa_from_jsonl(file_path):
+    """[相容用] response 必須剛好是 True / False"""
+    return _dwa_or_none(file_path, "exact")
 
+def qwen_8b_calculate_dwa_from_jsonl(file_path):
+    """[相容用] Qwen 版：去掉 <think> 後解析"""
+    return _dwa_or_none(file_path, "qwen")
 
 def oss_calculate_dwa_from_jsonl(file_path):
+    """[相容用] OSS 版：取 response 中最後一個 True / False"""
+    return _dwa_or_none(file_path, "oss")
+
+
+# ---------------------------------------------------------
+# Bootstrap 信賴區間與配對檢定
+# DWA 的長度權重依「該次重抽樣的最大長度」M 重新計算，且所有 L <= M：
+#   sum(w) = sum(k) - sum(k*L) / M，sum(w*c) = sum(k*c) - sum(k*c*L) / M
+# 所以每次重抽樣只需要幾個加權總和與 M。重抽樣以「每筆被抽到幾次」的計數矩陣表示，
+# 加總變成一次矩陣乘法；樣本先依長度遞減排序，M 就是第一個被抽到的樣本的長度
+# ---------------------------------------------------------
+BOOTSTRAP_BLOCK_ELEMS = 4_000_000  # 每個 block 的 (重抽樣數 × N) 上限，控制記憶體
+
+def _bootstrap_block(job):
+    L_sorted, cols, n_resamples, seed = job
+    rng = np.random.default_rng(seed)
+    n = L_sorted.shape[0]
+    # 排序後的陣列上均勻抽樣，分佈與原陣列相同
+    pos = rng.integers(0, n, size=(n_resamples, n))
+    pos += (np.arange(n_resamples) * n)[:, None]
+    counts = np.bincount(pos.ravel(), minlength=n_resamples * n).reshape(n_resamples, n).astype(np.float64)
+    sums = counts @ cols
+    M = L_sorted[np.argmax(counts > 0, axis=1)] + 1e-9
+    return sums, M
+
+def bootstrap_resamples(lengths, labels, corrects, n_resamples=1000, seed=0, workers=1,
+                        alpha=ALPHA_COST, beta=BETA_COST):
     """
-    [OSS版] 從 JSONL 檔案讀取資料並計算衰減加權準確率 (DWA Score)
+    對同一組樣本上的一或多個系統做 (配對) bootstrap，所有系統共用同一組重抽樣
+
+    參數:
+    lengths, labels: 樣本長度與標籤 (各系統共用)
+    corrects: 各系統每筆是否答對的 list
+    workers (int): >1 時用 process pool 分 block 計算；結果只由 seed 決定，與 workers 無關
+    回傳: (dwa, acc)，shape 皆為 (系統數, n_resamples)
     """
-    
-    if not os.path.exists(file_path):
-        print(f"錯誤: 找不到檔案 {file_path}")
-        return
+    L = np.asarray(lengths, dtype=np.float64)
+    n = L.shape[0]
+    if n == 0:
+        z = np.zeros((len(corrects), n_resamples))
+        return z, z.copy()
+    order = np.argsort(-L, kind='stable')
+    L = L[order]
+    k = np.where(np.asarray(labels)[order] == 1, alpha, beta)
+    cols = [k, k * L]
+    for c in corrects:
+        c = np.asarray(c, dtype=np.float64)[order]
+        cols += [k * c, k * c * L, c]
+    cols = np.stack(cols, axis=1)
 
-    parsed_results = []
-    global_max_len = 0
-    valid_count = 0
-    no_match_count = 0
-    
-    print(f"正在讀取檔案: {file_path} ...")
-    
-    # ---------------------------------------------------------
-    # 步驟 1: 讀取檔案並預處理
-    # ---------------------------------------------------------
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            for line_idx, line in enumerate(f):
-                line = line.strip()
-                if not line: continue
-                
-                try:
-                    item = json.loads(line)
-                except json.JSONDecodeError:
-                    print(f"[Warning] Line {line_idx+1} is not valid JSON. Skipped.")
-                    continue
-
-                # --- A. 提取對話長度 ---
-                user_content = ""
-                if 'messages' in item and isinstance(item['messages'], list):
-                    for msg in item['messages']:
-                        if msg.get('role') == 'user':
-                            user_content = msg.get('content', "")
-                            break
-                
-                match = re.search(r'<conversation>(.*?)</conversation>', user_content, re.DOTALL)
-                if match:
-                    actual_conversation = match.group(1).strip()
-                else:
-                    actual_conversation = user_content
-                
-                length = len(actual_conversation)
-                if length > global_max_len:
-                    global_max_len = length
-                
-                # --- B. 判斷答對與否 (OSS 特殊處理) ---
-                raw_response = str(item.get('response', '')).strip()
-                true_false_matches = list(re.finditer(r'\b(True|False)\b', raw_response, re.IGNORECASE))
-                
-                if true_false_matches:
-                    last_match = true_false_matches[-1]
-                    prediction = last_match.group(1)
-                else:
-                    prediction = "Unknown"
-                    no_match_count += 1
-                
-                if 'labels' in item:
-                    ground_truth = str(item['labels']).strip()
-                elif 'label' in item:
-                    label_val = item['label']
-                    if label_val == 0:
-                        ground_truth = "False"
-                    elif label_val == 1:
-                        ground_truth = "True"
-                    else:
-                        ground_truth = str(label_val)
-                else:
-                    ground_truth = "Unknown"
-
-                is_correct = (prediction.lower() == ground_truth.lower())
-                
-                parsed_results.append({
-                    'line_no': line_idx + 1,
-                    'length': length,
-                    'is_correct': is_correct,
-                    'prediction': prediction,
-                    'ground_truth': ground_truth
-                })
-                valid_count += 1
-                
-    except Exception as e:
-        print(f"讀取檔案時發生錯誤: {e}")
-        return
+    block = max(1, BOOTSTRAP_BLOCK_ELEMS // n)
+    sizes = [min(block, n_resamples - i) for i in range(0, n_resamples, block)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    jobs = [(L, cols, b, s) for b, s in zip(sizes, seeds)]
+    if workers and workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(_bootstrap_block, jobs))
+    else:
+        parts = [_bootstrap_block(job) for job in jobs]
+    sums = np.concatenate([p[0] for p in parts])
+    M = np.concatenate([p[1] for p in parts])
 
-    if valid_count == 0:
-        print("沒有讀取到有效資料。")
-        return
+    denom = sums[:, 0] - sums[:, 1] / M
+    dwa, acc = [], []
+    for j in range(len(corrects)):
+        num = sums[:, 2 + 3 * j] - sums[:, 3 + 3 * j] / M
+        dwa.append(np.divide(num, denom, out=np.zeros_like(num), where=denom > 0))
+        acc.append(sums[:, 4 + 3 * j] / n)
+    return np.array(dwa), np.array(acc)
 
-    if no_match_count > 0:
-        print(f"⚠️  警告: 有 {no_match_count} 筆資料的 response 中未找到 True 或 False")
+def _interval(samples, ci):
+    lo, hi = np.quantile(samples, [(1 - ci) / 2, 1 - (1 - ci) / 2])
+    return float(lo), float(hi)
 
-    # ---------------------------------------------------------
-    # 步驟 2: 計算 DWA 分數 (修改處)
-    # ---------------------------------------------------------
-    epsilon = 1e-9
-    total_weighted_score = 0  
-    total_possible_weight = 0 
-    
-    for i, res in enumerate(parsed_results):
-        L = res['length']
-        
-        # 1. 長度衰減
-        w_len = 1.0 - (L / (global_max_len + epsilon))
-        w_len = max(0.0, w_len)
-        
-        # 2. 類別成本 [新增]
-        # 判斷 Ground Truth 是否為詐騙 (True)
-        gt_str = res['ground_truth'].lower()
-        is_fraud_sample = (gt_str == 'true' or gt_str == '1')
-        w_class = ALPHA_COST if is_fraud_sample else BETA_COST
-        
-        # 3. 結合權重
-        final_weight = w_len * w_class
-        
-        contribution = final_weight if res['is_correct'] else 0.0
-        
-        total_weighted_score += contribution
-        total_possible_weight += final_weight
-
-    # ---------------------------------------------------------
-    # 步驟 3: 最終統計
-    # ---------------------------------------------------------
-    if total_possible_weight == 0:
-        final_score = 0.0
+def bootstrap_ci(data: EvalData, n_resamples=1000, ci=0.95, seed=0, workers=1,
+                 alpha=ALPHA_COST, beta=BETA_COST) -> Dict[str, Any]:
+    """單一結果檔 DWA 與準確率的 percentile bootstrap 信賴區間"""
+    lengths, preds, labels = data.numpy()
+    dwa, acc = bootstrap_resamples(lengths, labels, [preds == labels], n_resamples, seed, workers, alpha, beta)
+    return {"dwa_ci": _interval(dwa[0], ci), "accuracy_ci": _interval(acc[0], ci),
+            "ci": ci, "n_resamples": n_resamples, "seed": seed}
+
+def align(a: EvalData, b: EvalData):
+    """依對話 hash 對齊兩個結果檔 (同一對話重複出現時依出現順序配對)，回傳兩邊的索引"""
+    positions: Dict[tuple, int] = {}
+    seen: Dict[int, int] = {}
+    for j, key in enumerate(b.keys):
+        occ = seen.get(key, 0)
+        seen[key] = occ + 1
+        positions[(key, occ)] = j
+    ia, ib = array('q'), array('q')
+    seen.clear()
+    for i, key in enumerate(a.keys):
+        occ = seen.get(key, 0)
+        seen[key] = occ + 1
+        j = positions.get((key, occ))
+        if j is not None:
+            ia.append(i)
+            ib.append(j)
+    return np.frombuffer(ia, dtype=np.int64), np.frombuffer(ib, dtype=np.int64)
+
+def mcnemar(correct_a, correct_b) -> Dict[str, Any]:
+    """
+    McNemar 檢定：只看兩個系統答案不同的樣本
+    不一致數 < 25 用 exact binomial，否則用連續性校正的卡方 (自由度 1)
+    """
+    correct_a = np.asarray(correct_a, dtype=bool)
+    correct_b = np.asarray(correct_b, dtype=bool)
+    only_a = int(np.count_nonzero(correct_a & ~correct_b))
+    only_b = int(np.count_nonzero(~correct_a & correct_b))
+    n = only_a + only_b
+    if n == 0:
+        p = 1.0
+    elif n < 25:
+        tail = sum(math.comb(n, i) for i in range(min(only_a, only_b) + 1)) / 2 ** n
+        p = min(1.0, 2 * tail)
     else:
-        final_score = total_weighted_score / total_possible_weight
+        chi2 = (abs(only_a - only_b) - 1) ** 2 / n
+        p = math.erfc(math.sqrt(chi2 / 2))
+    return {"only_a_correct": only_a, "only_b_correct": only_b, "p_value": p}
+
+def paired_test(a: EvalData, b: EvalData, n_resamples=1000, ci=0.95, seed=0, workers=1,
+                alpha=ALPHA_COST, beta=BETA_COST) -> Dict[str, Any]:
+    """
+    同一測試集上兩個結果檔的配對比較 (b - a)：paired bootstrap 的 DWA / 準確率差異與 McNemar
+    兩個檔案都需以 keep_keys=True 讀取
+    """
+    ia, ib = align(a, b)
+    La, pa, ya = a.numpy()
+    _, pb, yb = b.numpy()
+    L, y = La[ia], ya[ia]
+    ca, cb = pa[ia] == y, pb[ib] == yb[ib]
+    dwa, acc = bootstrap_resamples(L, y, [ca, cb], n_resamples, seed, workers, alpha, beta)
+    d_dwa, d_acc = dwa[1] - dwa[0], acc[1] - acc[0]
+    base_a = compute_dwa(L, ca, y == 1, alpha, beta)[0]
+    base_b = compute_dwa(L, cb, y == 1, alpha, beta)[0]
+
+    def p_two_sided(d):
+        # 差異的 bootstrap 分佈跨過 0 的比例 × 2
+        return float(min(1.0, 2 * min(np.mean(d <= 0), np.mean(d >= 0))))
+
+    return {
+        "n_aligned": int(ia.shape[0]),
+        "dwa_a": base_a,
+        "dwa_b": base_b,
+        "dwa_diff": base_b - base_a,
+        "dwa_diff_ci": _interval(d_dwa, ci),
+        "dwa_p_value": p_two_sided(d_dwa),
+        "accuracy_diff": float(cb.mean() - ca.mean()) if ia.shape[0] else 0.0,
+        "accuracy_diff_ci": _interval(d_acc, ci),
+        "accuracy_p_value": p_two_sided(d_acc),
+        "mcnemar": mcnemar(ca, cb),
+        "ci": ci,
+        "n_resamples": n_resamples,
+        "seed": seed,
+    }
 
-    correct_count = sum(1 for res in parsed_results if res['is_correct'])
-    accuracy = correct_count / valid_count if valid_count > 0 else 0.0
+def compare_files(path_a, path_b, parser="auto", n_resamples=1000, ci=0.95, seed=0, workers=1,
+                  alpha=ALPHA_COST, beta=BETA_COST, columnar=False) -> Dict[str, Any]:
+    a = load_results(path_a, parser, verbose=False, keep_keys=True, columnar=columnar)
+    b = load_results(path_b, parser, verbose=False, keep_keys=True, columnar=columnar)
+    return paired_test(a, b, n_resamples, ci, seed, workers, alpha, beta)
 
+def print_comparison(path_a: str, path_b: str, r: Dict[str, Any]) -> None:
+    pct = int(r["ci"] * 100)
+    lo, hi = r["dwa_diff_ci"]
+    alo, ahi = r["accuracy_diff_ci"]
+    mc = r["mcnemar"]
     print("=" * 80)
-    print(f"📊 統計摘要 (DWA Metric - OSS):")
-    print(f"   - 參數設定:          Alpha(Fraud)={ALPHA_COST}, Beta(Normal)={BETA_COST}")
-    print(f"   - 總樣本數 (N):      {valid_count}")
-    print(f"   - 答對數量:          {correct_count}")
-    print(f"   - 傳統準確率:        {accuracy:.4f}")
-    print(f"   - 全域最大長度 (Max): {global_max_len} chars")
-    print(f"   - 加權總分 (Num):    {total_weighted_score:.4f}")
-    print(f"   - 總權重 (Denom):    {total_possible_weight:.4f}")
+    print(f"⚖️  配對比較 (B - A), 對齊樣本數 {r['n_aligned']}, bootstrap {r['n_resamples']} 次 (seed={r['seed']})")
+    print(f"   - A: {path_a}")
+    print(f"   - B: {path_b}")
     print("-" * 80)
-    print(f"🎯 DWA Score (衰減加權準確率): {final_score:.4f}")
+    print(f"   - DWA:       {r['dwa_a']:.4f} -> {r['dwa_b']:.4f}  差異 {r['dwa_diff']:+.4f}  "
+          f"{pct}% CI [{lo:+.4f}, {hi:+.4f}]  p={r['dwa_p_value']:.4f}")
+    print(f"   - 準確率差異: {r['accuracy_diff']:+.4f}  {pct}% CI [{alo:+.4f}, {ahi:+.4f}]  p={r['accuracy_p_value']:.4f}")
+    print(f"   - McNemar:   只有 A 對 {mc['only_a_correct']} 筆 / 只有 B 對 {mc['only_b_correct']} 筆  p={mc['p_value']:.4f}")
     print("=" * 80)
-    
-    return final_score
 
-"""
-print("base_8b")
-calculate_cdi_from_jsonl("./inference_data/base_8b_infer_all_test_results.jsonl")
-print("sft_8b")
-calculate_cdi_from_jsonl("./inference_data/sft_8b_infer_all_test_results_50_v3.jsonl")
-print("base_70b_awq")
-calculate_cdi_from_jsonl("./inference_data/base_70b_awq_infer_all_test_results.jsonl")
-print("qwen_8b")
-qwen_8b_calculate_cdi_from_jsonl("./inference_data/qwen_8b_infer_all_test_results.jsonl")
-print("ministral_8b")
-calculate_cdi_from_jsonl("./inference_data/ministral_8b_infer_all_test_results.jsonl")
-print("ministral_8b_v1_50")
-calculate_cdi_from_jsonl("./inference_data/ministral_8b_infer_all_test_results_50_v1.jsonl")
-print("ministral_8b_v1_81")
-calculate_cdi_from_jsonl("./inference_data/ministral_8b_infer_all_test_results_81_v1.jsonl")
-print("ministral_8b_v2_30")
-calculate_cdi_from_jsonl("./inference_data/ministral_8b_infer_all_test_results_30_v2.jsonl")
-"""
-print("ministral_8b_v1_50")
-calculate_dwa_from_jsonl("./inference_data/ministral_8b_infer_test_results_50_v1.jsonl")
-print("ministral_8b_v1_81")
-calculate_dwa_from_jsonl("./inference_data/ministral_8b_infer_test_results_81_v1.jsonl")
-print("ministral_8b")
-calculate_dwa_from_jsonl("./inference_data/ministral_8b_infer_test_results.jsonl")
-print("qwen_8b")
-qwen_8b_calculate_dwa_from_jsonl("./inference_data/qwen_8b_infer_test_results.jsonl")
-print("qwen_32b")
-qwen_8b_calculate_dwa_from_jsonl("./inference_data/qwen_32b_infer_test_results.jsonl")
-print("base_8b")
-calculate_dwa_from_jsonl("./inference_data/base_8b_infer_test_result.jsonl")
-print("sft_8b")
-calculate_dwa_from_jsonl("./inference_data/sft_8b_infer_test_results_50_v3.jsonl")
-print("base_70b_awq")
-calculate_dwa_from_jsonl("./inference_data/base_70b_awq_infer_test_results.jsonl")
-print("gpt_120b")
-oss_calculate_dwa_from_jsonl("./inference_data/gpt_120b_infer_test_results.jsonl")
-print("sft_8b_v4")
-calculate_dwa_from_jsonl("./inference_data/sft_8b_infer_test_results_20_v4.jsonl")
-calculate_dwa_from_jsonl("./inference_data/sft_8b_infer_test_results_40_v4.jsonl")
-calculate_dwa_from_jsonl("./inference_data/sft_8b_infer_test_results_60_v4.jsonl")
-calculate_dwa_from_jsonl("./inference_data/sft_8b_infer_test_results_80_v4.jsonl")
-calculate_dwa_from_jsonl("./inference_data/sft_8b_infer_test_results_100_v4.jsonl")
-calculate_dwa_from_jsonl("./inference_data/sft_8b_infer_test_results_108_v4.jsonl")
\ No newline at end of file
+
+# ---------------------------------------------------------
+# 多檔案 CLI：平行評估 + 結果快取
+# ---------------------------------------------------------
+DEFAULT_CACHE = "./inference_data/.eval_cache.json"
+TABLE_COLUMNS = ("file", "parser", "n", "accuracy", "precision", "recall", "f1", "dwa", "unparsed")
+
+def expand_paths(patterns: List[str]) -> List[str]:
+    paths = []
+    for pat in patterns:
+        matches = sorted(glob.glob(pat)) if glob.has_magic(pat) else [pat]
+        for p in matches:
+            if p not in paths:
+                paths.append(p)
+    return paths
+
+def cache_key(file_path: str, parser: str, alpha: float, beta: float, bootstrap=None) -> str:
+    st = os.stat(file_path)
+    key = [os.path.abspath(file_path), st.st_mtime_ns, st.st_size, parser, alpha, beta]
+    if bootstrap:
+        key.append(list(bootstrap))
+    return json.dumps(key)
+
+def load_cache(path: Optional[str]) -> Dict[str, Dict[str, Any]]:
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+def save_cache(path: str, cache: Dict[str, Dict[str, Any]]) -> None:
+    # 只保留檔案還存在的項目；先寫暫存檔再 rename，中斷也不會留下壞掉的快取
+    kept = {k: v for k, v in cache.items() if os.path.exists(json.loads(k)[0])}
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(kept, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+def _evaluate_worker(job):
+    file_path, parser, alpha, beta, bootstrap, columnar = job
+    if not bootstrap:
+        return evaluate_file(file_path, parser, alpha, beta, verbose=False, columnar=columnar)
+    data = load_results(file_path, parser, verbose=False, columnar=columnar)
+    if len(data) == 0:
+        return None
+    n_resamples, ci, seed = bootstrap
+    m = compute_metrics(data, alpha, beta)
+    m.update(bootstrap_ci(data, n_resamples, ci, seed, 1, alpha, beta))
+    return m
+
+def evaluate_many(paths, parser="auto", alpha=ALPHA_COST, beta=BETA_COST, workers=None, cache_path=DEFAULT_CACHE,
+                  bootstrap=None, columnar=False):
+    """
+    平行評估多個結果檔，回傳與 paths 同順序的指標 list (讀不到的檔案為 None)
+
+    參數:
+    workers (int): process 數，None = CPU 數；1 = 在目前的 process 內跑
+    cache_path (str): 指標快取檔，None = 不使用快取
+    bootstrap (tuple): (重抽樣次數, 信賴水準, seed)，給的話每個檔案加上 dwa_ci / accuracy_ci
+    columnar (bool): 從欄位快取讀取 (見 columnar.py)
+    """
+    cache = load_cache(cache_path)
+    results: List[Optional[Dict[str, Any]]] = [None] * len(paths)
+    keys: List[Optional[str]] = [None] * len(paths)
+    todo = []
+    for i, p in enumerate(paths):
+        if not os.path.exists(p):
+            print(f"錯誤: 找不到檔案 {p}")
+            continue
+        keys[i] = cache_key(p, parser, alpha, beta, bootstrap)
+        if keys[i] in cache:
+            results[i] = cache[keys[i]]
+        else:
+            todo.append(i)
+
+    jobs = [(paths[i], parser, alpha, beta, bootstrap, columnar) for i in todo]
+    if len(jobs) > 1 and workers != 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            computed = list(pool.map(_evaluate_worker, jobs))
+    else:
+        computed = [_evaluate_worker(job) for job in jobs]
+
+    for i, m in zip(todo, computed):
+        if m is None:
+            continue
+        m = dict(m, file=paths[i])
+        results[i] = cache[keys[i]] = m
+    if cache_path and todo:
+        save_cache(cache_path, cache)
+    return results
+
+def _cell(m: Dict[str, Any], col: str) -> str:
+    v = m[col] if col != "file" else os.path.basename(m["file"])
+    if isinstance(v, (list, tuple)):
+        return "[" + ", ".join(f"{x:.4f}" for x in v) + "]"
+    return f"{v:.4f}" if isinstance(v, float) else str(v)
+
+def format_table(rows: List[Dict[str, Any]], fmt: str) -> str:
+    if fmt == "json":
+        return json.dumps(rows, ensure_ascii=False, indent=2)
+    columns = TABLE_COLUMNS
+    if all("dwa_ci" in m for m in rows):
+        columns = columns + ("dwa_ci", "accuracy_ci")
+    cells = [[_cell(m, c) for c in columns] for m in rows]
+    if fmt == "csv":
+        buf = io.StringIO()
+        w = csv.writer(buf)
+        w.writerow(columns)
+        w.writerows(cells)
+        return buf.getvalue()
+    if fmt == "markdown":
+        lines = ["| " + " | ".join(columns) + " |", "|" + "---|" * len(columns)]
+        lines += ["| " + " | ".join(r) + " |" for r in cells]
+        return "\n".join(lines)
+    widths = [max(len(c), *(len(r[i]) for r in cells)) for i, c in enumerate(columns)]
+    lines = ["=" * 80]
+    lines.append(f"📊 DWA 排行 (Alpha(Fraud)={rows[0]['alpha']}, Beta(Normal)={rows[0]['beta']})")
+    lines.append("-" * 80)
+    for r in [list(columns)] + cells:
+        lines.append("  ".join(v.ljust(w) if i == 0 else v.rjust(w) for i, (v, w) in enumerate(zip(r, widths))))
+    lines.append("=" * 80)
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="*", default=["./inference_data/*.jsonl"], help="結果檔路徑或 glob")
+    parser.add_argument("--parser", default="auto", choices=["auto"] + sorted(PARSERS))
+    parser.add_argument("--alpha", type=float, default=ALPHA_COST, help="詐騙樣本權重")
+    parser.add_argument("--beta", type=float, default=BETA_COST, help="正常樣本權重")
+    parser.add_argument("--workers", type=int, default=None, help="process 數 (預設 CPU 數)")
+    parser.add_argument("--format", choices=["table", "csv", "json", "markdown"], default="table")
+    parser.add_argument("--sort", choices=["file", "dwa", "accuracy", "f1"], default="file")
+    parser.add_argument("--output", default=None, help="表格寫入檔案 (預設印出)")
+    parser.add_argument("--cache", default=DEFAULT_CACHE)
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--verbose", action="store_true", help="逐檔印出完整統計摘要 (不平行、不用快取)")
+    parser.add_argument("--bootstrap", type=int, default=0, help="bootstrap 重抽樣次數 (0 = 不算信賴區間)")
+    parser.add_argument("--ci", type=float, default=0.95, help="信賴水準")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--compare", action="store_true",
+                        help="配對比較：以第一個檔案為 A，和其餘每個檔案做 paired bootstrap 與 McNemar")
+    parser.add_argument("--columnar", action="store_true", help="從 columnar.py 的欄位快取讀取")
+    args = parser.parse_args()
+
+    paths = expand_paths(args.paths)
+    if not paths:
+        print("沒有符合的檔案。")
+        return
+    if args.compare:
+        if len(paths) < 2:
+            parser.error("--compare 至少需要兩個檔案")
+        for other in paths[1:]:
+            r = compare_files(paths[0], other, args.parser, args.bootstrap or 1000, args.ci, args.seed,
+                              args.workers or 1, args.alpha, args.beta, args.columnar)
+            print_comparison(paths[0], other, r)
+        return
+    if args.verbose:
+        for p in paths:
+            evaluate_file(p, args.parser, args.alpha, args.beta)
+        return
+
+    bootstrap = (args.bootstrap, args.ci, args.seed) if args.bootstrap else None
+    results = evaluate_many(paths, args.parser, args.alpha, args.beta, args.workers,
+                            None if args.no_cache else args.cache, bootstrap, args.columnar)
+    rows = [m for m in results if m is not None]
+    if not rows:
+        return
+    if args.sort != "file":
+        rows.sort(key=lambda m: m[args.sort], reverse=True)
+    text = format_table(rows, args.format)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text if text.endswith("\n") else text + "\n")
+        print(f"Wrote: {args.output}")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
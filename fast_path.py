@@ -0,0 +1,292 @@
+"""
+CPU 前置篩選：hashed n-gram 邏輯迴歸，先把「非常確定」的正常 / 詐騙對話判掉，其餘才送 vLLM。
+
+- 特徵：小寫單字的 unigram + bigram，以 crc32 hash 到 2^N_BITS 個桶 (出現與否，除以 sqrt(特徵數) 正規化)
+- 訓練：numpy 全批次 Adagrad，詐騙 / 正常樣本權重沿用 DWA 的 ALPHA_COST / BETA_COST
+- 門檻：在驗證集上找最寬的 low / high，使 p <= low 判正常、p >= high 判詐騙的精確度都達標，
+  中間的交給模型；找不到合格門檻的那一側就不判
+- 推論只需 hash + 查表，單筆約數十到數百微秒
+
+app.py 設定 FAST_PATH_MODEL 後啟用 (見 FAST_PATH_*)。
+
+python fast_path.py train --train ./real_data/train.jsonl --val ./real_data/val.jsonl --output ./models/fast_path.npz
+python fast_path.py eval --model ./models/fast_path.npz \\
+    ./inference_data/sft_8b_infer_test_results_108_v4.jsonl ./inference_data/base_70b_awq_infer_test_results.jsonl \\
+    --bands 0.02:0.98 0.05:0.95
+"""
+import argparse
+import json
+import math
+import os
+import re
+import time
+import zlib
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from convert_to_swift_jsonl import extract_conversation, read_jsonl, record_label
+from evaluation import ALPHA_COST, BETA_COST, DETECT_SAMPLE, compute_dwa, detect_parser, get_parser, parse_label
+
+
+N_BITS = 18
+_WORD_RE = re.compile(rb"\w+")
+_BIGRAM_MULT = 0x9E3779B1
+
+
+def features(text: str, n_bits: int = N_BITS) -> Tuple[List[int], float]:
+    """回傳 (不重複的特徵桶編號, 每個特徵的值)"""
+    mask = (1 << n_bits) - 1
+    hs = [zlib.crc32(w) for w in _WORD_RE.findall(text.lower().encode("utf-8"))]
+    # bigram 直接由兩個 unigram hash 組合，不另外串字串
+    idx = {h & mask for h in hs}
+    idx.update(((a * _BIGRAM_MULT) ^ b) & mask for a, b in zip(hs, hs[1:]))
+    idx = list(idx)
+    return idx, (1.0 / math.sqrt(len(idx)) if idx else 0.0)
+
+
+def _design(texts: Sequence[str], n_bits: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # 稀疏矩陣以 (列編號, 桶編號, 值) 三個陣列表示
+    rows, cols, vals = [], [], []
+    for i, t in enumerate(texts):
+        idx, v = features(t, n_bits)
+        rows.extend([i] * len(idx))
+        cols.extend(idx)
+        vals.extend([v] * len(idx))
+    return np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64), np.asarray(vals, dtype=np.float64)
+
+
+def train_weights(texts: Sequence[str], labels: Sequence[int], n_bits: int = N_BITS, epochs: int = 300,
+                  lr: float = 0.5, l2: float = 1e-4, alpha: float = ALPHA_COST,
+                  beta: float = BETA_COST) -> Tuple[np.ndarray, float]:
+    rows, cols, vals = _design(texts, n_bits)
+    y = np.asarray(labels, dtype=np.float64)
+    sw = np.where(y == 1, alpha, beta)
+    sw = sw / sw.sum()
+    n, dim = len(y), 1 << n_bits
+    w = np.zeros(dim)
+    b = 0.0
+    gw_acc = np.full(dim, 1e-8)
+    gb_acc = 1e-8
+    for _ in range(epochs):
+        z = np.bincount(rows, weights=vals * w[cols], minlength=n) + b
+        p = 1.0 / (1.0 + np.exp(-z))
+        g = (p - y) * sw
+        gw = np.bincount(cols, weights=vals * g[rows], minlength=dim) + l2 * w
+        gb = float(g.sum())
+        gw_acc += gw * gw
+        gb_acc += gb * gb
+        w -= lr * gw / np.sqrt(gw_acc)
+        b -= lr * gb / math.sqrt(gb_acc)
+    return w, b
+
+
+def pick_thresholds(probs: np.ndarray, labels: np.ndarray, precision_scam: float, precision_benign: float,
+                    max_low: float = 0.05, min_high: float = 0.95) -> Tuple[float, float]:
+    """
+    回傳最寬的 (low, high)：p <= low 的樣本中正常的比例 >= precision_benign，
+    p >= high 的樣本中詐騙的比例 >= precision_scam。沒有合格門檻時 low = -1 / high = 2 (永不判定)
+
+    驗證集小、又和訓練集同分布時精確度很容易全部達標，所以門檻另外限制在
+    low <= max_low、high >= min_high，分布外的對話 (例如合成資料) 才不會被大量誤判。
+    """
+    order = np.argsort(probs)
+    p, y = probs[order], labels[order]
+    n = len(p)
+    # 由小到大累積：前 k 筆全部判正常時的精確度
+    benign_prec = np.cumsum(y == 0) / np.arange(1, n + 1)
+    ok = np.nonzero(benign_prec >= precision_benign)[0]
+    low = float(p[ok[-1]]) if ok.size else -1.0
+    # 由大到小累積：後 k 筆全部判詐騙時的精確度
+    scam_prec = np.cumsum((y == 1)[::-1]) / np.arange(1, n + 1)
+    ok = np.nonzero(scam_prec >= precision_scam)[0]
+    high = float(p[::-1][ok[-1]]) if ok.size else 2.0
+    low, high = min(low, max_low), max(high, min_high)
+    if low >= high:
+        return -1.0, 2.0
+    return low, high
+
+
+class FastPath:
+    """
+    參數:
+    weights, bias: 邏輯迴歸參數
+    low / high: p <= low 判正常、p >= high 判詐騙，其餘回 None (交給模型)
+    """
+
+    def __init__(self, weights: np.ndarray, bias: float, low: float, high: float, n_bits: int = N_BITS,
+                 meta: Optional[Dict[str, Any]] = None):
+        self.weights = np.asarray(weights, dtype=np.float32)
+        self.bias = float(bias)
+        self.low = low
+        self.high = high
+        self.n_bits = n_bits
+        self.meta = meta or {}
+        self.decisions = {"benign": 0, "scam": 0, "forward": 0}
+
+    def prob(self, text: str) -> float:
+        idx, v = features(text, self.n_bits)
+        z = self.bias + v * float(self.weights[idx].sum()) if idx else self.bias
+        return 1.0 / (1.0 + math.exp(-z))
+
+    def probs(self, texts: Sequence[str]) -> np.ndarray:
+        return np.fromiter((self.prob(t) for t in texts), dtype=np.float64, count=len(texts))
+
+    def decide(self, text: str) -> Optional[Tuple[str, float]]:
+        """("True" / "False", p)；不夠確定時回 None"""
+        p = self.prob(text)
+        if p >= self.high:
+            self.decisions["scam"] += 1
+            return "True", p
+        if p <= self.low:
+            self.decisions["benign"] += 1
+            return "False", p
+        self.decisions["forward"] += 1
+        return None
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.savez_compressed(path, weights=self.weights, bias=self.bias, low=self.low, high=self.high,
+                            n_bits=self.n_bits, meta=json.dumps(self.meta, ensure_ascii=False))
+
+    @classmethod
+    def load(cls, path: str) -> "FastPath":
+        z = np.load(path)
+        return cls(z["weights"], float(z["bias"]), float(z["low"]), float(z["high"]), int(z["n_bits"]),
+                   json.loads(str(z["meta"])))
+
+    def stats(self) -> Dict[str, Any]:
+        total = sum(self.decisions.values())
+        return {
+            "band": [self.low, self.high],
+            "decisions": dict(self.decisions),
+            "offload_rate": (total - self.decisions["forward"]) / total if total else 0.0,
+        }
+
+
+def _load_dataset(paths: Sequence[str]) -> Tuple[List[str], np.ndarray]:
+    texts, labels = [], []
+    for path in paths:
+        for ex in read_jsonl(path):
+            d = ex["dialogue"] if isinstance(ex.get("dialogue"), str) else extract_conversation(ex)
+            texts.append(d)
+            labels.append(record_label(ex))
+    return texts, np.asarray(labels, dtype=np.int64)
+
+
+def cmd_train(args) -> None:
+    texts, labels = _load_dataset(args.train)
+    val_texts, val_labels = _load_dataset(args.val)
+    start = time.perf_counter()
+    w, b = train_weights(texts, labels, args.n_bits, args.epochs, args.lr, args.l2)
+    elapsed = time.perf_counter() - start
+
+    fp = FastPath(w, b, -1.0, 2.0, args.n_bits)
+    val_p = fp.probs(val_texts)
+    fp.low, fp.high = pick_thresholds(val_p, val_labels, args.precision_scam, args.precision_benign,
+                                      args.max_low, args.min_high)
+    fp.meta = {"train": args.train, "val": args.val, "n_train": len(texts), "epochs": args.epochs,
+               "precision_scam": args.precision_scam, "precision_benign": args.precision_benign,
+               "max_low": args.max_low, "min_high": args.min_high}
+    fp.save(args.output)
+
+    train_acc = float(((fp.probs(texts) >= 0.5) == (labels == 1)).mean())
+    val_acc = float(((val_p >= 0.5) == (val_labels == 1)).mean())
+    offload = float(((val_p <= fp.low) | (val_p >= fp.high)).mean())
+    print("=" * 80)
+    print(f"⚡ Fast path 訓練完成 ({elapsed:.1f} s): {args.output}")
+    print(f"   - train / val:          {len(texts)} / {len(val_texts)}")
+    print(f"   - accuracy @0.5:        train {train_acc:.4f}, val {val_acc:.4f}")
+    print(f"   - 門檻 (low, high):     {fp.low:.4f}, {fp.high:.4f}")
+    print(f"   - val 分流比例:         {offload:.2%}")
+    print("=" * 80)
+
+
+def _load_results(path: str, parser: str) -> Dict[str, Any]:
+    items = read_jsonl(path)
+    if parser == "auto":
+        parser = detect_parser(item.get("response") for item in items[:DETECT_SAMPLE])
+    parse = get_parser(parser)
+    texts = [extract_conversation(item) for item in items]
+    return {
+        "texts": texts,
+        "lengths": np.asarray([len(t) for t in texts], dtype=np.float64),
+        "preds": np.asarray([parse(item.get("response")) for item in items], dtype=np.int64),
+        "labels": np.asarray([parse_label(item) for item in items], dtype=np.int64),
+    }
+
+
+def offload_eval(fp: FastPath, res: Dict[str, Any], probs: np.ndarray, low: float, high: float) -> Dict[str, Any]:
+    """fast path 判掉 p <= low / p >= high 的對話，其餘沿用結果檔中模型的預測"""
+    fast_scam = probs >= high
+    fast_benign = (probs <= low) & ~fast_scam
+    offloaded = fast_scam | fast_benign
+    preds = np.where(fast_scam, 1, np.where(fast_benign, 0, res["preds"]))
+    labels = res["labels"]
+    fraud = labels == 1
+    dwa, _, _ = compute_dwa(res["lengths"], preds == labels, fraud)
+    fast_correct = (preds == labels)[offloaded]
+    return {
+        "offload_rate": float(offloaded.mean()),
+        "benign_rate": float(fast_benign.mean()),
+        "scam_rate": float(fast_scam.mean()),
+        "fast_accuracy": float(fast_correct.mean()) if fast_correct.size else float("nan"),
+        "missed_fraud": int((fast_benign & fraud).sum()),
+        "false_alarm": int((fast_scam & (labels == 0)).sum()),
+        "accuracy": float((preds == labels).mean()),
+        "dwa": dwa,
+    }
+
+
+def cmd_eval(args) -> None:
+    fp = FastPath.load(args.model)
+    bands = [(fp.low, fp.high)] + [tuple(float(x) for x in b.split(":")) for b in args.bands]
+    print("=" * 80)
+    print(f"⚡ Fast path 離線評估: {args.model} (預設門檻 {fp.low:.4f}, {fp.high:.4f})")
+    for path in args.paths:
+        res = _load_results(path, args.parser)
+        start = time.perf_counter()
+        probs = fp.probs(res["texts"])
+        us = 1e6 * (time.perf_counter() - start) / max(1, len(probs))
+        base_dwa, _, _ = compute_dwa(res["lengths"], res["preds"] == res["labels"], res["labels"] == 1)
+        print("-" * 80)
+        print(f"{path} (N={len(probs)}, 模型 DWA {base_dwa:.4f}, fast path {us:.0f} µs/筆)")
+        print(f"{'band':<16}{'offload':>9}{'benign':>9}{'scam':>8}{'fast acc':>10}{'miss':>6}{'FA':>5}"
+              f"{'DWA':>9}{'ΔDWA':>9}")
+        for low, high in bands:
+            r = offload_eval(fp, res, probs, low, high)
+            print(f"{f'{low:.3f}:{high:.3f}':<16}{r['offload_rate']:>9.2%}{r['benign_rate']:>9.2%}"
+                  f"{r['scam_rate']:>8.2%}{r['fast_accuracy']:>10.4f}{r['missed_fraud']:>6}{r['false_alarm']:>5}"
+                  f"{r['dwa']:>9.4f}{r['dwa'] - base_dwa:>+9.4f}")
+    print("=" * 80)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_train = sub.add_parser("train", help="訓練並以驗證集決定門檻")
+    p_train.add_argument("--train", nargs="+", default=["./real_data/train.jsonl"])
+    p_train.add_argument("--val", nargs="+", default=["./real_data/val.jsonl"])
+    p_train.add_argument("--output", default="./models/fast_path.npz")
+    p_train.add_argument("--n-bits", type=int, default=N_BITS, help="hash 桶數 = 2^n_bits")
+    p_train.add_argument("--epochs", type=int, default=300)
+    p_train.add_argument("--lr", type=float, default=0.5)
+    p_train.add_argument("--l2", type=float, default=1e-4)
+    p_train.add_argument("--precision-scam", type=float, default=0.99, help="直接判詐騙的精確度下限")
+    p_train.add_argument("--precision-benign", type=float, default=0.995, help="直接判正常的精確度下限 (漏報代價較大)")
+    p_train.add_argument("--max-low", type=float, default=0.05, help="判正常門檻的上限")
+    p_train.add_argument("--min-high", type=float, default=0.95, help="判詐騙門檻的下限")
+    p_eval = sub.add_parser("eval", help="在既有推論結果上估算分流比例與 DWA 變化")
+    p_eval.add_argument("paths", nargs="+", help="推論結果 JSONL (模型的預測當作沒被分流時的結果)")
+    p_eval.add_argument("--model", default="./models/fast_path.npz")
+    p_eval.add_argument("--parser", default="auto")
+    p_eval.add_argument("--bands", nargs="*", default=[], help="額外比較的 low:high 門檻")
+    args = parser.parse_args()
+    if args.cmd == "train":
+        cmd_train(args)
+    else:
+        cmd_eval(args)
+
+
+if __name__ == "__main__":
+    main()
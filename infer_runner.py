@@ -0,0 +1,371 @@
+"""
+離線高吞吐量推論：把 messages 格式的測試集送給一或多個 OpenAI 相容端點 / adapter，
+輸出與 swift infer 相同格式的結果檔 (response / labels / logprobs + 原始欄位)，可直接交給 evaluation.py。
+
+- 每個端點 (URL) 各有 --concurrency 個 worker，從「依長度由長到短排序」的佇列持續取下一筆，
+  vLLM 的 batch 裡長度相近、尾端沒有長請求拖時間；同一個 URL 上的多個 target 接成同一條佇列，
+  換 checkpoint 時不會讓 GPU 空轉
+- 完成一筆就寫進 <輸出>.partial (帶原始行號)，中斷後以相同參數重跑會略過已完成的；
+  一個 target 全部完成時才依輸入順序寫出正式檔並刪掉 .partial
+- 每個 target 的吞吐量 (records/s、prompt tokens/s)、延遲 p50 / p95、重試次數與 DWA 寫到 runner_stats.json
+- --sweep 依 glob 一次跑完所有 checkpoint；--load-adapters 在跑之前用 vLLM 的 /v1/load_lora_adapter 載入
+  (vLLM 需設 VLLM_ALLOW_RUNTIME_LORA_UPDATING=True)，跑完即卸載
+
+target 格式: 輸出名稱=served model[@URL]，沒給 URL 就用 --url
+
+python infer_runner.py --input ./real_data/test.jsonl --targets sft_8b_infer_test_results_108_v4=scam-8b-sft
+python infer_runner.py --input ./real_data/test.jsonl \\
+    --sweep "./output/llama31_8b_scam_real_sft_v4/*/checkpoint-*" --name-template "sft_8b_infer_test_results_{step}_v4" \\
+    --load-adapters --url http://localhost:8000/v1/chat/completions
+python mock_vllm.py --port 18000 &
+python infer_runner.py --targets a=m1 b=m2@http://localhost:18000/v1/chat/completions \\
+    --url http://localhost:18000/v1/chat/completions --output-dir /tmp/runner
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import re
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional, Set
+
+import httpx
+
+from convert_to_swift_jsonl import record_label
+from evaluation import compute_metrics, load_results
+from model_profiles import get_profile, profile_names
+
+_STEP_RE = re.compile(r"checkpoint-(\d+)")
+
+
+class Target:
+    """
+    參數:
+    name (str): 輸出檔名 (不含 .jsonl)
+    model (str): 請求中的 model (served_model_name 或 adapter 名稱)
+    url (str): chat completions 端點
+    adapter_path (str): --load-adapters 時要載入的 checkpoint 資料夾
+    """
+
+    def __init__(self, name: str, model: str, url: str, adapter_path: Optional[str] = None):
+        self.name = name
+        self.model = model
+        self.url = url
+        self.adapter_path = adapter_path
+        self.remaining = 0
+        self.loaded: Optional[asyncio.Future] = None
+
+        self.done = 0
+        self.retries = 0
+        self.prompt_tokens = 0
+        self.latencies: List[float] = []
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+
+    def stats(self) -> Dict[str, Any]:
+        elapsed = (self.finished or time.monotonic()) - (self.started or time.monotonic())
+        lat = sorted(self.latencies)
+
+        def pct(q: float) -> Optional[float]:
+            return lat[min(len(lat) - 1, int(q * len(lat)))] if lat else None
+
+        return {
+            "model": self.model,
+            "url": self.url,
+            "records": self.done,
+            "elapsed_s": elapsed,
+            "records_per_s": self.done / elapsed if elapsed > 0 else 0.0,
+            "prompt_tokens_per_s": self.prompt_tokens / elapsed if elapsed > 0 else 0.0,
+            "latency_p50_s": pct(0.5),
+            "latency_p95_s": pct(0.95),
+            "retries": self.retries,
+        }
+
+
+def parse_target(spec: str, default_url: str) -> Target:
+    name, sep, rest = spec.partition("=")
+    if not sep:
+        name, rest = spec, spec
+    model, _, url = rest.partition("@")
+    if not name or not model:
+        raise ValueError(f"target 格式為 name=model[@url]: {spec!r}")
+    return Target(name, model, url or default_url)
+
+
+def sweep_targets(pattern: str, name_template: str, model_template: str, url: str) -> List[Target]:
+    """glob 出所有 checkpoint 資料夾，依 step 排序；{step} / {ckpt} 代入名稱樣板"""
+    targets = []
+    for path in glob.glob(pattern):
+        if not os.path.isdir(path):
+            continue
+        m = _STEP_RE.search(os.path.basename(path))
+        step = int(m.group(1)) if m else 0
+        fields = {"step": step, "ckpt": os.path.basename(path)}
+        targets.append((step, Target(name_template.format(**fields), model_template.format(**fields), url, path)))
+    return [t for _, t in sorted(targets, key=lambda x: (x[0], x[1].name))]
+
+
+def load_records(path: str) -> List[Dict[str, Any]]:
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_idx, line in enumerate(f):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                print(f"[Warning] Line {line_idx + 1} is not valid JSON. Skipped.")
+    return records
+
+
+def _prompt_messages(record: Dict[str, Any]) -> List[Dict[str, Any]]:
+    # 與 swift infer 相同：去掉最後的 assistant (標準答案)
+    messages = record.get("messages") or []
+    if messages and messages[-1].get("role") == "assistant":
+        messages = messages[:-1]
+    return messages
+
+
+def _done_indices(partial_path: str) -> Set[int]:
+    # 讀已完成的行號；最後一行不完整 (中斷時寫到一半) 就截掉
+    if not os.path.exists(partial_path):
+        return set()
+    done = set()
+    with open(partial_path, "rb+") as f:
+        data = f.read()
+        end = 0
+        for line in data.splitlines(keepends=True):
+            try:
+                done.add(json.loads(line)["idx"])
+            except (ValueError, KeyError):
+                break
+            end += len(line)
+        if end != len(data):
+            f.truncate(end)
+    return done
+
+
+def _finalize(target: Target, records: List[Dict[str, Any]], output_dir: str) -> str:
+    # 依輸入順序寫出正式檔，先寫暫存檔再 rename，中途失敗不會留下半個結果檔
+    out_path = os.path.join(output_dir, f"{target.name}.jsonl")
+    partial = out_path + ".partial"
+    results: Dict[int, str] = {}
+    with open(partial, "r", encoding="utf-8") as f:
+        for line in f:
+            item = json.loads(line)
+            idx = item.pop("idx")
+            results[idx] = json.dumps(item, ensure_ascii=False)
+    tmp = out_path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        for i in range(len(records)):
+            f.write(results[i] + "\n")
+    os.replace(tmp, out_path)
+    os.remove(partial)
+    return out_path
+
+
+def _base_url(url: str) -> str:
+    i = url.find("/v1/")
+    return url[:i] if i >= 0 else url.rstrip("/")
+
+
+async def _adapter_call(client: httpx.AsyncClient, target: Target, action: str) -> None:
+    body = {"lora_name": target.model}
+    if action == "load":
+        body["lora_path"] = os.path.abspath(target.adapter_path)
+    r = await client.post(f"{_base_url(target.url)}/v1/{action}_lora_adapter", json=body)
+    r.raise_for_status()
+
+
+class EndpointRunner:
+    """
+    一個 URL 一條佇列：同一端點上的所有 target 依序接在一起，--concurrency 個 worker 持續取下一筆。
+    """
+
+    def __init__(self, url: str, targets: List[Target], records: List[Dict[str, Any]], order: List[int], args):
+        self.url = url
+        self.targets = targets
+        self.records = records
+        self.args = args
+        self.queue: deque = deque()
+        self.files: Dict[str, Any] = {}
+        self.outputs: Dict[str, str] = {}
+        for t in targets:
+            out_path = os.path.join(args.output_dir, f"{t.name}.jsonl")
+            if os.path.exists(out_path) and not os.path.exists(out_path + ".partial") and not args.overwrite:
+                print(f"[{t.name}] 已有結果檔，略過 (重跑請加 --overwrite)")
+                self.outputs[t.name] = out_path
+                continue
+            if args.overwrite and os.path.exists(out_path + ".partial"):
+                os.remove(out_path + ".partial")
+            done = _done_indices(out_path + ".partial")
+            if done:
+                print(f"[{t.name}] 接續先前的進度: 已完成 {len(done)} 筆")
+            todo = [i for i in order if i not in done]
+            t.remaining = len(todo)
+            if not todo:  # 上次在寫正式檔之前中斷
+                self.outputs[t.name] = _finalize(t, records, args.output_dir)
+                continue
+            self.files[t.name] = open(out_path + ".partial", "a", encoding="utf-8")
+            self.queue.extend((t, i) for i in todo)
+
+    async def run(self, client: httpx.AsyncClient) -> None:
+        workers = [asyncio.ensure_future(self._worker(client)) for _ in range(self.args.concurrency)]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for w in workers:
+                w.cancel()
+            for f in self.files.values():
+                f.close()
+
+    async def _worker(self, client: httpx.AsyncClient) -> None:
+        while self.queue:
+            target, idx = self.queue.popleft()
+            if target.started is None:
+                target.started = time.monotonic()
+            if self.args.load_adapters and target.adapter_path:
+                if target.loaded is None:
+                    target.loaded = asyncio.ensure_future(_adapter_call(client, target, "load"))
+                await target.loaded
+            result = await self._request(client, target, self.records[idx])
+            f = self.files[target.name]
+            f.write(json.dumps({"idx": idx, **result}, ensure_ascii=False) + "\n")
+            target.done += 1
+            target.remaining -= 1
+            if target.done % self.args.flush_every == 0:
+                f.flush()
+            if target.remaining == 0:
+                target.finished = time.monotonic()
+                f.close()
+                self.outputs[target.name] = _finalize(target, self.records, self.args.output_dir)
+                if self.args.load_adapters and target.adapter_path:
+                    await _adapter_call(client, target, "unload")
+                print(f"[{target.name}] 完成 {target.done} 筆, {target.stats()['records_per_s']:.1f} records/s")
+
+    async def _request(self, client: httpx.AsyncClient, target: Target, record: Dict[str, Any]) -> Dict[str, Any]:
+        payload = {
+            "model": target.model,
+            "messages": _prompt_messages(record),
+            "max_tokens": self.args.max_tokens,
+            "temperature": 0,
+            **get_profile(self.args.profile, target.model).request_params(),
+        }
+        if self.args.top_logprobs > 0:
+            payload["logprobs"] = True
+            payload["top_logprobs"] = self.args.top_logprobs
+        for attempt in range(self.args.retries + 1):
+            if attempt:
+                target.retries += 1
+                await asyncio.sleep(min(30.0, 2.0 ** attempt))
+            start = time.monotonic()
+            try:
+                r = await client.post(target.url, json=payload)
+                if r.status_code == 429 or r.status_code >= 500:
+                    r.raise_for_status()
+            except httpx.HTTPError as e:
+                if attempt == self.args.retries:
+                    raise
+                print(f"[Warning] [{target.name}] 請求失敗 (第 {attempt + 1} 次): {e!r}")
+                continue
+            r.raise_for_status()  # 4xx (例如 model 名稱錯誤) 重試也沒用
+            target.latencies.append(time.monotonic() - start)
+            body = r.json()
+            target.prompt_tokens += (body.get("usage") or {}).get("prompt_tokens") or 0
+            choice = body.get("choices", [{}])[0]
+            out = {
+                "response": choice.get("message", {}).get("content", ""),
+                "labels": "True" if record_label(record) == 1 else "False",
+                "logprobs": choice.get("logprobs"),
+            }
+            for k, v in record.items():
+                if k not in out:
+                    out[k] = v
+            return out
+        raise AssertionError("unreachable")
+
+
+async def run(targets: List[Target], records: List[Dict[str, Any]], args) -> Dict[str, str]:
+    # 由長到短：長請求先進 vLLM，最後收尾的都是短請求
+    order = sorted(range(len(records)), key=lambda i: -sum(
+        len(str(m.get("content", ""))) for m in _prompt_messages(records[i])))
+    by_url: Dict[str, List[Target]] = {}
+    for t in targets:
+        by_url.setdefault(t.url, []).append(t)
+    limits = httpx.Limits(max_connections=args.concurrency * len(by_url))
+    outputs: Dict[str, str] = {}
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        runners = [EndpointRunner(url, ts, records, order, args) for url, ts in by_url.items()]
+        await asyncio.gather(*(r.run(client) for r in runners))
+    for r in runners:
+        outputs.update(r.outputs)
+    return outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--input", default="./real_data/test.jsonl", help="messages 格式的測試集")
+    parser.add_argument("--targets", nargs="*", default=[], help="name=model[@url]")
+    parser.add_argument("--url", default="http://localhost:8000/v1/chat/completions", help="target 沒指定 URL 時使用")
+    parser.add_argument("--sweep", default=None, help="checkpoint 資料夾的 glob，每個 checkpoint 一個 target")
+    parser.add_argument("--name-template", default="sft_8b_infer_test_results_{step}", help="--sweep 的輸出檔名")
+    parser.add_argument("--model-template", default="{ckpt}", help="--sweep 的 adapter 名稱")
+    parser.add_argument("--load-adapters", action="store_true", help="跑之前以 /v1/load_lora_adapter 載入，跑完卸載")
+    parser.add_argument("--output-dir", default="./inference_data")
+    parser.add_argument("--overwrite", action="store_true", help="忽略既有的結果檔與進度")
+    parser.add_argument("--concurrency", type=int, default=64, help="每個端點同時在途的請求數")
+    parser.add_argument("--max-tokens", type=int, default=1)
+    parser.add_argument("--top-logprobs", type=int, default=5, help="0 = 不要 logprobs")
+    parser.add_argument("--profile", choices=profile_names(), default="default", help="模型 profile (model_profiles.py)")
+    parser.add_argument("--retries", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--flush-every", type=int, default=64, help="每幾筆 flush 一次進度檔")
+    args = parser.parse_args()
+
+    try:
+        targets = [parse_target(s, args.url) for s in args.targets]
+    except ValueError as e:
+        parser.error(str(e))
+    if args.sweep:
+        targets += sweep_targets(args.sweep, args.name_template, args.model_template, args.url)
+    if not targets:
+        parser.error("沒有 target：請給 --targets 或 --sweep")
+    names = [t.name for t in targets]
+    if len(set(names)) != len(names):
+        parser.error(f"輸出名稱重複: {names}")
+    records = load_records(args.input)
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    start = time.monotonic()
+    outputs = asyncio.run(run(targets, records, args))
+    elapsed = time.monotonic() - start
+
+    stats: Dict[str, Any] = {"input": args.input, "n": len(records), "elapsed_s": elapsed, "targets": {}}
+    print("=" * 80)
+    print(f"🚀 推論完成: {len(targets)} 個 target × {len(records)} 筆, 共 {elapsed:.1f} s")
+    print("-" * 80)
+    for t in targets:
+        s = t.stats()
+        if t.name in outputs:
+            s["file"] = outputs[t.name]
+            s["dwa"] = compute_metrics(load_results(outputs[t.name], verbose=False))["dwa"]
+        stats["targets"][t.name] = s
+        if not s["records"]:
+            print(f"   - {t.name}: 沒有新的請求" + (f"  DWA {s['dwa']:.4f}" if "dwa" in s else ""))
+            continue
+        print(f"   - {t.name}: {s['records']} 筆, {s['records_per_s']:.1f} records/s, "
+              f"{s['prompt_tokens_per_s']:,.0f} prompt tok/s, p50 {s['latency_p50_s']:.2f} s, "
+              f"p95 {s['latency_p95_s']:.2f} s, 重試 {s['retries']}"
+              + (f", DWA {s['dwa']:.4f}" if "dwa" in s else ""))
+    print("=" * 80)
+    out_path = os.path.join(args.output_dir, "runner_stats.json")
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(stats, f, ensure_ascii=False, indent=2)
+    print(f"Wrote: {out_path}")
+
+
+if __name__ == "__main__":
+    main()
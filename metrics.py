@@ -0,0 +1,206 @@
+"""
+不依賴 prometheus_client 的最小 metrics 實作 (Prometheus text exposition format 0.0.4)，
+以及非同步 (QueueHandler) + 抽樣的結構化 log。
+所有 metrics 都只在 event loop 內更新，不需要鎖。
+"""
+from __future__ import annotations
+
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import time
+from typing import Any, Callable, Dict, Iterable, List, Sequence, Tuple
+
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+CHAR_BUCKETS = (100, 250, 500, 1000, 1500, 2000, 3000, 4500, 6000, 8000, 12000, 16000)
+TOKEN_BUCKETS = (64, 128, 256, 512, 768, 1024, 1536, 2048, 3072, 4096, 8192)
+
+
+def _fmt_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(v: Any) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_value(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, v in sorted(self._values.items()):
+            lines.append(f"{self.name}{_fmt_labels(self.labels, key)} {_fmt_value(v)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [各 bucket 的個數 (非累積)..., +Inf 個數, sum]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.labels)
+        row = self._values.get(key)
+        if row is None:
+            row = self._values[key] = [0.0] * (len(self.buckets) + 2)
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        row[i] += 1
+        row[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, row in sorted(self._values.items()):
+            cum = 0.0
+            for le, n in zip(self.buckets + (float("inf"),), row[:-1]):
+                cum += n
+                le_label = 'le="' + _fmt_value(le) + '"'
+                lines.append(f"{self.name}_bucket{_fmt_labels(self.labels, key, le_label)} {int(cum)}")
+            lines.append(f"{self.name}_sum{_fmt_labels(self.labels, key)} {_fmt_value(row[-1])}")
+            lines.append(f"{self.name}_count{_fmt_labels(self.labels, key)} {int(cum)}")
+        return lines
+
+
+class Registry:
+    """集中管理 metrics；collector 用來在 scrape 時把其他元件的 stats() 轉成 metrics。"""
+
+    def __init__(self):
+        self._metrics: List[Any] = []
+        self._collectors: List[Callable[[], Iterable[str]]] = []
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        m = Counter(name, help, labels)
+        self._metrics.append(m)
+        return m
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        m = Histogram(name, help, labels, buckets)
+        self._metrics.append(m)
+        return m
+
+    def add_collector(self, fn: Callable[[], Iterable[str]]) -> None:
+        self._collectors.append(fn)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for m in self._metrics:
+            lines.extend(m.render())
+        for fn in self._collectors:
+            lines.extend(fn())
+        return "\n".join(lines) + "\n"
+
+
+def gauge_lines(name: str, help: str, samples: Iterable[Tuple[Dict[str, Any], float]], kind: str = "gauge") -> List[str]:
+    """給 collector 用：把 (labels, value) 轉成 exposition 格式。"""
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+    for labels, v in samples:
+        lines.append(f"{name}{_fmt_labels(tuple(labels), tuple(labels.values()))} {_fmt_value(v)}")
+    return lines
+
+
+def histogram_from_counts(name: str, help: str, counts: Dict[int, int], buckets: Sequence[float]) -> List[str]:
+    """把 {值: 次數} (例如 MicroBatcher 的批次大小分佈) 轉成 Prometheus histogram。"""
+    h = Histogram(name, help, buckets=buckets)
+    row = h._values[()] = [0.0] * (len(h.buckets) + 2)
+    for value, n in counts.items():
+        i = 0
+        while i < len(h.buckets) and value > h.buckets[i]:
+            i += 1
+        row[i] += n
+        row[-1] += value * n
+    return h.render()
+
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        out = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "msg": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            out.update(fields)
+        if record.exc_info:
+            out["exc"] = self.formatException(record.exc_info)
+        return json.dumps(out, ensure_ascii=False)
+
+
+def setup_logging(name: str, level: str = "INFO", max_queue: int = 10000) -> Tuple[logging.Logger, logging.handlers.QueueListener]:
+    """
+    request path 只把 log record 丟進有上限的 queue (滿了就丟掉，不會卡住 event loop)，
+    由背景 thread 的 QueueListener 寫到 stdout。
+    """
+    q: "queue.Queue[logging.LogRecord]" = queue.Queue(maxsize=max_queue)
+
+    class _DroppingQueueHandler(logging.handlers.QueueHandler):
+        dropped = 0
+
+        def enqueue(self, record: logging.LogRecord) -> None:
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                _DroppingQueueHandler.dropped += 1
+
+    stream = logging.StreamHandler()
+    stream.setFormatter(_JsonFormatter())
+    listener = logging.handlers.QueueListener(q, stream, respect_handler_level=False)
+
+    logger = logging.getLogger(name)
+    logger.setLevel(level)
+    logger.handlers[:] = [_DroppingQueueHandler(q)]
+    logger.propagate = False
+    return logger, listener
+
+
+class SampledLogger:
+    """每筆請求的 log 只抽樣 sample_rate 比例；warning 以上一律記錄。"""
+
+    def __init__(self, logger: logging.Logger, sample_rate: float):
+        self.logger = logger
+        self.sample_rate = sample_rate
+
+    def request(self, msg: str, **fields: Any) -> None:
+        if self.sample_rate >= 1.0 or random.random() < self.sample_rate:
+            self.logger.info(msg, extra={"fields": fields})
+
+    def warning(self, msg: str, **fields: Any) -> None:
+        self.logger.warning(msg, extra={"fields": fields})
+
+
+class Timer:
+    """with Timer() as t: ...；t.elapsed 為秒數。"""
+
+    def __enter__(self) -> "Timer":
+        self.start = time.perf_counter()
+        self.elapsed = 0.0
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.elapsed = time.perf_counter() - self.start
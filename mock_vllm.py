@@ -0,0 +1,201 @@
+"""
+沒有 GPU 時用來壓測 app.py 的假 vLLM：提供 OpenAI 相容的 /v1/chat/completions 與 /health。
+
+- 延遲 = 基本延遲 (依 --latency-dist 抽樣) + prefill (依 prompt 長度) + decode (依輸出 token 數)
+- --capacity 模擬 GPU 同時能跑的序列數，超過就排隊，延遲會跟著負載上升
+- 依 --error-rate 回 5xx、依 --hang-rate 卡住不回 (測 app 的 timeout / retry)
+- --output bool 只回 True/False (對應 --max_new_tokens 1)；think 模仿 Qwen3 先輸出 <think>...</think>，
+  超過 max_tokens 會被截斷；請求帶 guided_choice / structured_outputs 或 enable_thinking=False 時直接回答
+- 請求帶 logprobs 時會附上 True/False 的 top_logprobs，fraud_probability() 可直接解析
+
+python mock_vllm.py --port 8000 --latency-ms 40 --latency-dist lognormal --error-rate 0.01
+VLLM_URL=http://localhost:8000/v1/chat/completions uvicorn app:app --port 9000
+"""
+import argparse
+import asyncio
+import math
+import random
+import time
+import uuid
+from typing import Any, Dict, List
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+_THINK_WORDS = ("the", "caller", "asks", "for", "account", "details", "which", "is", "suspicious",
+                "but", "context", "seems", "normal", "so", "consider", "intent", "carefully")
+
+
+def sample_latency_s(dist: str, median_ms: float, sigma: float, rng: random.Random) -> float:
+    """依分佈抽一個基本延遲 (秒)。lognormal 的 sigma 越大尾巴越長。"""
+    if median_ms <= 0:
+        return 0.0
+    if dist == "fixed":
+        ms = median_ms
+    elif dist == "uniform":
+        ms = rng.uniform(median_ms * (1 - sigma), median_ms * (1 + sigma))
+    elif dist == "exp":
+        ms = rng.expovariate(math.log(2) / median_ms)  # 中位數 = median_ms
+    else:
+        ms = rng.lognormvariate(math.log(median_ms), sigma)
+    return max(0.0, ms) / 1000.0
+
+
+def _prompt_chars(messages: List[Dict[str, Any]]) -> int:
+    return sum(len(str(m.get("content", ""))) for m in messages)
+
+
+def _think_text(n_tokens: int, rng: random.Random) -> str:
+    return " ".join(rng.choice(_THINK_WORDS) for _ in range(n_tokens))
+
+
+def _top_logprobs(p_true: float) -> List[Dict[str, Any]]:
+    p_true = min(max(p_true, 1e-6), 1 - 1e-6)
+    return [
+        {"token": "True", "logprob": math.log(p_true)},
+        {"token": "False", "logprob": math.log(1 - p_true)},
+    ]
+
+
+def create_app(args) -> FastAPI:
+    app = FastAPI()
+    rng = random.Random(args.seed)
+    gpu = asyncio.Semaphore(args.capacity) if args.capacity > 0 else None
+    stats = {"requests": 0, "errors": 0, "hangs": 0, "inflight": 0}
+
+    @app.get("/health")
+    async def health():
+        return {}
+
+    @app.get("/v1/models")
+    async def models():
+        return {"object": "list", "data": [{"id": args.model, "object": "model"}]}
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    # vLLM 的執行期 LoRA 載入 / 卸載 (infer_runner.py --load-adapters)；只記錄名稱
+    @app.post("/v1/load_lora_adapter")
+    async def load_lora_adapter(req: Request):
+        body = await req.json()
+        stats.setdefault("adapters", []).append(body.get("lora_name"))
+        return JSONResponse({})
+
+    @app.post("/v1/unload_lora_adapter")
+    async def unload_lora_adapter(req: Request):
+        body = await req.json()
+        if body.get("lora_name") in stats.get("adapters", []):
+            stats["adapters"].remove(body["lora_name"])
+        return JSONResponse({})
+
+    async def generate(body: Dict[str, Any]) -> Dict[str, Any]:
+        chars = _prompt_chars(body.get("messages") or [])
+        constrained = bool(body.get("guided_choice") or (body.get("structured_outputs") or {}).get("choice"))
+        thinking = (body.get("chat_template_kwargs") or {}).get("enable_thinking", True)
+        n_think = args.think_tokens if args.output == "think" and thinking and not constrained else 0
+        max_tokens = int(body.get("max_tokens") or 0)
+        truncated = bool(n_think) and 0 < max_tokens <= n_think
+        if truncated:
+            n_think = max_tokens - 1
+        delay = (
+            sample_latency_s(args.latency_dist, args.latency_ms, args.latency_sigma, rng)
+            + chars / 1000.0 * args.prefill_ms_per_1k_chars / 1000.0
+            + (n_think + 1) * args.decode_ms_per_token / 1000.0
+        )
+        await asyncio.sleep(delay)
+
+        is_true = rng.random() < args.true_rate
+        # 機率往兩端集中，偶爾落在中間 (讓 cascade 的不確定區間有東西可升級)
+        p_true = rng.betavariate(8, 1) if is_true else rng.betavariate(1, 8)
+        word = "True" if is_true else "False"
+        if truncated:
+            content = f"<think>\n{_think_text(n_think, rng)}".rstrip()
+        else:
+            content = f"<think>\n{_think_text(n_think, rng)}\n</think>\n\n{word}" if n_think else word
+        thinks = truncated or bool(n_think)
+
+        choice: Dict[str, Any] = {
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "length" if truncated else "stop",
+        }
+        if body.get("logprobs"):
+            k = int(body.get("top_logprobs") or 0)
+            first = {"token": "<think>" if thinks else word, "logprob": 0.0,
+                     "top_logprobs": [] if thinks else _top_logprobs(p_true)[:k]}
+            if not thinks:
+                first["logprob"] = math.log(p_true if is_true else 1 - p_true)
+            choice["logprobs"] = {"content": [first]}
+
+        prompt_tokens = max(1, int(chars / args.chars_per_token))
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:16]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", args.model),
+            "choices": [choice],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": n_think + 1,
+                "total_tokens": prompt_tokens + n_think + 1,
+            },
+        }
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(req: Request):
+        body = await req.json()
+        stats["requests"] += 1
+        if rng.random() < args.hang_rate:
+            stats["hangs"] += 1
+            await asyncio.sleep(args.hang_s)
+        if rng.random() < args.error_rate:
+            stats["errors"] += 1
+            return JSONResponse({"error": {"message": "mock upstream error"}}, status_code=args.error_status)
+
+        stats["inflight"] += 1
+        try:
+            if gpu is None:
+                return await generate(body)
+            async with gpu:
+                return await generate(body)
+        finally:
+            stats["inflight"] -= 1
+
+    return app
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--model", default="scam-8b-sft")
+    parser.add_argument("--latency-ms", type=float, default=30.0, help="基本延遲的中位數")
+    parser.add_argument("--latency-dist", choices=["fixed", "uniform", "exp", "lognormal"], default="lognormal")
+    parser.add_argument("--latency-sigma", type=float, default=0.5,
+                        help="lognormal 的 sigma / uniform 的相對寬度")
+    parser.add_argument("--prefill-ms-per-1k-chars", type=float, default=5.0)
+    parser.add_argument("--decode-ms-per-token", type=float, default=10.0)
+    parser.add_argument("--chars-per-token", type=float, default=3.0, help="估算 usage.prompt_tokens 用")
+    parser.add_argument("--capacity", type=int, default=64, help="同時處理的序列數 (0 = 不限)")
+    parser.add_argument("--output", choices=["bool", "think"], default="bool")
+    parser.add_argument("--think-tokens", type=int, default=64)
+    parser.add_argument("--true-rate", type=float, default=0.5)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--hang-rate", type=float, default=0.0)
+    parser.add_argument("--hang-s", type=float, default=600.0)
+    parser.add_argument("--seed", type=int, default=None)
+    return parser
+
+
+def main():
+    import uvicorn
+
+    args = build_parser().parse_args()
+    uvicorn.run(create_app(args), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
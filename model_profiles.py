@@ -0,0 +1,113 @@
+"""
+後端模型的 profile：chat template 的特殊參數、把輸出限制在 True / False 的方式，以及輸出的 parser
+(evaluation.PARSERS，與離線評估共用同一份)。
+
+app.py 只送 max_tokens=1，推理型模型 (Qwen3 的 <think>、gpt-oss 的推理段落) 第一個 token 不會是答案，
+原本解析不出來一律當成 False。profile 讓這些模型也在一步 decode 內回答：
+- chat_template_kwargs: 例如 Qwen3 的 enable_thinking=False，template 直接關掉思考段落
+- constraint: vLLM 的 guided decoding，第一個 token 就只能是 True 或 False
+  guided_choice 為 vLLM < 0.11 的參數，structured_outputs 為新版；None 表示不加限制
+  (推理型模型的 vLLM 不要加 --reasoning-parser，否則限制要等推理結束才生效)
+- parser: 萬一後端忽略了限制，仍以該模型離線評估用的 parser 解析
+
+MODEL_PROFILE=auto 時依 served model 名稱挑選，新增模型用 register_profile()。
+"""
+from typing import Any, Dict, List, Optional, Tuple
+
+from evaluation import UNPARSED, get_parser
+
+CHOICES = ["True", "False"]
+CONSTRAINTS = ("guided_choice", "structured_outputs")
+
+
+class ModelProfile:
+    """
+    參數:
+    name (str): profile 名稱 (MODEL_PROFILE / ESCALATE_PROFILE)
+    parser (str): evaluation.PARSERS 內的名稱
+    constraint (str): guided_choice / structured_outputs / None
+    chat_template_kwargs (dict): 傳給 chat template 的參數
+    extra (dict): 其他要放進請求的欄位
+    match (tuple): auto 模式下，model 名稱 (小寫) 含任一字樣就選用
+    """
+
+    def __init__(self, name: str, parser: str = "exact", constraint: Optional[str] = None,
+                 chat_template_kwargs: Optional[Dict[str, Any]] = None, extra: Optional[Dict[str, Any]] = None,
+                 match: Tuple[str, ...] = ()):
+        if constraint is not None and constraint not in CONSTRAINTS:
+            raise ValueError(f"profile {name!r}: constraint must be one of {CONSTRAINTS} or None")
+        self.name = name
+        self.parser = parser
+        self.constraint = constraint
+        self.chat_template_kwargs = dict(chat_template_kwargs or {})
+        self.extra = dict(extra or {})
+        self.match = match
+        self._parse = get_parser(parser)
+
+    def with_constraint(self, constraint: Optional[str]) -> "ModelProfile":
+        return ModelProfile(self.name, self.parser, constraint, self.chat_template_kwargs, self.extra, self.match)
+
+    def request_params(self) -> Dict[str, Any]:
+        """要併進 chat completions 請求的欄位"""
+        params: Dict[str, Any] = dict(self.extra)
+        if self.chat_template_kwargs:
+            params["chat_template_kwargs"] = dict(self.chat_template_kwargs)
+        if self.constraint == "guided_choice":
+            params["guided_choice"] = list(CHOICES)
+        elif self.constraint == "structured_outputs":
+            params["structured_outputs"] = {"choice": list(CHOICES)}
+        return params
+
+    def verdict(self, text: Optional[str]) -> Optional[str]:
+        """回傳 "True" / "False"；解析不出來時回傳 None"""
+        v = self._parse(text or "")
+        if v == UNPARSED:
+            return None
+        return "True" if v == 1 else "False"
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "profile": self.name,
+            "parser": self.parser,
+            "constraint": self.constraint,
+            "chat_template_kwargs": self.chat_template_kwargs,
+        }
+
+
+PROFILES: Dict[str, ModelProfile] = {}
+
+
+def register_profile(profile: ModelProfile) -> ModelProfile:
+    PROFILES[profile.name] = profile
+    return profile
+
+
+def get_profile(name: str, model: str = "") -> ModelProfile:
+    """name 為 auto 時依 model 名稱挑選，都不符合就用 default"""
+    if name == "auto":
+        lowered = model.lower()
+        for p in PROFILES.values():
+            if any(m in lowered for m in p.match):
+                return p
+        return PROFILES["default"]
+    if name not in PROFILES:
+        raise ValueError(f"unknown model profile: {name!r} (choices: auto, {', '.join(sorted(PROFILES))})")
+    return PROFILES[name]
+
+
+def profile_names() -> List[str]:
+    return ["auto"] + sorted(PROFILES)
+
+
+# SFT adapter 本來就只輸出 True / False：維持原本的請求內容
+register_profile(ModelProfile("default"))
+# 一般 instruct 模型 (例如 base 70b)：加上 guided decoding 避免多餘的前綴
+register_profile(ModelProfile("instruct", constraint="guided_choice"))
+register_profile(ModelProfile(
+    "qwen3", parser="qwen", constraint="guided_choice",
+    chat_template_kwargs={"enable_thinking": False}, match=("qwen",),
+))
+register_profile(ModelProfile(
+    "gpt-oss", parser="oss", constraint="guided_choice",
+    extra={"reasoning_effort": "low"}, match=("gpt-oss",),
+))
@@ -0,0 +1,217 @@
+"""
+prompt 版本 (prompts.py) 的離線 A/B：prefill token 數與 DWA。
+
+tokens: 每個版本每筆的 prompt token 數、所有請求共用的固定前綴 (依 vLLM 的 block 大小取整後可命中
+        prefix cache 的部分)，以及扣掉快取後每筆實際要 prefill 的 token 數，和 --baseline 比較
+score:  (沒給 --no-run 時) 用各版本的 prompt 直接打 OpenAI 相容端點，每個版本寫一個 evaluation.py
+        格式的結果檔，再以 paired bootstrap 比較各版本與 baseline 的 DWA；
+        後端有回 usage.prompt_tokens_details.cached_tokens 時 (vLLM --enable-prompt-tokens-details)
+        一併列出實際命中快取的 token 數
+
+python prompt_ab.py --no-run
+python prompt_ab.py --url http://localhost:8000/v1/chat/completions --model scam-8b-sft --variants full prefix
+python prompt_ab.py --model scam-8b-compact --variants full compact --bootstrap 2000
+"""
+import argparse
+import asyncio
+import json
+import os
+from typing import Any, Dict, List
+
+import httpx
+
+from confidence import fraud_probability
+from convert_to_swift_jsonl import extract_conversation, read_jsonl, record_label, write_jsonl
+from evaluation import compute_metrics, load_results, paired_test
+from model_profiles import get_profile, profile_names
+from prompts import PROMPTS, PromptVariant, get_prompt
+from token_length import (
+    CHARS_PER_TOKEN,
+    DEFAULT_TOKENIZER,
+    TEMPLATE_BASE_TOKENS,
+    TEMPLATE_TOKENS_PER_MESSAGE,
+    TokenCounter,
+    get_counter,
+)
+
+
+def shared_prefix_tokens(counter: TokenCounter, variant: PromptVariant) -> int:
+    """所有請求逐 token 相同的前綴長度 (chat template + system + user 開頭到對話之前)"""
+    tok = counter.tokenizer
+    if counter.backend == "hf" and getattr(tok, "chat_template", None):
+        # 兩段不同對話的 token 序列取共同前綴，連 template 與邊界合併的 token 都算準
+        a, b = (tok.apply_chat_template(variant.messages(c), add_generation_prompt=True, tokenize=True)
+                for c in ("0", "1"))
+        n = 0
+        for x, y in zip(a, b):
+            if x != y:
+                break
+            n += 1
+        return n
+    # 估算：system 一則 + user 開頭一則的 template 開銷
+    system, prefix = counter.count_batch([variant.system, variant.user_prefix])
+    return system + prefix + TEMPLATE_BASE_TOKENS + 2 * TEMPLATE_TOKENS_PER_MESSAGE
+
+
+def token_report(conversations: List[str], variants: List[str], counter: TokenCounter,
+                 block_size: int) -> Dict[str, Dict[str, Any]]:
+    """
+    回傳:
+    {版本: {prompt_tokens (平均), prefix_tokens, cached_tokens, prefill_tokens (平均), prefill_total}}
+    """
+    counter.count_batch(conversations)  # 先整批算好，之後各版本都命中 memo
+    report = {}
+    for name in variants:
+        v = get_prompt(name)
+        totals = [counter.chat_tokens(v.messages(c)) for c in conversations]
+        prefix = shared_prefix_tokens(counter, v)
+        # vLLM 只快取填滿的 block；第一筆以外都能重用
+        cached = prefix // block_size * block_size if block_size > 0 else prefix
+        prefill = [t - min(cached, t) for t in totals]
+        n = max(1, len(totals))
+        report[name] = {
+            "prompt_tokens": sum(totals) / n,
+            "prefix_tokens": prefix,
+            "cached_tokens": cached,
+            "prefill_tokens": sum(prefill) / n,
+            "prefill_total": sum(prefill),
+        }
+    return report
+
+
+async def _score_one(client, args, v: PromptVariant, ex: Dict[str, Any], sem) -> Dict[str, Any]:
+    conversation = extract_conversation(ex)
+    payload = {
+        "model": args.model,
+        "messages": v.messages(conversation),
+        "max_tokens": 1,
+        "temperature": 0,
+        "logprobs": True,
+        "top_logprobs": 5,
+        **get_profile(args.profile, args.model).request_params(),
+    }
+    async with sem:
+        r = await client.post(args.url, json=payload)
+    r.raise_for_status()
+    body = r.json()
+    choice = body.get("choices", [{}])[0]
+    usage = body.get("usage") or {}
+    out = {
+        "messages": payload["messages"],
+        "response": choice.get("message", {}).get("content", ""),
+        "labels": "True" if record_label(ex) == 1 else "False",
+        "prompt_tokens": usage.get("prompt_tokens"),
+        "cached_tokens": (usage.get("prompt_tokens_details") or {}).get("cached_tokens"),
+    }
+    prob = fraud_probability(choice)
+    if prob is not None:
+        out["fraud_prob"] = prob
+    return out
+
+
+async def score_variants(raw: List[Dict[str, Any]], variants: List[str], args) -> Dict[str, str]:
+    # 版本依序跑 (不交錯)，每個版本第一筆暖好快取後其餘都能命中，和線上的穩態一致
+    stem = os.path.splitext(os.path.basename(args.input))[0]
+    os.makedirs(args.output_dir, exist_ok=True)
+    paths = {}
+    sem = asyncio.Semaphore(args.concurrency)
+    async with httpx.AsyncClient(timeout=180.0) as client:
+        for name in variants:
+            v = get_prompt(name)
+            results = await asyncio.gather(*(_score_one(client, args, v, ex, sem) for ex in raw))
+            paths[name] = os.path.join(args.output_dir, f"{stem}_{name}.jsonl")
+            write_jsonl(results, paths[name])
+    return paths
+
+
+def _usage_means(path: str) -> Dict[str, Any]:
+    prompt, cached = [], []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            item = json.loads(line)
+            if item.get("prompt_tokens") is not None:
+                prompt.append(item["prompt_tokens"])
+            if item.get("cached_tokens") is not None:
+                cached.append(item["cached_tokens"])
+    return {
+        "prompt_tokens": sum(prompt) / len(prompt) if prompt else None,
+        "cached_tokens": sum(cached) / len(cached) if cached else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--input", default="./real_data/test.jsonl", help="messages 格式的測試集")
+    parser.add_argument("--variants", nargs="+", choices=sorted(PROMPTS), default=sorted(PROMPTS))
+    parser.add_argument("--baseline", default="full", help="比較基準的版本")
+    parser.add_argument("--url", default="http://localhost:8000/v1/chat/completions")
+    parser.add_argument("--model", default="scam-8b-sft")
+    parser.add_argument("--profile", choices=profile_names(), default="auto", help="模型 profile (model_profiles.py)")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--output-dir", default="./inference_data/prompt_ab", help="各版本結果檔與摘要的資料夾")
+    parser.add_argument("--no-run", action="store_true", help="只算 token，不呼叫模型")
+    parser.add_argument("--tokenizer", default=DEFAULT_TOKENIZER, help="本機快取的 tokenizer 名稱或路徑")
+    parser.add_argument("--chars-per-token", type=float, default=CHARS_PER_TOKEN, help="沒有 tokenizer 時的估算比例")
+    parser.add_argument("--block-size", type=int, default=16, help="vLLM KV cache block 大小")
+    parser.add_argument("--bootstrap", type=int, default=1000, help="paired bootstrap 次數")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    get_prompt(args.baseline)
+    variants = [args.baseline] + [v for v in dict.fromkeys(args.variants) if v != args.baseline]
+    raw = read_jsonl(args.input)
+    conversations = [extract_conversation(ex) for ex in raw]
+    counter = get_counter(args.tokenizer, args.chars_per_token)
+    tokens = token_report(conversations, variants, counter, args.block_size)
+    base = tokens[args.baseline]
+
+    print("=" * 80)
+    print(f"🧾 Prompt 版本 prefill 比較: {args.input} (N={len(raw)}, baseline {args.baseline})")
+    print(f"   - tokenizer:  {args.tokenizer} ({counter.backend}), block {args.block_size}")
+    print("-" * 80)
+    for name in variants:
+        t = tokens[name]
+        saved = 1 - t["prefill_tokens"] / base["prefill_tokens"] if base["prefill_tokens"] else 0.0
+        print(f"   - {name + ':':<10} prompt {t['prompt_tokens']:7.1f} tok/筆, 固定前綴 {t['prefix_tokens']} "
+              f"(可快取 {t['cached_tokens']}), 每筆 prefill {t['prefill_tokens']:7.1f}"
+              + ("" if name == args.baseline else f" ({-saved:+.1%})"))
+    print("=" * 80)
+
+    summary: Dict[str, Any] = {"input": args.input, "baseline": args.baseline, "tokenizer": counter.backend,
+                               "block_size": args.block_size, "tokens": tokens}
+    if not args.no_run:
+        paths = asyncio.run(score_variants(raw, variants, args))
+        data = {name: load_results(p, verbose=False, keep_keys=True) for name, p in paths.items()}
+        summary["results"] = {}
+        print(f"📊 DWA ({args.model}, baseline {args.baseline}, bootstrap {args.bootstrap} 次)")
+        print("-" * 80)
+        for name in variants:
+            m = compute_metrics(data[name])
+            usage = _usage_means(paths[name])
+            entry = {"file": paths[name], "dwa": m["dwa"], "accuracy": m["accuracy"],
+                     "unparsed": m["unparsed"], "usage": usage}
+            line = f"   - {name + ':':<10} DWA {m['dwa']:.4f}  acc {m['accuracy']:.4f}  unparsed {m['unparsed']}"
+            if name != args.baseline:
+                r = paired_test(data[args.baseline], data[name], args.bootstrap, seed=args.seed)
+                lo, hi = r["dwa_diff_ci"]
+                entry["dwa_diff"] = r["dwa_diff"]
+                entry["dwa_diff_ci"] = [lo, hi]
+                entry["dwa_p_value"] = r["dwa_p_value"]
+                line += f"  Δ {r['dwa_diff']:+.4f} [{lo:+.4f}, {hi:+.4f}] p={r['dwa_p_value']:.3f}"
+            if usage["prompt_tokens"] is not None:
+                line += f"  usage {usage['prompt_tokens']:.1f}"
+                if usage["cached_tokens"] is not None:
+                    line += f" (cached {usage['cached_tokens']:.1f})"
+            summary["results"][name] = entry
+            print(line)
+        print("=" * 80)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    out_path = os.path.join(args.output_dir, "summary.json")
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    print(f"Wrote: {out_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+送給模型的 prompt 版本 (system + user 樣板)，訓練資料 (convert_to_swift_jsonl.build_record)、
+app.py 與離線工具共用同一份文字。
+
+vLLM 的 prefix cache 只能重用「從頭開始逐位元組相同」的部分，而 max_tokens=1 時 GPU 成本幾乎都是 prefill，
+所以對話以外的固定文字應該全部放在對話之前：
+- full:     原本的版面 (SFT 訓練時用的樣板)，對話後面還有一句 Reminder，每次都要重算
+- prefix:   Reminder 併入 system，對話之後只剩結尾標籤，固定前綴可整段命中快取
+- compact:  極短的指令，給以此樣板訓練的 SFT adapter 用 (不需要完整說明)
+
+新增版本用 register_prompt()，A/B 比較見 prompt_ab.py。
+"""
+from typing import Dict, List
+
+
+SYSTEM_PROMPT = """You are a strict binary classification system specialized in fraud detection. Your task is to analyze a conversation log between two parties and determine if it exhibits characteristics of a scam or fraudulent intent.
+
+**Input Format:**
+The user will provide a conversation text enclosed within <conversation> tags.
+
+**Classification Criteria:**
+- Output 'True': If the conversation contains evidence of scamming, phishing, social engineering, financial fraud, or malicious intent by either party.
+- Output 'False': If the conversation appears to be a normal, benign interaction without fraudulent intent.
+
+**Output Constraints (CRITICAL):**
+1. You must output EXACTLY one word: "True" or "False".
+2. Do NOT output any explanation, reasoning, preamble, or punctuation.
+3. Do NOT output markdown formatting (e.g., no bold, no code blocks).
+4. Do NOT apologize or converse.
+5. If the input is empty or unintelligible, output "False" (as the safe default) or handle strictly as per specific edge-case logic.
+"""
+
+REMINDER = 'Reminder: Based on the system instructions, output ONLY "True" or "False".'
+
+USER_TEMPLATE = (
+    'Here is the conversation log to classify: <conversation>\n'
+    '{conversation}\n'
+    '</conversation>\n'
+    + REMINDER
+)
+
+
+class PromptVariant:
+    """
+    參數:
+    name (str): 版本名稱 (PROMPT_VARIANT / --prompt)
+    system (str): system message
+    user_template (str): user message，以 {conversation} 代入對話
+    """
+
+    def __init__(self, name: str, system: str, user_template: str, description: str = ""):
+        if user_template.count("{conversation}") != 1:
+            raise ValueError(f"prompt {name!r}: user_template must contain {{conversation}} exactly once")
+        self.name = name
+        self.system = system
+        self.user_template = user_template
+        self.description = description
+        self.user_prefix, self.user_suffix = user_template.split("{conversation}")
+
+    def messages(self, conversation: str) -> List[Dict[str, str]]:
+        # 不用 str.format：對話裡的大括號不需要跳脫
+        return [
+            {"role": "system", "content": self.system},
+            {"role": "user", "content": self.user_prefix + conversation + self.user_suffix},
+        ]
+
+
+PROMPTS: Dict[str, PromptVariant] = {}
+
+
+def register_prompt(name: str, system: str, user_template: str, description: str = "") -> PromptVariant:
+    variant = PromptVariant(name, system, user_template, description)
+    PROMPTS[name] = variant
+    return variant
+
+
+def get_prompt(name: str) -> PromptVariant:
+    if name not in PROMPTS:
+        raise ValueError(f"unknown prompt variant: {name!r} (choices: {', '.join(sorted(PROMPTS))})")
+    return PROMPTS[name]
+
+
+register_prompt("full", SYSTEM_PROMPT, USER_TEMPLATE, "原本的版面，與 SFT 訓練資料相同")
+register_prompt(
+    "prefix",
+    SYSTEM_PROMPT + "\n" + REMINDER,
+    'Here is the conversation log to classify: <conversation>\n{conversation}\n</conversation>',
+    "Reminder 移到 system，對話之前的文字全部固定",
+)
+register_prompt(
+    "compact",
+    'Classify the call transcript as fraud. Output only "True" (scam) or "False" (benign).',
+    '<conversation>\n{conversation}\n</conversation>',
+    "極短指令，需搭配以此樣板訓練的 adapter",
+)
@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import random
+import re
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+
+# (model, payload) -> {"output": 與線上相同規則的判定, "fraud_prob": 校準後的機率, "raw": argmax token, "p_raw": 未校準的機率}
+ScoreFn = Callable[[str, Dict[str, Any]], Awaitable[Dict[str, Any]]]
+
+_UNSAFE_RE = re.compile(r"[^A-Za-z0-9._-]+")
+
+
+def shadow_log_path(log_dir: str, model: str) -> str:
+    return os.path.join(log_dir, f"shadow_{_UNSAFE_RE.sub('_', model)}.jsonl")
+
+
+class ShadowScorer:
+    """
+    Shadow mode：抽樣一部分線上請求，非同步送給候選 adapter (同一個 vLLM、同一個 base model 上的 LoRA)
+    評分並記錄下來，不影響原本請求的延遲與結果。
+
+    每個候選 adapter 寫一個 shadow_<model>.jsonl，格式與 swift infer 的結果檔相同
+    (messages / response / labels / fraud_prob)，可直接交給 evaluation.py；
+    labels 是線上實際回傳的判定，response 是候選 adapter 以同一套校準與門檻得到的判定
+    (raw_response / raw_prob 另外記下 argmax token 與未校準的機率)，
+    算出來的 DWA 是「與線上判定的一致程度」，有人工標註時把 labels 換掉就是真正的 DWA。
+    抽樣發生在線上判定之後，快取命中、前置篩選等各種 tier 都會被抽到 (sampled_by_tier)。
+
+    參數:
+    models: 候選 adapter 的 served model name
+    score_fn: 實際送出請求並解析結果的 async 函式
+    sample_rate (float): 送去 shadow 的請求比例
+    max_concurrency (int): shadow 請求自己的併發上限，不佔主流量的名額
+    max_pending (int): 等待中的 shadow 工作上限，超過就直接略過 (不排隊、不回壓主流量)
+    log_dir (str): 結果檔的資料夾
+    """
+
+    def __init__(self, models: List[str], score_fn: ScoreFn, sample_rate: float, max_concurrency: int,
+                 max_pending: int, log_dir: str, seed: Optional[int] = None):
+        self.models = list(models)
+        self.sample_rate = sample_rate
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self.log_dir = log_dir
+        self._score_fn = score_fn
+        self._rng = random.Random(seed)
+        self._sem = asyncio.Semaphore(max_concurrency)
+        self._tasks: set = set()
+        os.makedirs(log_dir, exist_ok=True)
+        self._files = {m: open(shadow_log_path(log_dir, m), "a", encoding="utf-8") for m in self.models}
+
+        self.sampled = 0
+        self.sampled_by_tier: Dict[str, int] = {}
+        self.skipped = 0  # 抽中但 max_pending 已滿
+        self.outcomes = {m: {"agree": 0, "disagree": 0, "error": 0} for m in self.models}
+
+    def submit(self, make_payload: Callable[[], Dict[str, Any]], reference: Dict[str, Any]) -> bool:
+        """
+        參數:
+        make_payload: 產生送給主模型的請求 (model 會換成候選 adapter)；只有抽中時才會呼叫
+        reference: 線上的判定 {"output": "True"/"False", "fraud_prob", "tier"}
+
+        回傳:
+        是否有送去 shadow (呼叫端不需要等它)
+        """
+        if not self.models or self._rng.random() >= self.sample_rate:
+            return False
+        if len(self._tasks) >= self.max_pending:
+            self.skipped += 1
+            return False
+        self.sampled += 1
+        tier = reference.get("tier") or "unknown"
+        self.sampled_by_tier[tier] = self.sampled_by_tier.get(tier, 0) + 1
+        task = asyncio.ensure_future(self._run(make_payload(), reference))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+
+    async def _run(self, payload: Dict[str, Any], reference: Dict[str, Any]) -> None:
+        await asyncio.gather(*(self._score_one(m, payload, reference) for m in self.models))
+
+    async def _score_one(self, model: str, payload: Dict[str, Any], reference: Dict[str, Any]) -> None:
+        try:
+            async with self._sem:
+                score = await self._score_fn(model, payload)
+        except Exception:
+            self.outcomes[model]["error"] += 1
+            return
+        self.outcomes[model]["agree" if score["output"] == reference["output"] else "disagree"] += 1
+        record = {
+            "messages": payload["messages"],
+            "response": score["output"],
+            "labels": reference["output"],
+            "raw_response": score["raw"],
+            "model": model,
+            "reference_tier": reference.get("tier"),
+            "reference_prob": reference.get("fraud_prob"),
+            "ts": round(time.time(), 3),
+        }
+        if score.get("fraud_prob") is not None:
+            record["fraud_prob"] = score["fraud_prob"]
+        if score.get("p_raw") is not None:
+            record["raw_prob"] = score["p_raw"]
+        f = self._files[model]
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        f.flush()
+
+    async def aclose(self, timeout_s: float = 5.0) -> None:
+        # 關機時給在途的 shadow 請求一點時間寫完，剩下的直接取消
+        if self._tasks:
+            _, pending = await asyncio.wait(set(self._tasks), timeout=timeout_s)
+            for t in pending:
+                t.cancel()
+        for f in self._files.values():
+            f.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "models": self.models,
+            "sample_rate": self.sample_rate,
+            "max_concurrency": self.max_concurrency,
+            "pending": len(self._tasks),
+            "sampled": self.sampled,
+            "sampled_by_tier": self.sampled_by_tier,
+            "skipped": self.skipped,
+            "outcomes": self.outcomes,
+            "log_dir": self.log_dir,
+        }
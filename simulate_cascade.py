@@ -0,0 +1,121 @@
+"""
+用 inference_data/ 內既有的推論結果離線模擬兩階段 cascade (app.py 的 ESCALATE_*)，
+估算不同升級門檻下的準確率、DWA 與 GPU 成本。
+
+兩個檔案以對話內容對齊 (取交集)。GPU 成本以「對話長度 × 模型成本係數」估算
+(max_tokens=1 時幾乎全是 prefill)，並以「全部交給第二階段」為 1.0 做正規化。
+第一階段檔案有 logprobs (swift infer --logprobs true --top_logprobs 5) 時才能模擬 --bands。
+
+python simulate_cascade.py \\
+    --tier1 ./inference_data/sft_8b_infer_test_results_108_v4.jsonl \\
+    --tier2 ./inference_data/base_70b_awq_infer_test_results.jsonl \\
+    --long-chars 0 2000 3000 4500 --bands 0.2:0.8 0.05:0.95
+"""
+import argparse
+import itertools
+from typing import Any, Dict, List, Optional
+
+from confidence import fraud_probability
+from convert_to_swift_jsonl import extract_conversation, read_jsonl, record_label
+from evaluation import DETECT_SAMPLE, compute_dwa, detect_parser, get_parser
+
+
+def _load(path: str, parser: str = "auto") -> Dict[str, Dict[str, Any]]:
+    items = read_jsonl(path)
+    if parser == "auto":
+        parser = detect_parser(item.get("response") for item in items[:DETECT_SAMPLE])
+    parse = get_parser(parser)
+    out = {}
+    for item in items:
+        conv = extract_conversation(item)
+        out[conv] = {
+            # 無法解析時為 UNPARSED (-1)，和標籤比對一律算答錯
+            "pred": parse(item.get("response")),
+            "prob": fraud_probability(item),
+            "label": record_label(item),
+        }
+    return out
+
+
+def simulate(tier1, tier2, convs, long_chars: int, band, cost1: float, cost2: float) -> Dict[str, Any]:
+    lengths, correct, fraud = [], [], []
+    n_esc = 0
+    cost = 0.0
+    for conv in convs:
+        r1, r2 = tier1[conv], tier2[conv]
+        L = len(conv)
+        escalate = bool(long_chars) and L > long_chars
+        if not escalate and band is not None and r1["prob"] is not None:
+            escalate = band[0] <= r1["prob"] <= band[1]
+
+        cost += L * cost1
+        pred = r1["pred"]
+        if escalate:
+            n_esc += 1
+            cost += L * cost2
+            pred = r2["pred"]
+
+        lengths.append(L)
+        correct.append(pred == r1["label"])
+        fraud.append(r1["label"] == 1)
+
+    dwa, _, _ = compute_dwa(lengths, correct, fraud)
+    return {
+        "escalation_rate": n_esc / len(convs),
+        "accuracy": sum(correct) / len(convs),
+        "dwa": dwa,
+        "cost": cost,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tier1", required=True, help="第一階段 (便宜模型) 推論結果")
+    parser.add_argument("--tier2", required=True, help="第二階段 (大模型) 推論結果")
+    parser.add_argument("--cost1", type=float, default=8.0, help="第一階段成本係數 (預設以參數量 8B)")
+    parser.add_argument("--cost2", type=float, default=70.0, help="第二階段成本係數 (預設以參數量 70B)")
+    parser.add_argument("--long-chars", type=int, nargs="+", default=[0, 2000, 3000, 4500])
+    parser.add_argument("--bands", nargs="*", default=["0.2:0.8"],
+                        help="不確定區間 low:high，可給多組")
+    parser.add_argument("--parser1", default="auto", help="第一階段 response 的解析方式 (evaluation.PARSERS)")
+    parser.add_argument("--parser2", default="auto", help="第二階段 response 的解析方式")
+    args = parser.parse_args()
+
+    tier1 = _load(args.tier1, args.parser1)
+    tier2 = _load(args.tier2, args.parser2)
+    convs = [c for c in tier1 if c in tier2]
+    if not convs:
+        print("兩個檔案沒有相同的對話，無法模擬。")
+        return
+
+    has_prob = any(tier1[c]["prob"] is not None for c in convs)
+    bands: List[Optional[tuple]] = [None]
+    if has_prob:
+        bands += [tuple(float(x) for x in b.split(":")) for b in args.bands]
+    else:
+        print("⚠️  第一階段檔案沒有 logprobs，只模擬以長度升級。")
+
+    full_cost = sum(len(c) for c in convs) * args.cost2
+    rows = [("tier1 only", simulate(tier1, tier2, convs, 0, None, args.cost1, 0.0)),
+            ("tier2 only", simulate(tier1, tier2, convs, -1, None, 0.0, args.cost2))]
+    for long_chars, band in itertools.product(args.long_chars, bands):
+        if not long_chars and band is None:
+            continue
+        name = f"long>{long_chars}" if long_chars else "-"
+        name += f", band={band[0]}:{band[1]}" if band else ""
+        rows.append((name, simulate(tier1, tier2, convs, long_chars, band, args.cost1, args.cost2)))
+
+    print("=" * 80)
+    print(f"📊 Cascade 模擬: N={len(convs)}")
+    print(f"   - tier1: {args.tier1}")
+    print(f"   - tier2: {args.tier2}")
+    print("-" * 80)
+    print(f"{'policy':<32}{'escalated':>10}{'accuracy':>10}{'DWA':>10}{'GPU cost':>10}")
+    for name, r in rows:
+        print(f"{name:<32}{r['escalation_rate']:>10.2%}{r['accuracy']:>10.4f}"
+              f"{r['dwa']:>10.4f}{r['cost'] / full_cost:>10.3f}")
+    print("=" * 80)
+
+
+if __name__ == "__main__":
+    main()
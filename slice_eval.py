@@ -0,0 +1,361 @@
+"""
+推論結果的分層錯誤分析：依對話長度 (字元 / token)、標籤、資料來源 (real_data / syn_data) 分組，
+每組列出準確率、對 DWA 的貢獻與損失、<think> 長度與答錯的樣本。
+token 數與 app.py、convert_to_swift_jsonl.py 一樣用 token_length.py 計算 (找不到 tokenizer 時以 --chars-per-token 估算)，
+token 分組才會對得上線上實際套用的預算。
+
+只讀一次結果檔，逐筆累加到各組的計數與加權和；DWA 需要的全域最大長度 M 到最後才知道，
+所以各組存 sum(k)、sum(k*L)、sum(k*c)、sum(k*c*L)，最後以 sum(w) = sum(k) - sum(k*L) / M 換算。
+
+給 --cheap (同一測試集上便宜模型的結果) 時，會依長度區間比較兩者，標出可以安全改走便宜模型的區間。
+
+python slice_eval.py ./inference_data/base_70b_awq_infer_test_results.jsonl \\
+    --cheap ./inference_data/sft_8b_infer_test_results_108_v4.jsonl --output ./reports/70b_slices.json
+"""
+import argparse
+import glob
+import json
+import math
+import os
+import re
+from itertools import chain, islice
+from typing import Any, Dict, List, Optional, Tuple
+
+from convert_to_swift_jsonl import extract_conversation
+from evaluation import (
+    ALPHA_COST,
+    BETA_COST,
+    DETECT_SAMPLE,
+    PARSERS,
+    UNPARSED,
+    conversation_key,
+    detect_parser,
+    get_parser,
+    parse_label,
+)
+from token_length import CHARS_PER_TOKEN, DEFAULT_TOKENIZER, TokenCounter, get_counter
+
+
+CHAR_EDGES = (500, 1000, 2000, 3000, 4500, 8000)
+TOKEN_EDGES = (128, 256, 512, 1024, 2048, 4096)
+DEFAULT_SOURCES = ("real_data=./real_data/*.jsonl", "syn_data=./syn_data/*.jsonl")
+
+_THINK_RE = re.compile(r'<think>(.*?)</think>', re.DOTALL)
+TOKEN_BATCH = 512
+
+
+def bucket_name(value: float, edges) -> str:
+    lo = 0
+    for e in edges:
+        if value < e:
+            return f"[{lo}, {e})"
+        lo = e
+    return f"[{lo}, inf)"
+
+
+def bucket_order(edges) -> List[str]:
+    return [bucket_name(e - 1, edges) for e in edges] + [bucket_name(edges[-1], edges)]
+
+
+def wilson_lower(k: int, n: int, z: float = 1.96) -> float:
+    """二項比例的 Wilson 下界，樣本少的組不會因為剛好全對就被當成安全"""
+    if n == 0:
+        return 0.0
+    p = k / n
+    denom = 1 + z * z / n
+    center = p + z * z / (2 * n)
+    margin = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n))
+    return (center - margin) / denom
+
+
+def load_sources(specs: List[str]) -> Dict[int, str]:
+    """name=glob 形式的資料來源，回傳 對話 hash -> 來源名稱"""
+    out: Dict[int, str] = {}
+    for spec in specs:
+        name, _, pattern = spec.partition("=")
+        for path in sorted(glob.glob(pattern)):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        out.setdefault(conversation_key(extract_conversation(json.loads(line))), name)
+    return out
+
+
+class Group:
+    """一個分組的累加器"""
+
+    __slots__ = ("n", "correct", "fraud", "fn", "fp", "unparsed", "think_n", "think_chars",
+                 "k", "kL", "kc", "kcL", "errors")
+
+    def __init__(self):
+        self.n = self.correct = self.fraud = self.fn = self.fp = self.unparsed = 0
+        self.think_n = self.think_chars = 0
+        self.k = self.kL = self.kc = self.kcL = 0.0
+        self.errors: List[Dict[str, Any]] = []
+
+    def add(self, rec: Dict[str, Any], max_examples: int) -> None:
+        ok = rec["pred"] == rec["label"]
+        k = rec["k"]
+        L = rec["length"]
+        self.n += 1
+        self.k += k
+        self.kL += k * L
+        if rec["label"] == 1:
+            self.fraud += 1
+        if rec["pred"] == UNPARSED:
+            self.unparsed += 1
+        if rec["think_chars"] is not None:
+            self.think_n += 1
+            self.think_chars += rec["think_chars"]
+        if ok:
+            self.correct += 1
+            self.kc += k
+            self.kcL += k * L
+            return
+        if rec["label"] == 1:
+            self.fn += 1
+        else:
+            self.fp += 1
+        if len(self.errors) < max_examples:
+            self.errors.append({key: rec[key] for key in ("line", "length", "label", "pred", "preview")})
+
+    def summary(self, M: float, total_weight: float) -> Dict[str, Any]:
+        w = self.k - self.kL / M
+        wc = self.kc - self.kcL / M
+        return {
+            "n": self.n,
+            "accuracy": self.correct / self.n if self.n else 0.0,
+            "accuracy_lower95": wilson_lower(self.correct, self.n),
+            "fraud": self.fraud,
+            "fn": self.fn,
+            "fp": self.fp,
+            "unparsed": self.unparsed,
+            "weight_share": w / total_weight if total_weight else 0.0,
+            "dwa_contribution": wc / total_weight if total_weight else 0.0,
+            "dwa_lost": (w - wc) / total_weight if total_weight else 0.0,
+            "avg_think_chars": self.think_chars / self.think_n if self.think_n else None,
+            "errors": self.errors,
+        }
+
+
+def _iter_records(path: str, parser: str, sources: Dict[int, str], alpha, beta):
+    with open(path, 'r', encoding='utf-8') as f:
+        numbered = ((i + 1, line) for i, line in enumerate(f) if line.strip())
+        head = list(islice(numbered, DETECT_SAMPLE))  # auto 模式先看前幾筆決定 parser，其餘照樣串流
+        if parser == "auto":
+            parser = detect_parser(json.loads(line).get('response') for _, line in head)
+        parse = get_parser(parser)
+        for line_no, line in chain(head, numbered):
+            item = json.loads(line)
+            conv = extract_conversation(item)
+            key = conversation_key(conv)
+            response = str(item.get('response') or '')
+            think = _THINK_RE.search(response)
+            label = parse_label(item)
+            yield {
+                "line": line_no,
+                "length": len(conv),
+                "conv": conv,
+                "label": label,
+                "pred": parse(response),
+                "k": alpha if label == 1 else beta,
+                "source": sources.get(key, "unknown"),
+                "key": key,
+                "think_chars": len(think.group(1).strip()) if think else None,
+                "preview": conv[:80].replace("\n", " "),
+            }
+
+
+def _iter_table_records(path: str, parser: str, sources: Dict[int, str], alpha, beta):
+    # 從 columnar.py 的欄位快取讀：數值欄位是 memmap，文字只在需要時才解碼
+    from columnar import open_table
+
+    table = open_table(path)
+    preds = table.preds(parser)
+    for i in range(len(table)):
+        conv = table.conversation(i)
+        key = int(table.keys[i])
+        label = int(table.labels[i])
+        think = _THINK_RE.search(table.response(i))
+        yield {
+            "line": int(table.lines[i]),
+            "length": int(table.lengths[i]),
+            "conv": conv,
+            "label": label,
+            "pred": int(preds[i]),
+            "k": alpha if label == 1 else beta,
+            "source": sources.get(key, "unknown"),
+            "key": key,
+            "think_chars": len(think.group(1).strip()) if think else None,
+            "preview": conv[:80].replace("\n", " "),
+        }
+
+
+def _with_tokens(records, counter: TokenCounter):
+    # 每 TOKEN_BATCH 筆一起編碼 (fast tokenizer 整批平行處理)，填好 tokens 後丟掉對話全文
+    while True:
+        batch = list(islice(records, TOKEN_BATCH))
+        if not batch:
+            return
+        for rec, n in zip(batch, counter.count_batch([r.pop("conv") for r in batch])):
+            rec["tokens"] = n
+            yield rec
+
+
+def slice_report(path: str, parser: str = "auto", sources: Optional[Dict[int, str]] = None,
+                 char_edges=CHAR_EDGES, token_edges=TOKEN_EDGES, counter: Optional[TokenCounter] = None,
+                 max_examples: int = 5, alpha=ALPHA_COST, beta=BETA_COST,
+                 columnar: bool = False) -> Tuple[Dict[str, Any], Dict[int, Tuple[int, int]]]:
+    """
+    一次走過結果檔並依各維度分組；counter 沒給時用 token_length.get_counter() 的預設 tokenizer
+
+    回傳: (報表, 對話 hash -> (長度, 是否答對))，後者給 --cheap 比較用
+    """
+    dims = {
+        "chars": lambda r: bucket_name(r["length"], char_edges),
+        "tokens": lambda r: bucket_name(r["tokens"], token_edges),
+        "label": lambda r: {1: "True", 0: "False"}.get(r["label"], "Unknown"),
+        "source": lambda r: r["source"],
+        "chars_x_label": lambda r: f"{bucket_name(r['length'], char_edges)} / "
+                                   f"{ {1: 'True', 0: 'False'}.get(r['label'], 'Unknown') }",
+    }
+    groups: Dict[str, Dict[str, Group]] = {d: {} for d in dims}
+    overall = Group()
+    per_key: Dict[int, Tuple[int, int]] = {}
+    M = 0
+    counter = counter or get_counter()
+    records = _iter_table_records if columnar else _iter_records
+    for rec in _with_tokens(records(path, parser, sources or {}, alpha, beta), counter):
+        M = max(M, rec["length"])
+        overall.add(rec, 0)
+        for d, fn in dims.items():
+            groups[d].setdefault(fn(rec), Group()).add(rec, max_examples)
+        per_key[rec["key"]] = (rec["length"], int(rec["pred"] == rec["label"]))
+
+    M = M + 1e-9
+    total = overall.k - overall.kL / M
+    char_order = bucket_order(char_edges)
+    sort_keys = {
+        "chars": char_order.index,
+        "tokens": bucket_order(token_edges).index,
+        "chars_x_label": lambda name: (char_order.index(name.split(" / ")[0]), name),
+    }
+
+    def ordered(d):
+        names = sorted(groups[d], key=sort_keys.get(d))
+        return {name: groups[d][name].summary(M, total) for name in names}
+
+    report = {
+        "path": path,
+        "overall": overall.summary(M, total),
+        "max_len": int(M),
+        "tokenizer": counter.stats(),
+        "slices": {d: ordered(d) for d in dims},
+    }
+    report["overall"]["dwa"] = report["overall"]["dwa_contribution"]
+    return report, per_key
+
+
+def cheap_regimes(main: Dict[int, Tuple[int, int]], cheap: Dict[int, Tuple[int, int]], char_edges,
+                  min_acc: float, min_n: int) -> List[Dict[str, Any]]:
+    """
+    依長度區間比較主模型與便宜模型 (只看兩邊都有的對話)。
+    便宜模型準確率的 Wilson 95% 下界 >= min_acc，且答錯數不多於主模型時，標為可安全改走便宜模型
+    """
+    stats: Dict[str, List[int]] = {}
+    for key, (L, ok_main) in main.items():
+        if key not in cheap:
+            continue
+        s = stats.setdefault(bucket_name(L, char_edges), [0, 0, 0])
+        s[0] += 1
+        s[1] += ok_main
+        s[2] += cheap[key][1]
+    out = []
+    for name in bucket_order(char_edges):
+        if name not in stats:
+            continue
+        n, ok_main, ok_cheap = stats[name]
+        lower = wilson_lower(ok_cheap, n)
+        out.append({
+            "chars": name,
+            "n": n,
+            "main_accuracy": ok_main / n,
+            "cheap_accuracy": ok_cheap / n,
+            "cheap_accuracy_lower95": lower,
+            "safe": n >= min_n and lower >= min_acc and ok_cheap >= ok_main,
+        })
+    return out
+
+
+def _print_report(report: Dict[str, Any], regimes: Optional[List[Dict[str, Any]]], show_errors: bool) -> None:
+    o = report["overall"]
+    print("=" * 80)
+    print(f"🔍 分層錯誤分析: {report['path']}")
+    print(f"   - 總樣本數 (N):      {o['n']}   準確率 {o['accuracy']:.4f}   DWA {o['dwa']:.4f}")
+    print(f"   - 全域最大長度 (Max): {report['max_len']} chars")
+    print(f"   - token 計算:        {report['tokenizer']['tokenizer']} ({report['tokenizer']['backend']})")
+    for dim, rows in report["slices"].items():
+        print("-" * 80)
+        print(f"{dim:<28}{'n':>6}{'acc':>8}{'FN':>5}{'FP':>5}{'w share':>9}{'DWA lost':>10}{'think':>8}")
+        for name, r in rows.items():
+            think = f"{r['avg_think_chars']:.0f}" if r["avg_think_chars"] is not None else "-"
+            print(f"{name:<28}{r['n']:>6}{r['accuracy']:>8.4f}{r['fn']:>5}{r['fp']:>5}"
+                  f"{r['weight_share']:>9.2%}{r['dwa_lost']:>10.4f}{think:>8}")
+    if show_errors:
+        print("-" * 80)
+        print("答錯的樣本 (依字元長度區間):")
+        for name, r in report["slices"]["chars"].items():
+            for e in r["errors"]:
+                print(f"   {name:<16} line {e['line']:>5}  L={e['length']:<6} label={e['label']} "
+                      f"pred={e['pred']}  {e['preview']}")
+    if regimes:
+        print("-" * 80)
+        print(f"{'便宜模型 (chars)':<24}{'n':>6}{'main acc':>10}{'cheap acc':>11}{'lower95':>9}  safe")
+        for r in regimes:
+            print(f"{r['chars']:<24}{r['n']:>6}{r['main_accuracy']:>10.4f}{r['cheap_accuracy']:>11.4f}"
+                  f"{r['cheap_accuracy_lower95']:>9.4f}  {'✅' if r['safe'] else '-'}")
+    print("=" * 80)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="推論結果 JSONL")
+    parser.add_argument("--parser", default="auto", choices=["auto"] + sorted(PARSERS))
+    parser.add_argument("--char-edges", type=int, nargs="+", default=list(CHAR_EDGES))
+    parser.add_argument("--token-edges", type=int, nargs="+", default=list(TOKEN_EDGES))
+    parser.add_argument("--tokenizer", default=DEFAULT_TOKENIZER, help="本機快取的 tokenizer 名稱或路徑")
+    parser.add_argument("--chars-per-token", type=float, default=CHARS_PER_TOKEN, help="沒有 tokenizer 時的估算比例")
+    parser.add_argument("--sources", nargs="*", default=list(DEFAULT_SOURCES),
+                        help="name=glob，依對話內容判斷每筆來自哪個資料集")
+    parser.add_argument("--max-examples", type=int, default=5, help="每組最多列幾筆答錯的樣本")
+    parser.add_argument("--show-errors", action="store_true")
+    parser.add_argument("--cheap", default=None, help="同一測試集上便宜模型的結果檔")
+    parser.add_argument("--cheap-parser", default="auto", choices=["auto"] + sorted(PARSERS))
+    parser.add_argument("--min-acc", type=float, default=0.95, help="便宜模型準確率下界的門檻")
+    parser.add_argument("--min-n", type=int, default=20, help="區間樣本數少於此值不標為安全")
+    parser.add_argument("--output", default=None, help="完整報表 JSON")
+    parser.add_argument("--columnar", action="store_true", help="從 columnar.py 的欄位快取讀取")
+    args = parser.parse_args()
+
+    sources = load_sources(args.sources)
+    counter = get_counter(args.tokenizer, args.chars_per_token)
+    report, per_key = slice_report(args.path, args.parser, sources, args.char_edges, args.token_edges,
+                                   counter, args.max_examples, columnar=args.columnar)
+    regimes = None
+    if args.cheap:
+        _, cheap_key = slice_report(args.cheap, args.cheap_parser, None, args.char_edges, args.token_edges,
+                                    counter, 0, columnar=args.columnar)
+        regimes = cheap_regimes(per_key, cheap_key, args.char_edges, args.min_acc, args.min_n)
+        report["cheap"] = {"path": args.cheap, "regimes": regimes}
+
+    _print_report(report, regimes, args.show_errors)
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Wrote: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
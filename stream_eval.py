@@ -0,0 +1,150 @@
+"""
+通話中即時評分 (/stream) 的離線評估。
+
+make:   把測試集依 cut_pct 截短，產生 messages 格式的 JSONL，
+        可直接丟給既有的推論流程，再用 evaluation.py 算 DWA。
+replay: 逐句重播測試集，模擬 StreamSession 的重評 / 提早結案規則，
+        直接打 OpenAI 相容的 vLLM 端點，統計偵測率、誤報率、平均在第幾成通話時攔下。
+
+python stream_eval.py make --input ./real_data/test.jsonl --cut-pcts 25 50 75
+python stream_eval.py replay --input ./real_data/test.jsonl --url http://localhost:8000/v1/chat/completions
+"""
+import argparse
+import asyncio
+import os
+from typing import Any, Dict, List
+
+import httpx
+
+from confidence import fraud_probability
+from convert_to_swift_jsonl import (
+    build_record,
+    extract_conversation,
+    read_jsonl,
+    record_label,
+    truncate_dialogue,
+    write_jsonl,
+)
+from model_profiles import get_profile, profile_names
+from prompts import PROMPTS, get_prompt
+from streaming import StreamSession
+
+
+def make_truncated(input_path: str, cut_pcts: List[int], out_dir: str, prompt: str = "full") -> None:
+    raw = read_jsonl(input_path)
+    stem = os.path.splitext(os.path.basename(input_path))[0]
+    os.makedirs(out_dir, exist_ok=True)
+    for pct in cut_pcts:
+        records = [
+            build_record(truncate_dialogue(extract_conversation(ex), pct), record_label(ex), pct, prompt)
+            for ex in raw
+        ]
+        write_jsonl(records, os.path.join(out_dir, f"{stem}_cut{pct}.jsonl"))
+
+
+async def _replay_one(client, url: str, model: str, ex: Dict[str, Any], args, sem) -> Dict[str, Any]:
+    turns = [t for t in extract_conversation(ex).split("\n") if t.strip()]
+    profile = get_profile(args.profile, model)
+    s = StreamSession(every_turns=args.every_turns, every_chars=args.every_chars,
+                      confirm_n=args.confirm_n, final_threshold=args.final_threshold)
+
+    async def score(text: str):
+        payload = {
+            "model": model,
+            "messages": get_prompt(args.prompt).messages(text),
+            "max_tokens": 1,
+            "temperature": 0,
+            "logprobs": True,
+            "top_logprobs": 5,
+            **profile.request_params(),
+        }
+        async with sem:
+            r = await client.post(url, json=payload)
+        r.raise_for_status()
+        choice = r.json().get("choices", [{}])[0]
+        prob = fraud_probability(choice)
+        if prob is None:
+            return profile.verdict(choice.get("message", {}).get("content", "")) or "False", None
+        return ("True" if prob >= args.threshold else "False"), prob
+
+    for t in turns:
+        if s.add_turns([t]):
+            s.record(*(await score(s.text)))
+        if s.final:
+            break
+    if s.has_unscored():  # 通話結束，補評最後一次
+        s.record(*(await score(s.text)))
+
+    out = s.to_dict()
+    out.pop("session_id")
+    out["label"] = record_label(ex)
+    out["total_turns"] = len(turns)
+    return out
+
+
+async def replay(args) -> None:
+    raw = read_jsonl(args.input)
+    sem = asyncio.Semaphore(args.concurrency)
+    async with httpx.AsyncClient(timeout=180.0) as client:
+        results = await asyncio.gather(
+            *(_replay_one(client, args.url, args.model, ex, args, sem) for ex in raw)
+        )
+
+    if args.output:
+        write_jsonl(results, args.output)
+
+    fraud = [r for r in results if r["label"] == 1]
+    normal = [r for r in results if r["label"] == 0]
+    detected = [r for r in fraud if r["verdict"] == "True"]
+    early = [r for r in fraud if r["final"]]
+    false_alarm = [r for r in normal if r["verdict"] == "True"]
+    detect_frac = [r["final_at_turn"] / r["total_turns"] for r in early if r["total_turns"]]
+    n_calls = sum(r["n_scored"] for r in results)
+
+    print("=" * 80)
+    print(f"📞 Streaming 重播結果: {args.input}")
+    print(f"   - 參數設定:          every_turns={args.every_turns}, every_chars={args.every_chars}, "
+          f"confirm_n={args.confirm_n}, final_threshold={args.final_threshold}")
+    print(f"   - 總樣本數 (N):      {len(results)} (詐騙 {len(fraud)} / 正常 {len(normal)})")
+    print(f"   - 詐騙偵測率:        {len(detected) / max(1, len(fraud)):.4f}")
+    print(f"   - 提早結案比例:      {len(early) / max(1, len(fraud)):.4f}")
+    if detect_frac:
+        print(f"   - 平均攔截位置:      通話進行到 {sum(detect_frac) / len(detect_frac):.1%}")
+    print(f"   - 正常通話誤報率:    {len(false_alarm) / max(1, len(normal)):.4f}")
+    print(f"   - 模型呼叫次數:      {n_calls} (平均每通 {n_calls / max(1, len(results)):.2f} 次)")
+    print("=" * 80)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p_make = sub.add_parser("make", help="產生截短版本的測試集")
+    p_make.add_argument("--input", default="./real_data/test.jsonl")
+    p_make.add_argument("--cut-pcts", type=int, nargs="+", default=[25, 50, 75])
+    p_make.add_argument("--out-dir", default="./real_data/truncated")
+    p_make.add_argument("--prompt", choices=sorted(PROMPTS), default="full", help="prompt 版本 (prompts.py)")
+
+    p_replay = sub.add_parser("replay", help="逐句重播並模擬提早結案")
+    p_replay.add_argument("--input", default="./real_data/test.jsonl")
+    p_replay.add_argument("--url", default="http://localhost:8000/v1/chat/completions")
+    p_replay.add_argument("--model", default="scam-8b-sft")
+    p_replay.add_argument("--prompt", choices=sorted(PROMPTS), default="full", help="prompt 版本 (prompts.py)")
+    p_replay.add_argument("--profile", choices=profile_names(), default="auto", help="模型 profile (model_profiles.py)")
+    p_replay.add_argument("--every-turns", type=int, default=2)
+    p_replay.add_argument("--every-chars", type=int, default=0)
+    p_replay.add_argument("--confirm-n", type=int, default=1)
+    p_replay.add_argument("--threshold", type=float, default=0.5, help="判為 True 的機率門檻")
+    p_replay.add_argument("--final-threshold", type=float, default=0.9, help="提早結案的機率門檻")
+    p_replay.add_argument("--concurrency", type=int, default=32)
+    p_replay.add_argument("--output", default=None, help="逐筆結果 JSONL (選用)")
+
+    args = parser.parse_args()
+    if args.cmd == "make":
+        make_truncated(args.input, args.cut_pcts, args.out_dir, args.prompt)
+    else:
+        asyncio.run(replay(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional
+
+
+class StreamSession:
+    """
+    一通進行中的通話。逐句接收逐字稿，累積到一定的句數或字數才重新評分，
+    一旦詐騙機率連續 confirm_n 次超過 final_threshold 就結束 (final)，之後不再送模型。
+
+    對話一律以 "\\n" 往後串接，舊的內容一個 byte 都不會變，
+    因此每次重新評分時 SYSTEM_PROMPT + 前面的句子都能命中 vLLM 的 prefix cache，
+    只需要 prefill 新增的那幾句。
+
+    參數:
+    every_turns (int): 每累積幾句重新評分一次 (0 = 不看句數)
+    every_chars (int): 每累積幾個字元重新評分一次 (0 = 不看字數)
+    confirm_n (int): 連續幾次達到門檻才視為確定 (early exit)
+    final_threshold (float): 詐騙機率門檻；後端沒回機率時改以判定為 True 計算
+    """
+
+    def __init__(
+        self,
+        every_turns: int = 2,
+        every_chars: int = 0,
+        confirm_n: int = 1,
+        final_threshold: float = 0.9,
+    ):
+        self.id = uuid.uuid4().hex
+        self.every_turns = every_turns
+        self.every_chars = every_chars
+        self.confirm_n = max(1, confirm_n)
+        self.final_threshold = final_threshold
+
+        self.turns: List[str] = []
+        self.verdict: Optional[str] = None
+        self.fraud_prob: Optional[float] = None
+        self.final = False
+        self.n_scored = 0
+        self.fraud_streak = 0
+        self.final_at_turn: Optional[int] = None
+
+        self._turns_since = 0
+        self._chars_since = 0
+        self.last_seen = time.monotonic()
+        # 同一通電話的評分要排隊，避免兩批句子同時觸發重複評分
+        self.lock = asyncio.Lock()
+
+    @property
+    def text(self) -> str:
+        return "\n".join(self.turns)
+
+    def add_turns(self, turns: Iterable[str]) -> bool:
+        """加入新的句子，回傳這次是否該重新評分。"""
+        self.last_seen = time.monotonic()
+        for t in turns:
+            t = t.strip()
+            if not t:
+                continue
+            self.turns.append(t)
+            self._turns_since += 1
+            self._chars_since += len(t) + 1
+        return self.rescore_due()
+
+    def rescore_due(self) -> bool:
+        if self.final or self._turns_since == 0:
+            return False
+        if self.every_turns and self._turns_since >= self.every_turns:
+            return True
+        if self.every_chars and self._chars_since >= self.every_chars:
+            return True
+        return not self.every_turns and not self.every_chars
+
+    def has_unscored(self) -> bool:
+        return not self.final and self._turns_since > 0
+
+    def record(self, verdict: str, fraud_prob: Optional[float] = None) -> bool:
+        """記錄一次評分結果，回傳是否已經可以下最終判定。"""
+        self._turns_since = 0
+        self._chars_since = 0
+        self.n_scored += 1
+        self.verdict = verdict
+        self.fraud_prob = fraud_prob
+
+        if fraud_prob is not None:
+            confident = fraud_prob >= self.final_threshold
+        else:
+            confident = verdict == "True"
+        self.fraud_streak = self.fraud_streak + 1 if confident else 0
+        if self.fraud_streak >= self.confirm_n:
+            self.final = True
+            self.final_at_turn = len(self.turns)
+        return self.final
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "session_id": self.id,
+            "turns": len(self.turns),
+            "verdict": self.verdict,
+            "fraud_prob": self.fraud_prob,
+            "final": self.final,
+            "n_scored": self.n_scored,
+            "final_at_turn": self.final_at_turn,
+        }
+
+
+class SessionStore:
+    """保存進行中的 session；超過 idle_s 沒有新句子或數量超過上限就丟掉最舊的。"""
+
+    def __init__(self, max_sessions: int = 10000, idle_s: float = 1800.0):
+        self.max_sessions = max_sessions
+        self.idle_s = idle_s
+        self._sessions: "OrderedDict[str, StreamSession]" = OrderedDict()
+
+    def create(self, **kwargs: Any) -> StreamSession:
+        self._expire()
+        s = StreamSession(**kwargs)
+        self._sessions[s.id] = s
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+        return s
+
+    def get(self, session_id: str) -> Optional[StreamSession]:
+        s = self._sessions.get(session_id)
+        if s is not None:
+            self._sessions.move_to_end(session_id)
+        return s
+
+    def pop(self, session_id: str) -> Optional[StreamSession]:
+        return self._sessions.pop(session_id, None)
+
+    def _expire(self) -> None:
+        cutoff = time.monotonic() - self.idle_s
+        stale = [sid for sid, s in self._sessions.items() if s.last_seen < cutoff]
+        for sid in stale:
+            del self._sessions[sid]
+
+    def __len__(self) -> int:
+        return len(self._sessions)
@@ -0,0 +1,207 @@
+"""
+一次讀入結果檔，掃描 DWA 對「判定門檻 × ALPHA_COST × BETA_COST × 長度衰減指數」的變化。
+
+分數 (fraud_prob 或 logprobs) 只排序一次，每個門檻下「抓到的詐騙權重」與「放行的正常權重」
+都由累積和 + searchsorted 取得；alpha / beta 只是這兩個量的線性組合，整個網格一次算完。
+長度衰減權重為 max(0, 1 - L / max_len) ** gamma，gamma=1 即原本的 DWA。
+
+沒有機率分數的檔案 (swift infer 沒開 --logprobs) 會以 0/1 預測當分數，門檻只有兩種效果。
+
+輸出 (--out-dir):
+- dwa_curve.csv:  gamma, alpha, beta, threshold, dwa, accuracy, tpr, fpr
+- roc.csv:        gamma, threshold, tpr, fpr, weighted_tpr, weighted_fpr (依長度權重加權的 ROC)
+- summary.json:   每組 (gamma, alpha, beta) 的最佳門檻、最佳 DWA、門檻 0.5 時的 DWA 與 AUC
+
+python sweep_eval.py ./inference_data/app_test_results.jsonl --alphas 1 2 4 --betas 1 --out-dir ./sweeps/app_test
+"""
+import argparse
+import csv
+import itertools
+import json
+import os
+from typing import Any, Dict, List
+
+import numpy as np
+
+from evaluation import ALPHA_COST, BETA_COST, PARSERS, UNPARSED, load_results
+
+
+def length_weights(lengths, gamma: float = 1.0) -> np.ndarray:
+    L = np.asarray(lengths, dtype=np.float64)
+    if L.size == 0:
+        return L
+    return np.maximum(0.0, 1.0 - L / (L.max() + 1e-9)) ** gamma
+
+
+class SortedScores:
+    """
+    依分數排序一次；門檻 t 時 score >= t 判為詐騙。
+    沒有分數 (NaN) 的樣本在任何門檻下都算答錯，但仍計入分母。
+
+    參數:
+    scores, labels: 每筆的詐騙機率與標籤 (1 / 0 / UNPARSED)
+    weights: 每筆的長度衰減權重
+    """
+
+    def __init__(self, scores, labels, weights):
+        scores = np.asarray(scores, dtype=np.float64)
+        labels = np.asarray(labels)
+        weights = np.asarray(weights, dtype=np.float64)
+        fraud = labels == 1
+        normal = labels == 0
+        valid = ~np.isnan(scores)
+        order = np.argsort(scores[valid], kind='stable')
+        self.sorted = scores[valid][order]
+
+        def cum(x):
+            return np.concatenate([[0.0], np.cumsum(x[valid][order])])
+
+        self.cum_fraud_w = cum(np.where(fraud, weights, 0.0))
+        self.cum_normal_w = cum(np.where(normal, weights, 0.0))
+        self.cum_fraud_n = cum(fraud.astype(np.float64))
+        self.cum_normal_n = cum(normal.astype(np.float64))
+
+        # 分母：詐騙樣本與「非詐騙」樣本 (標籤無法解析的也以 beta 計) 的總權重
+        self.fraud_w = float(weights[fraud].sum())
+        self.other_w = float(weights[~fraud].sum())
+        self.n = int(labels.shape[0])
+        self.n_fraud = int(fraud.sum())
+        self.n_normal = int(normal.sum())
+
+    def at(self, thresholds) -> Dict[str, np.ndarray]:
+        """每個門檻的 TP / TN 權重和與個數"""
+        i = np.searchsorted(self.sorted, np.asarray(thresholds, dtype=np.float64), side='left')
+        return {
+            "tp_w": self.cum_fraud_w[-1] - self.cum_fraud_w[i],
+            "tn_w": self.cum_normal_w[i],
+            "fp_w": self.cum_normal_w[-1] - self.cum_normal_w[i],
+            "tp": self.cum_fraud_n[-1] - self.cum_fraud_n[i],
+            "tn": self.cum_normal_n[i],
+            "fp": self.cum_normal_n[-1] - self.cum_normal_n[i],
+        }
+
+    def dwa(self, thresholds, alphas, betas) -> np.ndarray:
+        """回傳 shape (門檻數, alpha 數, beta 數) 的 DWA"""
+        c = self.at(thresholds)
+        a = np.asarray(alphas, dtype=np.float64)[None, :, None]
+        b = np.asarray(betas, dtype=np.float64)[None, None, :]
+        num = a * c["tp_w"][:, None, None] + b * c["tn_w"][:, None, None]
+        denom = a * self.fraud_w + b * self.other_w
+        return np.divide(num, denom, out=np.zeros_like(num), where=denom > 0)
+
+    def candidate_thresholds(self) -> np.ndarray:
+        # 在所有不同的分數 (以及高於最大分數) 上取門檻，就涵蓋所有可能的判定結果
+        uniq = np.unique(self.sorted)
+        return np.concatenate([uniq, [np.nextafter(uniq[-1], np.inf) if uniq.size else 1.0]])
+
+
+def _auc(fpr: np.ndarray, tpr: np.ndarray) -> float:
+    order = np.lexsort((tpr, fpr))
+    x, y = fpr[order], tpr[order]
+    return float(np.sum(np.diff(x) * (y[1:] + y[:-1]) / 2.0))
+
+
+def sweep(data, thresholds, alphas, betas, gammas, default_threshold: float = 0.5):
+    lengths, preds, labels = data.numpy()
+    scores = data.scores_numpy()
+    if not data.has_scores():
+        scores = np.where(preds == UNPARSED, np.nan, preds.astype(np.float64))
+
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    curve_rows: List[List[Any]] = []
+    roc_rows: List[List[Any]] = []
+    summary: List[Dict[str, Any]] = []
+    for gamma in gammas:
+        ss = SortedScores(scores, labels, length_weights(lengths, gamma))
+        c = ss.at(thresholds)
+        tpr = c["tp"] / max(1, ss.n_fraud)
+        fpr = c["fp"] / max(1, ss.n_normal)
+        wtpr = c["tp_w"] / ss.fraud_w if ss.fraud_w else np.zeros_like(tpr)
+        normal_w = ss.cum_normal_w[-1]
+        wfpr = c["fp_w"] / normal_w if normal_w else np.zeros_like(fpr)
+        acc = (c["tp"] + c["tn"]) / max(1, ss.n)
+        for row in zip(thresholds, tpr, fpr, wtpr, wfpr):
+            roc_rows.append([gamma, *row])
+
+        grid = ss.dwa(thresholds, alphas, betas)
+        cand = ss.candidate_thresholds()
+        best_grid = ss.dwa(cand, alphas, betas)
+        at_default = ss.dwa([default_threshold], alphas, betas)[0]
+        full = ss.at(cand)
+        auc = _auc(full["fp"] / max(1, ss.n_normal), full["tp"] / max(1, ss.n_fraud))
+        wauc = _auc(full["fp_w"] / (normal_w or 1.0), full["tp_w"] / (ss.fraud_w or 1.0))
+
+        for (ai, a), (bi, b) in itertools.product(enumerate(alphas), enumerate(betas)):
+            for ti, t in enumerate(thresholds):
+                curve_rows.append([gamma, a, b, t, grid[ti, ai, bi], acc[ti], tpr[ti], fpr[ti]])
+            k = int(np.argmax(best_grid[:, ai, bi]))
+            summary.append({
+                "gamma": gamma, "alpha": a, "beta": b,
+                "best_threshold": float(cand[k]),
+                "best_dwa": float(best_grid[k, ai, bi]),
+                "dwa_at_default": float(at_default[ai, bi]),
+                "auc": auc,
+                "weighted_auc": wauc,
+            })
+    return curve_rows, roc_rows, summary
+
+
+def _write_csv(path: str, header, rows) -> None:
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        w = csv.writer(f)
+        w.writerow(header)
+        w.writerows(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="推論結果 JSONL")
+    parser.add_argument("--parser", default="auto", choices=["auto"] + sorted(PARSERS))
+    parser.add_argument("--alphas", type=float, nargs="+", default=[ALPHA_COST])
+    parser.add_argument("--betas", type=float, nargs="+", default=[BETA_COST])
+    parser.add_argument("--gammas", type=float, nargs="+", default=[1.0], help="長度衰減指數")
+    parser.add_argument("--n-thresholds", type=int, default=101, help="曲線在 [0, 1] 上取幾個等距門檻")
+    parser.add_argument("--all-thresholds", action="store_true", help="曲線改用所有出現過的分數當門檻")
+    parser.add_argument("--default-threshold", type=float, default=0.5)
+    parser.add_argument("--out-dir", default=None, help="曲線與摘要的輸出資料夾")
+    parser.add_argument("--columnar", action="store_true", help="從 columnar.py 的欄位快取讀取")
+    args = parser.parse_args()
+
+    data = load_results(args.path, args.parser, verbose=False, columnar=args.columnar)
+    if len(data) == 0:
+        print("沒有讀取到有效資料。")
+        return
+    if not data.has_scores():
+        print("⚠️  檔案沒有機率分數 (fraud_prob / logprobs)，以 0/1 預測當分數。")
+
+    if args.all_thresholds:
+        scores = data.scores_numpy()
+        thresholds = np.unique(scores[~np.isnan(scores)]) if data.has_scores() else np.array([0.0, 1.0])
+    else:
+        thresholds = np.linspace(0.0, 1.0, args.n_thresholds)
+    curve, roc, summary = sweep(data, thresholds, args.alphas, args.betas, args.gammas, args.default_threshold)
+
+    print("=" * 80)
+    print(f"📈 DWA 掃描: {args.path} (N={len(data)}, parser={data.parser})")
+    print("-" * 80)
+    print(f"{'gamma':>6}{'alpha':>7}{'beta':>7}{'best thr':>11}{'best DWA':>11}"
+          f"{'DWA@' + str(args.default_threshold):>11}{'AUC':>8}{'wAUC':>8}")
+    for r in summary:
+        print(f"{r['gamma']:>6.2f}{r['alpha']:>7.2f}{r['beta']:>7.2f}{r['best_threshold']:>11.4f}"
+              f"{r['best_dwa']:>11.4f}{r['dwa_at_default']:>11.4f}{r['auc']:>8.4f}{r['weighted_auc']:>8.4f}")
+    print("=" * 80)
+
+    if args.out_dir:
+        os.makedirs(args.out_dir, exist_ok=True)
+        _write_csv(os.path.join(args.out_dir, "dwa_curve.csv"),
+                   ["gamma", "alpha", "beta", "threshold", "dwa", "accuracy", "tpr", "fpr"], curve)
+        _write_csv(os.path.join(args.out_dir, "roc.csv"),
+                   ["gamma", "threshold", "tpr", "fpr", "weighted_tpr", "weighted_fpr"], roc)
+        with open(os.path.join(args.out_dir, "summary.json"), 'w', encoding='utf-8') as f:
+            json.dump({"path": args.path, "n": len(data), "parser": data.parser, "sweep": summary},
+                      f, ensure_ascii=False, indent=2)
+        print(f"Wrote: {args.out_dir}/dwa_curve.csv, roc.csv, summary.json")
+
+
+if __name__ == "__main__":
+    main()
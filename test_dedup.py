@@ -0,0 +1,36 @@
+"""
+dedup.py 的 LSH 候選比對：同一段相同 band key 內，真正的近似重複不是第一筆時也要找得到。
+
+python -m pytest -q test_dedup.py
+"""
+import numpy as np
+
+from dedup import DedupIndex, cluster
+
+
+def _sigs(seed: int = 0):
+    # threshold 0.7 -> 16 bands × 8 rows；near 和 base 只在 band 0 完全相同，其餘每個 band 差一個位置
+    rng = np.random.default_rng(seed)
+    base = rng.integers(0, 2 ** 32, size=128, dtype=np.uint32)
+    near = base.copy()
+    near[8::8] ^= np.uint32(1)  # 相似度 113 / 128
+    other = rng.integers(0, 2 ** 32, size=128, dtype=np.uint32)
+    other[:8] = base[:8]        # 同一個 band 0 key，但內容不相似
+    return base, near, other
+
+
+def test_query_checks_whole_bucket():
+    base, near, other = _sigs()
+    index = DedupIndex(threshold=0.7)
+    assert (index.bands, index.rows) == (16, 8)
+    index.add(np.stack([other, near]), split="train", batch="b")  # 不相似的排在同一段的最前面
+    match, sim = index.query(base[None])
+    assert match[0] == 1
+    assert sim[0] > 0.85
+
+
+def test_cluster_links_members_behind_unrelated_anchor():
+    base, near, other = _sigs(1)
+    labels = cluster(np.stack([other, base, near]), threshold=0.7)
+    assert labels[0] == 0
+    assert labels[2] == 1
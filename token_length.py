@@ -0,0 +1,334 @@
+"""
+以 tokenizer 計算對話長度，並把超過模型長度的對話截到 token 預算內。
+
+vLLM 以 --vllm_max_model_len 4096 (token) 啟動，但資料集原本用 MAX_CHARS = 4500 (字元) 過濾：
+字元數合格的對話仍可能超長，token 數很短的對話卻被丟掉。這裡提供兩邊共用的長度計算：
+- TokenCounter: 讀本機快取的 tokenizer (local_files_only，不連網)，批次編碼、token 數以 LRU 記憶
+  沒有 transformers / tokenizers 或本機沒有快取時，退回以 chars_per_token 估算 (偏保守)
+- conversation_budget: 扣掉 system prompt、指令與 chat template 後，對話本身能用的 token 數
+- fit: 依策略把對話放進預算
+  filter     超過就丟棄 (資料集用)
+  head       保留開頭的句子
+  recent     保留最近的句子 (即時通話的詐騙徵兆通常在後段)
+  head_tail  保留開頭約 1/3 預算 + 最近的句子，中間以 "..." 標示
+
+python token_length.py "./real_data/*.jsonl" "./syn_data/*.jsonl" --max-model-len 4096 \\
+    --tokenizer meta-llama/Llama-3.1-8B-Instruct
+"""
+import argparse
+import glob
+import hashlib
+import json
+import math
+import os
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+
+
+DEFAULT_TOKENIZER = os.getenv("TOKENIZER_PATH", "meta-llama/Llama-3.1-8B-Instruct")
+CHARS_PER_TOKEN = 3.0          # 估算模式；英文對話實際約 4 字元 / token，取小一點寧可多截
+TEMPLATE_BASE_TOKENS = 32      # 估算模式下 chat template 的固定開銷 (Llama 3.1 會在 system 前加日期等)
+TEMPLATE_TOKENS_PER_MESSAGE = 5
+HEAD_FRACTION = 1 / 3
+ELLIPSIS = "..."
+POLICIES = ("filter", "head", "recent", "head_tail")
+
+
+def _load_tokenizer(name_or_path: str) -> Tuple[Optional[Any], str]:
+    # 用到時才 import：transformers 很慢，而 evaluation.py 等只需要估算或根本用不到
+    try:
+        from transformers import AutoTokenizer
+        return AutoTokenizer.from_pretrained(name_or_path, local_files_only=True), "hf"
+    except (ImportError, OSError, ValueError):
+        pass
+    # 沒裝 transformers 時改試 tokenizers (只吃 tokenizer.json)，再不行就估算
+    try:
+        from tokenizers import Tokenizer
+        if os.path.isfile(name_or_path):
+            return Tokenizer.from_file(name_or_path), "tokenizers"
+    except ImportError:
+        pass
+    return None, "estimate"
+
+
+class TokenCounter:
+    """
+    token 數計算 (不含 BOS 等特殊 token)，結果以內容 hash 為 key 做 LRU 記憶。
+
+    參數:
+    name_or_path: HF 模型名稱 / 本機資料夾，或 tokenizer.json 路徑
+    chars_per_token: 沒有 tokenizer 時的估算比例
+    cache_size: 記憶的筆數，0 表示不記憶
+    """
+
+    def __init__(self, name_or_path: str = DEFAULT_TOKENIZER, chars_per_token: float = CHARS_PER_TOKEN,
+                 cache_size: int = 100_000):
+        self.name = name_or_path
+        self.chars_per_token = chars_per_token
+        self.tokenizer, self.backend = _load_tokenizer(name_or_path) if name_or_path else (None, "estimate")
+        self.cache_size = cache_size
+        self._memo: "OrderedDict[bytes, int]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def exact(self) -> bool:
+        return self.backend != "estimate"
+
+    def _count_uncached(self, texts: Sequence[str]) -> List[int]:
+        if not texts:
+            return []
+        if self.backend == "hf":
+            return [len(ids) for ids in self.tokenizer(list(texts), add_special_tokens=False)["input_ids"]]
+        if self.backend == "tokenizers":
+            return [len(e.ids) for e in self.tokenizer.encode_batch(list(texts), add_special_tokens=False)]
+        return [math.ceil(len(t) / self.chars_per_token) for t in texts]
+
+    def count_batch(self, texts: Sequence[str]) -> List[int]:
+        """批次計算；只有沒記憶到的才送去編碼 (fast tokenizer 會一次平行編碼整批)"""
+        if not self.cache_size:
+            return self._count_uncached(texts)
+        keys = [hashlib.blake2b(t.encode("utf-8"), digest_size=16).digest() for t in texts]
+        out: List[Optional[int]] = [None] * len(texts)
+        miss_idx = []
+        for i, k in enumerate(keys):
+            n = self._memo.get(k)
+            if n is None:
+                miss_idx.append(i)
+            else:
+                self._memo.move_to_end(k)
+                out[i] = n
+        self.hits += len(texts) - len(miss_idx)
+        self.misses += len(miss_idx)
+        # 同一批裡重複的文字也只算一次
+        uniq: Dict[bytes, str] = {}
+        for i in miss_idx:
+            uniq.setdefault(keys[i], texts[i])
+        counted = dict(zip(uniq, self._count_uncached(list(uniq.values()))))
+        for i in miss_idx:
+            out[i] = counted[keys[i]]
+        for k, n in counted.items():
+            self._memo[k] = n
+        while len(self._memo) > self.cache_size:
+            self._memo.popitem(last=False)
+        return out
+
+    def count(self, text: str) -> int:
+        return self.count_batch([text])[0]
+
+    def chat_tokens(self, messages: List[Dict[str, str]]) -> int:
+        """整段 chat prompt (含 template 與 assistant 開頭) 的 token 數"""
+        if self.backend == "hf" and getattr(self.tokenizer, "chat_template", None):
+            return len(self.tokenizer.apply_chat_template(messages, add_generation_prompt=True, tokenize=True))
+        counts = self.count_batch([m.get("content", "") for m in messages])
+        return sum(counts) + TEMPLATE_BASE_TOKENS + TEMPLATE_TOKENS_PER_MESSAGE * (len(messages) + 1)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "tokenizer": self.name,
+            "backend": self.backend,
+            "memo_entries": len(self._memo),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+_COUNTERS: Dict[Tuple[str, float], TokenCounter] = {}
+
+
+def get_counter(name_or_path: str = DEFAULT_TOKENIZER, chars_per_token: float = CHARS_PER_TOKEN) -> TokenCounter:
+    # 每個 process 只載入一次 tokenizer (資料集的 worker process 也會用到)
+    key = (name_or_path, chars_per_token)
+    if key not in _COUNTERS:
+        _COUNTERS[key] = TokenCounter(name_or_path, chars_per_token)
+    return _COUNTERS[key]
+
+
+def conversation_budget(counter: TokenCounter, max_model_len: int, empty_messages: List[Dict[str, str]],
+                        max_new_tokens: int = 1, margin: int = 8) -> int:
+    """
+    對話本身可用的 token 數。
+
+    參數:
+    empty_messages: 對話填空字串時的 system + user messages
+    max_new_tokens: 生成長度 (分類只要 1 個 token)
+    margin: 保留的餘裕；估算模式下再多留 5%
+    """
+    overhead = counter.chat_tokens(empty_messages)
+    budget = max_model_len - overhead - max_new_tokens - margin
+    if not counter.exact:
+        budget = int(budget * 0.95)
+    return max(0, budget)
+
+
+def _cut(counter: TokenCounter, text: str, budget: int, from_end: bool) -> str:
+    # 單一句子就超過預算時，二分搜尋字元位置 (不記憶，避免塞滿 memo)
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        piece = text[-mid:] if from_end else text[:mid]
+        if counter._count_uncached([piece])[0] <= budget:
+            lo = mid
+        else:
+            hi = mid - 1
+    if not lo:
+        return ""
+    return text[-lo:] if from_end else text[:lo]
+
+
+def _take(turns: List[str], counts: List[int], budget: int, from_end: bool) -> int:
+    # 從一端開始能放進 budget 的句數 (每個換行算 1 個 token)
+    used, k = 0, 0
+    order = range(len(turns) - 1, -1, -1) if from_end else range(len(turns))
+    for i in order:
+        cost = counts[i] + (1 if k else 0)
+        if used + cost > budget:
+            break
+        used += cost
+        k += 1
+    return k
+
+
+def _assemble(turns: List[str], counts: List[int], budget: int, policy: str, marker_tokens: int) -> str:
+    if policy == "head":
+        return "\n".join(turns[:_take(turns, counts, budget, False)])
+    if policy == "recent":
+        k = _take(turns, counts, budget, True)
+        return "\n".join(turns[len(turns) - k:]) if k else ""
+    # head_tail
+    head_k = _take(turns, counts, int(budget * HEAD_FRACTION), False)
+    rest = budget - (sum(counts[:head_k]) + head_k) - marker_tokens - 1
+    tail_turns, tail_counts = turns[head_k:], counts[head_k:]
+    tail_k = _take(tail_turns, tail_counts, max(0, rest), True)
+    if head_k + tail_k == len(turns):
+        return "\n".join(turns)
+    if not head_k and not tail_k:
+        return ""
+    tail = tail_turns[len(tail_turns) - tail_k:] if tail_k else []
+    return "\n".join(turns[:head_k] + [ELLIPSIS] + tail)
+
+
+def fit(counter: TokenCounter, text: str, budget: int, policy: str = "head_tail") -> Tuple[Optional[str], int, bool]:
+    """
+    把對話放進 budget 個 token 內；以「句」(換行) 為單位取捨，單句就超長時才切到句子中間。
+
+    回傳:
+    (對話或 None (filter 策略且超長), 結果的 token 數, 是否有截斷)
+    """
+    if policy not in POLICIES:
+        raise ValueError(f"unknown length policy: {policy!r} (choices: {', '.join(POLICIES)})")
+    n = counter.count(text)
+    if n <= budget:
+        return text, n, False
+    if policy == "filter":
+        return None, n, False
+
+    turns = [t for t in text.split("\n") if t.strip()]
+    counts = counter.count_batch(turns)
+    marker_tokens = counter.count(ELLIPSIS)
+    # 分句計數加總和整段編碼會差幾個 token，超過就把差額從預算扣掉再組一次
+    slack = 0
+    for _ in range(4):
+        out = _assemble(turns, counts, budget - slack, policy, marker_tokens)
+        m = counter.count(out) if out else 0
+        if out and m <= budget:
+            return out, m, True
+        if not out:
+            break
+        slack += m - budget
+    out = _cut(counter, text, budget, from_end=policy != "head")
+    return out, counter.count(out) if out else 0, True
+
+
+def length_report(counter: TokenCounter, texts: Sequence[str], budget: int, max_chars: int) -> Dict[str, Any]:
+    """各種長度策略各保留幾筆、截斷幾筆；和舊的字元過濾比較"""
+    counts = counter.count_batch(texts)
+    fits = [n <= budget for n in counts]
+    char_ok = [len(t) <= max_chars for t in texts]
+    report: Dict[str, Any] = {
+        "n": len(texts),
+        "budget_tokens": budget,
+        "backend": counter.backend,
+        "chars_filter_kept": sum(char_ok),
+        "chars_pass_but_overflow": sum(c and not f for c, f in zip(char_ok, fits)),
+        "chars_drop_but_fit": sum(f and not c for c, f in zip(char_ok, fits)),
+        "policies": {},
+    }
+    over = [t for t, f in zip(texts, fits) if not f]
+    for policy in POLICIES:
+        if policy == "filter":
+            report["policies"][policy] = {"kept": sum(fits), "truncated": 0, "tokens_removed": 0}
+            continue
+        removed = 0
+        kept = sum(fits)
+        for t in over:
+            out, m, _ = fit(counter, t, budget, policy)
+            if out:
+                kept += 1
+                removed += counter.count(t) - m
+        report["policies"][policy] = {"kept": kept, "truncated": len(over), "tokens_removed": removed}
+    s = sorted(counts)
+    report["token_quantiles"] = {f"p{q}": s[min(len(s) - 1, int(len(s) * q / 100))] if s else 0
+                                 for q in (50, 90, 99, 100)}
+    return report
+
+
+def main():
+    from convert_to_swift_jsonl import MAX_CHARS, build_record, extract_conversation
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="資料集 JSONL (可用 glob)；原始 {dialogue} 或 messages 格式皆可")
+    parser.add_argument("--tokenizer", default=DEFAULT_TOKENIZER)
+    parser.add_argument("--chars-per-token", type=float, default=CHARS_PER_TOKEN, help="沒有 tokenizer 時的估算比例")
+    parser.add_argument("--max-model-len", type=int, default=4096)
+    parser.add_argument("--max-chars", type=int, default=MAX_CHARS, help="對照用的舊字元過濾")
+    parser.add_argument("--output", default=None, help="報告 JSON")
+    args = parser.parse_args()
+
+    texts = []
+    for pattern in args.paths:
+        for path in sorted(glob.glob(pattern)):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        ex = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    d = ex["dialogue"] if isinstance(ex.get("dialogue"), str) else extract_conversation(ex)
+                    if d.strip():
+                        texts.append(d)
+    if not texts:
+        raise SystemExit("沒有讀到任何對話")
+
+    counter = TokenCounter(args.tokenizer, args.chars_per_token)
+    budget = conversation_budget(counter, args.max_model_len, build_record("", 0, 0)["messages"][:2])
+    r = length_report(counter, texts, budget, args.max_chars)
+
+    print("=" * 80)
+    print(f"📏 長度策略比較 (N={r['n']}, tokenizer={counter.name}, backend={counter.backend})")
+    if not counter.exact:
+        print(f"⚠️  本機沒有 tokenizer，以 {args.chars_per_token} 字元 / token 估算")
+    print(f"   - 對話 token 預算:        {budget} (max_model_len {args.max_model_len})")
+    q = r["token_quantiles"]
+    print(f"   - 對話 token 數:          p50={q['p50']}  p90={q['p90']}  p99={q['p99']}  max={q['p100']}")
+    print(f"   - 字元過濾 (<= {args.max_chars}):  保留 {r['chars_filter_kept']}")
+    print(f"   - 字元合格但超過預算:     {r['chars_pass_but_overflow']}")
+    print(f"   - 字元超長但放得下:       {r['chars_drop_but_fit']}")
+    print("-" * 80)
+    print(f"{'policy':<12}{'kept':>10}{'kept %':>10}{'truncated':>12}{'tokens removed':>18}")
+    for policy, p in r["policies"].items():
+        print(f"{policy:<12}{p['kept']:>10}{p['kept'] / r['n']:>10.2%}{p['truncated']:>12}{p['tokens_removed']:>18}")
+    print("=" * 80)
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(r, f, ensure_ascii=False, indent=2)
+        print(f"Wrote: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import re
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+
+_WS_RE = re.compile(r"[ \t\f\v]+")
+
+
+def normalize_conversation(text: str) -> str:
+    """統一換行、壓縮行內空白、去掉空行；只差在空白的重送會得到同一個 key。"""
+    lines = text.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    lines = (_WS_RE.sub(" ", ln).strip() for ln in lines)
+    return "\n".join(ln for ln in lines if ln)
+
+
+class _DiskStore:
+    """
+    sqlite 後端，讓同一台機器上的多個 uvicorn worker (或掛同一個 volume 的容器)
+    共用快取；記憶體 LRU 沒命中時才會查這裡。
+
+    所有呼叫都在 VerdictCache 專用的單一 thread 上執行 (寫入鎖被別的 worker 佔住時
+    最多等 busy timeout，不能卡住 event loop)；過期的資料由 purge 定期刪除。
+    """
+
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS verdicts "
+            "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS verdicts_expires_at ON verdicts (expires_at)")
+
+    def get(self, key: str, now: float) -> Optional[Tuple[Any, float]]:
+        row = self._conn.execute(
+            "SELECT value, expires_at FROM verdicts WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        if row[1] <= now:
+            self._conn.execute("DELETE FROM verdicts WHERE key = ?", (key,))
+            return None
+        return json.loads(row[0]), row[1]
+
+    def put(self, key: str, value: Any, expires_at: float) -> None:
+        self._conn.execute(
+            "INSERT OR REPLACE INTO verdicts (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value, ensure_ascii=False), expires_at),
+        )
+
+    def purge(self, now: float) -> int:
+        return self._conn.execute("DELETE FROM verdicts WHERE expires_at <= ?", (now,)).rowcount
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+class VerdictCache:
+    """
+    以對話內容雜湊為 key 的判定快取 (LRU + TTL)。
+    同一個 key 同時有多筆請求時，只有第一筆會真的去算，其餘等同一個結果。
+
+    參數:
+    max_entries (int): 記憶體內最多保留幾筆 (超過就淘汰最久沒用的)
+    ttl_s (float): 每筆的存活秒數
+    disk_path (str | None): 選用的 sqlite 檔案路徑
+    purge_interval_s (float): 多久刪一次 sqlite 中過期的資料 (在寫入時順便排進 sqlite 的 thread)
+    """
+
+    def __init__(self, max_entries: int, ttl_s: float, disk_path: Optional[str] = None,
+                 purge_interval_s: float = 60.0):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.purge_interval_s = purge_interval_s
+        self._mem: "OrderedDict[str, Tuple[Any, float]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._disk = _DiskStore(disk_path) if disk_path else None
+        # sqlite 連線只在這個 thread 上使用，呼叫依序執行
+        self._io = ThreadPoolExecutor(max_workers=1, thread_name_prefix="verdict-cache") if self._disk else None
+        self._next_purge = time.monotonic()
+        self.purged = 0
+        self.disk_errors = 0
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(text: str, *scope: str) -> str:
+        h = hashlib.sha256()
+        for part in scope:
+            h.update(part.encode("utf-8"))
+            h.update(b"\x00")
+        h.update(normalize_conversation(text).encode("utf-8"))
+        return h.hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        """只查記憶體 (不會碰 sqlite)"""
+        entry = self._mem.get(key)
+        if entry is not None:
+            if entry[1] > time.monotonic():
+                self._mem.move_to_end(key)
+                return entry[0]
+            del self._mem[key]
+        return None
+
+    async def _get_disk(self, key: str) -> Optional[Any]:
+        wall_now = time.time()
+        try:
+            found = await asyncio.get_running_loop().run_in_executor(self._io, self._disk.get, key, wall_now)
+        except sqlite3.Error:
+            self.disk_errors += 1
+            return None
+        if found is None:
+            return None
+        value, expires_at_wall = found
+        self._store_mem(key, value, time.monotonic() + (expires_at_wall - wall_now))
+        return value
+
+    def put(self, key: str, value: Any) -> None:
+        self._store_mem(key, value, time.monotonic() + self.ttl_s)
+        if self._disk is not None:
+            # 寫入不等結果；回應不用等 sqlite 的寫入鎖
+            self._io.submit(self._disk_write, key, value, time.time() + self.ttl_s)
+
+    def _disk_write(self, key: str, value: Any, expires_at: float) -> None:
+        # 在 sqlite 的 thread 上執行
+        try:
+            self._disk.put(key, value, expires_at)
+            if time.monotonic() >= self._next_purge:
+                self._next_purge = time.monotonic() + self.purge_interval_s
+                self.purged += self._disk.purge(time.time())
+        except sqlite3.Error:
+            self.disk_errors += 1
+
+    def _store_mem(self, key: str, value: Any, expires_at: float) -> None:
+        self._mem[key] = (value, expires_at)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_entries:
+            self._mem.popitem(last=False)
+            self.evictions += 1
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            # 用獨立的 task 去查 sqlite / 計算，第一個呼叫者斷線時其他等待者不受影響
+            task = asyncio.ensure_future(self._lookup_or_compute(key, compute))
+            self._inflight[key] = task
+        return await asyncio.shield(task)
+
+    async def _lookup_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            if self._disk is not None:
+                value = await self._get_disk(key)
+                if value is not None:
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return value
+            self.misses += 1
+            value = await compute()
+            self.put(key, value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    def close(self) -> None:
+        if self._disk is not None:
+            self._io.shutdown(wait=True)  # 先把排隊中的寫入做完
+            self._disk.close()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._mem),
+            "max_entries": self.max_entries,
+            "ttl_s": self.ttl_s,
+            "disk": self._disk is not None,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "purged": self.purged,
+            "disk_errors": self.disk_errors,
+            "hit_rate": ((self.hits + self.coalesced) / lookups) if lookups else 0.0,
+        }
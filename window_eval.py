@@ -0,0 +1,185 @@
+"""
+長對話視窗模式 (windowing.py、app.py 的 WINDOW_RULE) 的離線評估。
+
+挑出目前會被濾掉的長對話 (超過 --min-chars，預設與 convert_to_swift_jsonl.MAX_CHARS 相同)，
+每筆以兩種做法打 OpenAI 相容端點：
+- truncate: 依 --policy 截到 token 預算內，送一次 (app.py 預設的做法)
+- windows:  切成重疊的視窗全部評分，依 any / max / recency 合併；early stop 依視窗順序模擬
+            (遇到機率 >= --early-stop 的視窗就判 True、不再看後面的視窗)，並統計省下的請求數
+每種做法寫一個 evaluation.py 格式的結果檔 (messages 內是完整對話，DWA 的長度權重與配對都以原文計算)，
+再以 paired bootstrap 比較各合併規則與 truncate 的 DWA。
+
+python window_eval.py --input ./real_data/test.jsonl --url http://localhost:8000/v1/chat/completions
+python window_eval.py --input ./real_data/train.jsonl ./real_data/val.jsonl --window-tokens 1024 --rules any recency
+"""
+import argparse
+import asyncio
+import json
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from confidence import fraud_probability
+from convert_to_swift_jsonl import MAX_CHARS, extract_conversation, read_jsonl, record_label, write_jsonl
+from evaluation import compute_metrics, load_results, paired_test
+from model_profiles import get_profile, profile_names
+from prompts import PROMPTS, get_prompt
+from token_length import CHARS_PER_TOKEN, DEFAULT_TOKENIZER, conversation_budget, fit, get_counter
+from windowing import RULES, combine, split_windows
+
+
+async def score_texts(texts: List[str], args) -> Dict[str, Tuple[str, Optional[float]]]:
+    """每段文字送一次 (重複的只送一次)，回傳 {文字: (判定, 機率)}"""
+    prompt = get_prompt(args.prompt)
+    profile = get_profile(args.profile, args.model)
+    sem = asyncio.Semaphore(args.concurrency)
+
+    async def one(client, text: str) -> Tuple[str, Optional[float]]:
+        payload = {
+            "model": args.model,
+            "messages": prompt.messages(text),
+            "max_tokens": 1,
+            "temperature": 0,
+            "logprobs": True,
+            "top_logprobs": 5,
+            **profile.request_params(),
+        }
+        async with sem:
+            r = await client.post(args.url, json=payload)
+        r.raise_for_status()
+        choice = r.json().get("choices", [{}])[0]
+        raw = profile.verdict(choice.get("message", {}).get("content", "")) or "False"
+        return raw, fraud_probability(choice)
+
+    unique = list(dict.fromkeys(texts))
+    async with httpx.AsyncClient(timeout=180.0) as client:
+        results = await asyncio.gather(*(one(client, t) for t in unique))
+    return dict(zip(unique, results))
+
+
+def _decide(raw: str, p: Optional[float], threshold: float) -> str:
+    if p is None:
+        return raw
+    return "True" if p >= threshold else "False"
+
+
+def _record(prompt, conversation: str, ex: Dict[str, Any], response: str, p: Optional[float],
+            **extra: Any) -> Dict[str, Any]:
+    out = {
+        "messages": prompt.messages(conversation),
+        "response": response,
+        "labels": "True" if record_label(ex) == 1 else "False",
+        **extra,
+    }
+    if p is not None:
+        out["fraud_prob"] = p
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--input", nargs="+", default=["./real_data/test.jsonl"], help="messages 格式的資料")
+    parser.add_argument("--min-chars", type=int, default=MAX_CHARS, help="只評估超過此長度的對話")
+    parser.add_argument("--url", default="http://localhost:8000/v1/chat/completions")
+    parser.add_argument("--model", default="scam-8b-sft")
+    parser.add_argument("--prompt", choices=sorted(PROMPTS), default="full", help="prompt 版本 (prompts.py)")
+    parser.add_argument("--profile", choices=profile_names(), default="auto", help="模型 profile (model_profiles.py)")
+    parser.add_argument("--max-model-len", type=int, default=4096, help="與 vLLM 的設定相同")
+    parser.add_argument("--window-tokens", type=int, default=0, help="每個視窗的 token 上限 (0 = 依 --max-model-len 計算)")
+    parser.add_argument("--overlap-turns", type=int, default=2)
+    parser.add_argument("--max-windows", type=int, default=8)
+    parser.add_argument("--policy", choices=["head", "recent", "head_tail"], default="head_tail", help="truncate 的截斷方式")
+    parser.add_argument("--rules", nargs="+", choices=RULES, default=list(RULES))
+    parser.add_argument("--decay", type=float, default=0.7, help="recency 規則的權重衰減")
+    parser.add_argument("--early-stop", type=float, default=0.95)
+    parser.add_argument("--threshold", type=float, default=0.5, help="判為 True 的機率門檻")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--tokenizer", default=DEFAULT_TOKENIZER, help="本機快取的 tokenizer 名稱或路徑")
+    parser.add_argument("--chars-per-token", type=float, default=CHARS_PER_TOKEN, help="沒有 tokenizer 時的估算比例")
+    parser.add_argument("--output-dir", default="./inference_data/windows")
+    parser.add_argument("--bootstrap", type=int, default=1000, help="paired bootstrap 次數")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    prompt = get_prompt(args.prompt)
+    counter = get_counter(args.tokenizer, args.chars_per_token)
+    budget = args.window_tokens or conversation_budget(counter, args.max_model_len, prompt.messages(""))
+
+    total = 0
+    items = []
+    for path in args.input:
+        for ex in read_jsonl(path):
+            total += 1
+            conversation = extract_conversation(ex)
+            if len(conversation) > args.min_chars:
+                items.append((ex, conversation))
+    if not items:
+        parser.error(f"沒有超過 {args.min_chars} 字元的對話")
+
+    plans = []
+    for ex, conversation in items:
+        truncated, _, _ = fit(counter, conversation, budget, args.policy)
+        windows = split_windows(counter, conversation, budget, args.overlap_turns, args.max_windows)
+        plans.append((ex, conversation, truncated, windows))
+    scores = asyncio.run(score_texts([p[2] for p in plans] + [w for p in plans for w in p[3]], args))
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    rows: Dict[str, List[Dict[str, Any]]] = {"truncate": []}
+    rows.update({rule: [] for rule in args.rules})
+    n_windows = n_scored = 0
+    for ex, conversation, truncated, windows in plans:
+        raw, p = scores[truncated]
+        rows["truncate"].append(_record(prompt, conversation, ex, _decide(raw, p, args.threshold), p))
+        window_scores = [scores[w] for w in windows]
+        stop = next((i for i, (_, wp) in enumerate(window_scores) if wp is not None and wp >= args.early_stop), None)
+        n_windows += len(windows)
+        n_scored += len(windows) if stop is None else stop + 1
+        for rule in args.rules:
+            if stop is not None:
+                response, p = "True", window_scores[stop][1]
+            else:
+                raw, p = combine(window_scores, rule, args.decay)
+                response = _decide(raw, p, args.threshold)
+            rows[rule].append(_record(prompt, conversation, ex, response, p,
+                                      windows=len(windows), early_stop=stop is not None))
+
+    paths = {}
+    for name, records in rows.items():
+        paths[name] = os.path.join(args.output_dir, f"long_{name if name == 'truncate' else 'windows_' + name}.jsonl")
+        write_jsonl(records, paths[name])
+    data = {name: load_results(p, verbose=False, keep_keys=True) for name, p in paths.items()}
+
+    n = len(plans)
+    multi = sum(len(p[3]) > 1 for p in plans)
+    summary: Dict[str, Any] = {
+        "inputs": args.input, "min_chars": args.min_chars, "budget_tokens": budget, "n": n, "total": total,
+        "split": multi, "windows": n_windows, "windows_scored": n_scored, "results": {},
+    }
+    print("=" * 80)
+    print(f"🪟 長對話視窗評估: {n} 筆 > {args.min_chars} chars (共 {total} 筆), "
+          f"token 預算 {budget} ({counter.backend})")
+    print(f"   - 需切視窗:      {multi} 筆, 平均 {n_windows / n:.2f} 個視窗, 最多 {max(len(p[3]) for p in plans)} 個")
+    print(f"   - 請求數:        truncate {n}, windows {n_windows}, early stop 後 {n_scored} "
+          f"(省 {1 - n_scored / max(1, n_windows):.1%})")
+    print("-" * 80)
+    for name in rows:
+        m = compute_metrics(data[name])
+        entry = {"file": paths[name], "dwa": m["dwa"], "accuracy": m["accuracy"], "recall": m["recall"]}
+        line = f"   - {name + ':':<10} DWA {m['dwa']:.4f}  acc {m['accuracy']:.4f}  recall {m['recall']:.4f}"
+        if name != "truncate":
+            r = paired_test(data["truncate"], data[name], args.bootstrap, seed=args.seed)
+            lo, hi = r["dwa_diff_ci"]
+            entry.update(dwa_diff=r["dwa_diff"], dwa_diff_ci=[lo, hi], dwa_p_value=r["dwa_p_value"])
+            line += f"  Δ {r['dwa_diff']:+.4f} [{lo:+.4f}, {hi:+.4f}] p={r['dwa_p_value']:.3f}"
+        summary["results"][name] = entry
+        print(line)
+    print("=" * 80)
+    out_path = os.path.join(args.output_dir, "summary.json")
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    print(f"Wrote: {out_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+超過模型長度的長對話：切成以「句」對齊、前後重疊的視窗分別評分，再把各視窗的結果合併成一個判定。
+
+截斷 (token_length.fit) 一定會丟掉一部分通話，而長通話往往正是詐騙 (先閒聊建立信任、後段才要錢)。
+視窗模式每一段都看得到，代價是多幾次 (可同批送出的) 請求：
+- split_windows: 依 token 預算貪婪地把連續的句子裝進視窗，相鄰視窗重疊 overlap_turns 句
+- combine: 合併規則
+    any      任一視窗是詐騙的機率 (noisy-OR：1 - Π(1 - p))，沒有機率時任一視窗判 True 即 True
+    max      各視窗機率取最大
+    recency  越後面的視窗權重越大 (權重 decay^(距最後一個視窗幾個))，適合「後段才露出意圖」的通話
+- 有任一視窗的機率 >= early_stop 時即可提早結案 (呼叫端取消其餘視窗)
+
+app.py (WINDOW_RULE) 與 window_eval.py 共用。
+"""
+from typing import List, Optional, Sequence, Tuple
+
+from token_length import TokenCounter, fit
+
+RULES = ("any", "max", "recency")
+
+
+def _spread(n: int, k: int) -> List[int]:
+    # 從 n 個視窗平均挑 k 個 (含頭尾)
+    if k >= n:
+        return list(range(n))
+    if k == 1:
+        return [n - 1]
+    return sorted({round(i * (n - 1) / (k - 1)) for i in range(k)})
+
+
+def split_windows(counter: TokenCounter, text: str, budget: int, overlap_turns: int = 2,
+                  max_windows: int = 0) -> List[str]:
+    """
+    參數:
+    budget: 每個視窗 (只算對話本身) 的 token 上限，與截斷用的預算相同
+    overlap_turns: 相鄰視窗重疊的句數，避免關鍵的一問一答剛好被切開
+    max_windows: 視窗數上限 (0 = 不限)；超過時平均挑選，保留第一段與最後一段
+
+    回傳:
+    視窗文字 (依通話順序)；整段放得進 budget 時只有一個視窗
+    """
+    if counter.count(text) <= budget:
+        return [text]
+    turns = [t for t in text.split("\n") if t.strip()]
+    counts = counter.count_batch(turns)
+    windows = []
+    start = 0
+    while start < len(turns):
+        end, used = start, 0
+        while end < len(turns) and used + counts[end] + 1 <= budget:  # +1: 換行
+            used += counts[end] + 1
+            end += 1
+        if end == start:
+            # 單句就超過預算：只取這句的開頭
+            piece, _, _ = fit(counter, turns[start], budget, "head")
+            windows.append(piece)
+            start += 1
+            continue
+        # 分句加總與整段編碼可能差幾個 token，超過就少放一句
+        while end - start > 1 and counter.count("\n".join(turns[start:end])) > budget:
+            end -= 1
+        windows.append("\n".join(turns[start:end]))
+        if end >= len(turns):
+            break
+        start = max(start + 1, end - overlap_turns)
+    if max_windows > 0 and len(windows) > max_windows:
+        windows = [windows[i] for i in _spread(len(windows), max_windows)]
+    return windows
+
+
+def combine(scores: Sequence[Tuple[str, Optional[float]]], rule: str = "any",
+            decay: float = 0.7) -> Tuple[str, Optional[float]]:
+    """
+    參數:
+    scores: 依視窗順序的 (判定 "True"/"False", 詐騙機率或 None)
+
+    回傳:
+    (判定, 合併後的機率)；有視窗沒有機率時，any / max 只回傳判定，recency 以判定當 0 / 1 計算
+    """
+    if rule not in RULES:
+        raise ValueError(f"unknown window rule: {rule!r} (choices: {', '.join(RULES)})")
+    raws = [r for r, _ in scores]
+    raw_any = "True" if "True" in raws else "False"
+    probs = [p for _, p in scores]
+    if any(p is None for p in probs):
+        if rule != "recency":
+            return raw_any, None
+        probs = [1.0 if r == "True" else 0.0 for r in raws]
+    if rule == "any":
+        q = 1.0
+        for p in probs:
+            q *= 1.0 - p
+        return raw_any, 1.0 - q
+    if rule == "max":
+        return raw_any, max(probs)
+    n = len(probs)
+    weights = [decay ** (n - 1 - i) for i in range(n)]
+    p = sum(w * x for w, x in zip(weights, probs)) / sum(weights)
+    return ("True" if p >= 0.5 else "False"), p